@@ -42,6 +42,7 @@ from pitivi.shortcuts import show_shortcuts
 from pitivi.undo.project import ProjectObserver
 from pitivi.undo.undo import UndoableActionLog
 from pitivi.utils import loggable
+from pitivi.utils.discovery import DiscoveryCache
 from pitivi.utils.loggable import Loggable
 from pitivi.utils.misc import path_from_uri
 from pitivi.utils.misc import quote_uri
@@ -145,6 +146,7 @@ class Pitivi(Gtk.Application, Loggable):
         self.threads = ThreadMaster()
         self.effects = EffectsManager()
         self.proxy_manager = ProxyManager(self)
+        DiscoveryCache.get().install()
         self.system = get_system()
         self.plugin_manager = PluginManager(self)
 
@@ -238,6 +240,7 @@ class Pitivi(Gtk.Application, Loggable):
             self.gui.destroy()
         self.threads.stopAllThreads()
         self.settings.storeSettings()
+        DiscoveryCache.get().flush()
         self.quit()
         return True
 
@@ -282,11 +285,13 @@ class Pitivi(Gtk.Application, Loggable):
                     raise e
                 pass
             self.recent_manager.add_item(uri)
-        self.action_log = UndoableActionLog()
+        self.action_log = UndoableActionLog(self.settings.undoMaxOperations,
+                                            self.settings.undoMaxSize)
         self.action_log.connect("pre-push", self._action_log_pre_push_cb)
         self.action_log.connect("commit", self._actionLogCommit)
         self.action_log.connect("move", self._action_log_move_cb)
         self.project_observer = ProjectObserver(project, self.action_log)
+        self.project_manager.start_journal(self.action_log)
 
     def __project_saved_cb(self, unused_project_manager, unused_project, uri):
         if uri:
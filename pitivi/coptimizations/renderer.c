@@ -1,22 +1,161 @@
 #include <Python.h>
 #include <stdio.h>
+#include <string.h>
 #include <cairo.h>
 #include <py3cairo.h>
 #include <gst/gst.h>
 
 static GObjectClass * gobject_class;
 
+/*
+ * The samples to draw, either a list of floats or an object supporting
+ * the buffer protocol, such as a NumPy array of float32 or float64, which
+ * is read without copying.
+ */
+typedef struct
+{
+  PyObject *list;
+  Py_buffer view;
+  gboolean is_double;
+  /* The number of items. */
+  Py_ssize_t length;
+  /* The distance between two items in view, in bytes. */
+  Py_ssize_t item_stride;
+} Samples;
+
+static gboolean
+samples_init (Samples * samples, PyObject * obj)
+{
+  const char *format;
+
+  memset (samples, 0, sizeof (Samples));
+
+  if (PyList_Check (obj)) {
+    samples->list = obj;
+    samples->length = PyList_GET_SIZE (obj);
+    return TRUE;
+  }
+
+  if (PyObject_GetBuffer (obj, &samples->view, PyBUF_STRIDES | PyBUF_FORMAT) < 0)
+    return FALSE;
+
+  format = samples->view.format;
+  if (*format == '@' || *format == '=' ||
+      (G_BYTE_ORDER == G_LITTLE_ENDIAN && *format == '<') ||
+      (G_BYTE_ORDER == G_BIG_ENDIAN && *format == '>'))
+    format++;
+
+  if (!strcmp (format, "d")) {
+    samples->is_double = TRUE;
+  } else if (!strcmp (format, "f")) {
+    samples->is_double = FALSE;
+  } else {
+    PyErr_Format (PyExc_TypeError,
+        "The samples must be float32 or float64, not %s", samples->view.format);
+    PyBuffer_Release (&samples->view);
+    return FALSE;
+  }
+
+  if (samples->view.ndim == 1) {
+    samples->length = samples->view.shape[0];
+    samples->item_stride = samples->view.strides[0];
+  } else if (PyBuffer_IsContiguous (&samples->view, 'C')) {
+    /* Multi-dimensional buffers are seen as flat. */
+    samples->length = samples->view.len / samples->view.itemsize;
+    samples->item_stride = samples->view.itemsize;
+  } else {
+    PyErr_SetString (PyExc_ValueError,
+        "The samples must be one-dimensional or C-contiguous");
+    PyBuffer_Release (&samples->view);
+    return FALSE;
+  }
+
+  return TRUE;
+}
+
+static void
+samples_release (Samples * samples)
+{
+  if (!samples->list)
+    PyBuffer_Release (&samples->view);
+}
+
+/*
+ * Releases the GIL while reading a buffer, so the samples can be drawn
+ * in a thread without blocking the others. Lists need the GIL.
+ */
+static inline PyThreadState *
+samples_allow_threads (Samples * samples)
+{
+  return samples->list ? NULL : PyEval_SaveThread ();
+}
+
+static inline void
+samples_end_allow_threads (PyThreadState * state)
+{
+  if (state)
+    PyEval_RestoreThread (state);
+}
+
+/* Must be followed by a PyErr_Occurred () check when using a list. */
+static inline double
+samples_get (Samples * samples, Py_ssize_t index)
+{
+  const char *item;
+
+  if (samples->list)
+    return PyFloat_AsDouble (PyList_GET_ITEM (samples->list, index));
+
+  item = (const char *) samples->view.buf + index * samples->item_stride;
+  if (samples->is_double)
+    return *(const double *) item;
+  return *(const float *) item;
+}
+
+/*
+ * Checks the items offset + i * stride, for i in [0, count[ exist.
+ * A negative count means as many items as possible.
+ */
+static gboolean
+samples_check_range (Samples * samples, Py_ssize_t offset, Py_ssize_t stride,
+    Py_ssize_t * count)
+{
+  if (offset < 0 || stride < 1) {
+    PyErr_SetString (PyExc_ValueError,
+        "The offset must be positive and the stride at least 1");
+    return FALSE;
+  }
+
+  if (*count < 0)
+    *count = offset < samples->length ?
+        (samples->length - offset + stride - 1) / stride : 0;
+
+  if (*count > 0 && offset + (*count - 1) * stride >= samples->length) {
+    PyErr_SetString (PyExc_IndexError, "The samples range is out of bounds");
+    return FALSE;
+  }
+
+  return TRUE;
+}
+
 /*
  * This function must be called with a range of samples, and a desired
  * width and height.
  * It will average samples if needed.
+ *
+ * The samples drawn are samples[offset + i * stride], for i in [0, count[,
+ * so a column of a NumPy array can be drawn without slicing it.
  */
 static PyObject *
-py_fill_surface (PyObject * self, PyObject * args)
+py_fill_surface (PyObject * self, PyObject * args, PyObject * kwargs)
 {
-  PyObject *samples;
-  PyObject *sampleObj;
-  int length, i;
+  static char *kwlist[] = { "samples", "width", "height", "offset", "stride",
+    "count", NULL
+  };
+  PyObject *samplesObj;
+  Samples samples;
+  Py_ssize_t offset = 0, stride = 1, count = -1;
+  Py_ssize_t i;
   double sample;
   cairo_surface_t *surface;
   cairo_t *ctx;
@@ -26,12 +165,21 @@ py_fill_surface (PyObject * self, PyObject * args)
   int samplesInAccum;
   float x = 0.;
   double accum;
+  PyThreadState *state;
+
+  if (!PyArg_ParseTupleAndKeywords (args, kwargs, "Oii|nnn", kwlist,
+          &samplesObj, &width, &height, &offset, &stride, &count))
+    return NULL;
 
-  if (!PyArg_ParseTuple (args, "O!ii", &PyList_Type, &samples, &width, &height))
+  if (!samples_init (&samples, samplesObj))
     return NULL;
 
-  length = PyList_Size (samples);
+  if (!samples_check_range (&samples, offset, stride, &count)) {
+    samples_release (&samples);
+    return NULL;
+  }
 
+  state = samples_allow_threads (&samples);
   surface = cairo_image_surface_create (CAIRO_FORMAT_ARGB32, width, height);
 
   ctx = cairo_create (surface);
@@ -40,20 +188,20 @@ py_fill_surface (PyObject * self, PyObject * args)
   cairo_set_line_width (ctx, 0.5);
   cairo_move_to (ctx, 0, height);
 
-  pixelsPerSample = width / (float) length;
+  pixelsPerSample = count ? width / (float) count : 0;
   currentPixel = 0.;
   samplesInAccum = 0;
   accum = 0.;
 
-  for (i = 0; i < length; i++) {
-    /* Guaranteed to return something */
-    sampleObj = PyList_GetItem (samples, i);
-    sample = PyFloat_AsDouble (sampleObj);
+  for (i = 0; i < count; i++) {
+    sample = samples_get (&samples, offset + i * stride);
 
-    /* If the object was not a float or convertible to float */
-    if (PyErr_Occurred ()) {
-      cairo_surface_finish (surface);
-      Py_DECREF (samples);
+    /* If the object was not a float or convertible to float.
+     * Only lists can fail, and they are read with the GIL. */
+    if (samples.list && PyErr_Occurred ()) {
+      cairo_destroy (ctx);
+      cairo_surface_destroy (surface);
+      samples_release (&samples);
       return NULL;
     }
 
@@ -70,16 +218,119 @@ py_fill_surface (PyObject * self, PyObject * args)
     x += pixelsPerSample;
   }
 
-  Py_DECREF (samples);
   cairo_line_to (ctx, width, height);
   cairo_close_path (ctx);
   cairo_fill_preserve (ctx);
+  cairo_destroy (ctx);
+  samples_end_allow_threads (state);
+  samples_release (&samples);
+
+  return PycairoSurface_FromSurface (surface, NULL);
+}
+
+/*
+ * Draws the min/max envelope of the audio, centered vertically.
+ *
+ * The min and max values, in percents of the full scale, are
+ * samples[min_offset + i * stride] and samples[max_offset + i * stride],
+ * for i in [0, count[.
+ */
+static PyObject *
+py_fill_envelope (PyObject * self, PyObject * args, PyObject * kwargs)
+{
+  static char *kwlist[] = { "samples", "width", "height", "min_offset",
+    "max_offset", "stride", "count", NULL
+  };
+  PyObject *samplesObj;
+  Samples samples;
+  Py_ssize_t min_offset = 0, max_offset = 0, stride = 1, count = -1;
+  Py_ssize_t max_count;
+  Py_ssize_t i, start, end;
+  double *mins, *maxs;
+  double value;
+  cairo_surface_t *surface;
+  cairo_t *ctx;
+  int width, height;
+  int x;
+  PyThreadState *state;
+
+  if (!PyArg_ParseTupleAndKeywords (args, kwargs, "Oii|nnnn", kwlist,
+          &samplesObj, &width, &height, &min_offset, &max_offset, &stride,
+          &count))
+    return NULL;
+
+  if (width < 0) {
+    PyErr_SetString (PyExc_ValueError, "The width must be positive");
+    return NULL;
+  }
+
+  if (!samples_init (&samples, samplesObj))
+    return NULL;
+
+  max_count = count;
+  if (!samples_check_range (&samples, min_offset, stride, &count) ||
+      !samples_check_range (&samples, max_offset, stride, &max_count)) {
+    samples_release (&samples);
+    return NULL;
+  }
+  count = MIN (count, max_count);
+
+  /* The min and max values for each pixel column. */
+  mins = g_new (double, width + 1);
+  maxs = g_new (double, width + 1);
+  state = samples_allow_threads (&samples);
+  for (x = 0; x < width && count > 0; x++) {
+    start = x * count / width;
+    end = MAX (start + 1, (x + 1) * count / width);
+    mins[x] = G_MAXDOUBLE;
+    maxs[x] = -G_MAXDOUBLE;
+    for (i = start; i < end; i++) {
+      value = samples_get (&samples, min_offset + i * stride);
+      mins[x] = MIN (mins[x], value);
+      value = samples_get (&samples, max_offset + i * stride);
+      maxs[x] = MAX (maxs[x], value);
+    }
+
+    if (samples.list && PyErr_Occurred ()) {
+      g_free (mins);
+      g_free (maxs);
+      samples_release (&samples);
+      return NULL;
+    }
+  }
+  samples_end_allow_threads (state);
+  samples_release (&samples);
+
+  Py_BEGIN_ALLOW_THREADS;
+  surface = cairo_image_surface_create (CAIRO_FORMAT_ARGB32, width, height);
+  ctx = cairo_create (surface);
+  cairo_set_source_rgb (ctx, 0.2, 0.6, 0.0);
+  cairo_set_line_width (ctx, 0.5);
+
+  if (count > 0 && width > 0) {
+    /* The upper edge from left to right, then the lower edge back. */
+    cairo_move_to (ctx, 0, height / 2. - maxs[0] * height / 200.);
+    for (x = 0; x < width; x++)
+      cairo_line_to (ctx, x + 1, height / 2. - maxs[x] * height / 200.);
+    for (x = width - 1; x >= 0; x--)
+      cairo_line_to (ctx, x + 1, height / 2. - mins[x] * height / 200.);
+    cairo_line_to (ctx, 0, height / 2. - mins[0] * height / 200.);
+    cairo_close_path (ctx);
+    cairo_fill_preserve (ctx);
+  }
+
+  cairo_destroy (ctx);
+  g_free (mins);
+  g_free (maxs);
+  Py_END_ALLOW_THREADS;
 
   return PycairoSurface_FromSurface (surface, NULL);
 }
 
 static PyMethodDef renderer_methods[] = {
-  {"fill_surface", py_fill_surface, METH_VARARGS},
+  {"fill_surface", (PyCFunction) py_fill_surface, METH_VARARGS | METH_KEYWORDS},
+  {"fill_envelope", (PyCFunction) py_fill_envelope,
+      METH_VARARGS | METH_KEYWORDS},
   {NULL, NULL}
 };
 
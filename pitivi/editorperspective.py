@@ -24,6 +24,7 @@ from urllib.parse import unquote
 from gi.repository import Gdk
 from gi.repository import GES
 from gi.repository import Gio
+from gi.repository import Gst
 from gi.repository import Gtk
 
 from pitivi.clipproperties import ClipProperties
@@ -40,8 +41,10 @@ from pitivi.tabsmanager import BaseTabs
 from pitivi.timeline.timeline import TimelineContainer
 from pitivi.titleeditor import TitleEditor
 from pitivi.transitions import TransitionsListWidget
+from pitivi.utils.export import ExportMode
 from pitivi.utils.loggable import Loggable
 from pitivi.utils.misc import path_from_uri
+from pitivi.utils.ui import beautify_ETA
 from pitivi.utils.ui import beautify_time_delta
 from pitivi.utils.ui import EDITOR_PERSPECTIVE_CSS
 from pitivi.utils.ui import info_name
@@ -416,15 +419,33 @@ class EditorPerspective(Perspective, Loggable):
         return self.app.project_manager.revertToSavedProject()
 
     def __export_project_cb(self, unused_action, unused_param):
-        uri = self._showExportDialog(self.app.project_manager.current_project)
-        result = None
+        uri, mode = self._showExportDialog(self.app.project_manager.current_project)
+        exporter = None
         if uri:
-            result = self.app.project_manager.exportProject(
-                self.app.project_manager.current_project, uri)
+            exporter = self.app.project_manager.exportProject(
+                self.app.project_manager.current_project, uri, mode)
 
-        if not result:
+        if not exporter:
             self.log("Project couldn't be exported")
-        return result
+            return False
+
+        exporter.connect("progress", self.__export_progress_cb)
+        exporter.connect("exported", self.__exported_cb)
+        self.headerbar.set_subtitle(_("Exporting project…"))
+        return True
+
+    def __export_progress_cb(self, unused_exporter, fraction, remaining):
+        subtitle = _("Exporting project: %d%%") % (fraction * 100)
+        if remaining:
+            subtitle += " — " + _("%s left") % beautify_ETA(remaining * Gst.SECOND)
+        self.headerbar.set_subtitle(subtitle)
+
+    def __exported_cb(self, unused_exporter, failure):
+        if failure:
+            self.error("Project couldn't be exported: %s", failure)
+            self.headerbar.set_subtitle(_("Exporting the project failed"))
+        else:
+            self.headerbar.set_subtitle(None)
 
     def __project_settings_cb(self, unused_action, unused_param):
         self.showProjectSettingsDialog()
@@ -705,6 +726,15 @@ class EditorPerspective(Perspective, Loggable):
         default.add_pattern("*")
         chooser.add_filter(default)
 
+        mode_combo = Gtk.ComboBoxText()
+        mode_combo.append(str(ExportMode.ALL), _("Include the media files"))
+        mode_combo.append(str(ExportMode.PROXIES),
+                          _("Include the proxies instead of the media files"))
+        mode_combo.append(str(ExportMode.USED_RANGES),
+                          _("Include only the used parts of the media files"))
+        mode_combo.set_active_id(str(ExportMode.ALL))
+        chooser.set_extra_widget(mode_combo)
+
         response = chooser.run()
         if response == Gtk.ResponseType.OK:
             self.log("User chose a URI to export project to")
@@ -712,10 +742,10 @@ class EditorPerspective(Perspective, Loggable):
             # which escapes all /'s in path!
             uri = "file://" + chooser.get_filename()
             self.log("uri: %s", uri)
-            ret = uri
+            ret = uri, int(mode_combo.get_active_id())
         else:
             self.log("User didn't choose a URI to export project to")
-            ret = None
+            ret = None, None
 
         chooser.destroy()
         return ret
@@ -18,6 +18,7 @@
 # License along with this program; if not, write to the
 # Free Software Foundation, Inc., 51 Franklin St, Fifth Floor,
 # Boston, MA 02110-1301, USA.
+import functools
 import os
 import time
 from gettext import gettext as _
@@ -715,6 +716,7 @@ class MediaLibraryWidget(Gtk.Box, Loggable):
         project.connect("asset-loading-progress", self._assetLoadingProgressCb)
         project.connect("asset-removed", self._assetRemovedCb)
         project.connect("error-loading-asset", self._errorCreatingAssetCb)
+        project.connect("import-progress", self.__import_progress_cb)
         project.connect("proxying-error", self._proxyingErrorCb)
         project.connect("settings-set-from-imported-asset", self.__projectSettingsSetFromImportedAssetCb)
 
@@ -866,6 +868,11 @@ class MediaLibraryWidget(Gtk.Box, Loggable):
         if progress == 100:
             self._doneImporting()
 
+    def __import_progress_cb(self, unused_project, imported, total):
+        text = ngettext("Imported %d of %d file",
+                        "Imported %d of %d files", total) % (imported, total)
+        self._progressbar.set_text(text)
+
     def __assetProxyingCb(self, proxy, unused_pspec):
         if not self.app.proxy_manager.is_proxy_asset(proxy):
             self.info("Proxy is not a proxy in our terms (handling deleted proxy"
@@ -1393,6 +1400,7 @@ class MediaLibraryWidget(Gtk.Box, Loggable):
         self._project.disconnect_by_func(self._assetRemovedCb)
         self._project.disconnect_by_func(self._proxyingErrorCb)
         self._project.disconnect_by_func(self._errorCreatingAssetCb)
+        self._project.disconnect_by_func(self.__import_progress_cb)
         self._project.disconnect_by_func(self.__projectSettingsSetFromImportedAssetCb)
 
     def _new_project_loading_cb(self, unused_project_manager, project):
@@ -1418,19 +1426,21 @@ class MediaLibraryWidget(Gtk.Box, Loggable):
         self.storemodel.clear()
         self._project = None
 
-    def __paths_walked_cb(self, uris):
-        """Handles the end of the path walking when importing files and dirs."""
-        if not uris:
-            return
+    def __paths_walked_cb(self, uris, merge_key):
+        """Handles a batch of files found when importing files and dirs."""
         if not self._project:
             self.warning("Cannot add URIs, project missing")
-        self._last_imported_uris = set(uris)
-        assets = self._project.assetsForUris(uris)
-        if assets:
-            # All the files have already been added.
-            self._selectLastImportedUris()
-        else:
-            self._project.addUris(uris)
+            return
+        if not uris:
+            # The search is finished.
+            if not self._project.loading_assets:
+                # Nothing is being imported, otherwise the files are
+                # selected when the import is done.
+                self._selectLastImportedUris()
+            return
+        self._last_imported_uris.update(uris)
+        if not self._project.assetsForUris(uris):
+            self._project.addUris(uris, merge_key=merge_key)
 
     def _drag_data_received_cb(self, unused_widget, unused_context, unused_x,
                                unused_y, selection, targettype, unused_time):
@@ -1440,7 +1450,11 @@ class MediaLibraryWidget(Gtk.Box, Loggable):
         uris = selection.get_uris()
         # Scan in the background what was dragged and
         # import whatever can be imported.
-        self.app.threads.addThread(PathWalker, uris, self.__paths_walked_cb)
+        # The batches are undone at once.
+        merge_key = object()
+        callback = functools.partial(self.__paths_walked_cb, merge_key=merge_key)
+        self.app.threads.addThread(PathWalker, uris, callback,
+                                   SUPPORTED_MIMETYPES)
 
     # Used with TreeView and IconView
     def _dndDragDataGetCb(self, unused_view, unused_context, data, unused_info, unused_timestamp):
@@ -18,11 +18,12 @@
 # Free Software Foundation, Inc., 51 Franklin St, Fifth Floor,
 # Boston, MA 02110-1301, USA.
 """Project related classes."""
+import collections
 import datetime
 import os
 import pwd
 import shutil
-import tarfile
+import tempfile
 import time
 import uuid
 from gettext import gettext as _
@@ -47,7 +48,14 @@ from pitivi.settings import get_dir
 from pitivi.settings import xdg_cache_home
 from pitivi.timeline.previewers import ThumbnailCache
 from pitivi.undo.project import AssetAddedIntention
+from pitivi.undo.journal import UndoJournal
 from pitivi.undo.project import AssetProxiedIntention
+from pitivi.utils.discovery import DiscoveryCache
+from pitivi.utils.export import ExportMode
+from pitivi.utils.export import find_used_ranges
+from pitivi.utils.export import MediaCut
+from pitivi.utils.export import ProjectExporter
+from pitivi.utils.export import rewrite_project_uris
 from pitivi.utils.loggable import Loggable
 from pitivi.utils.misc import fixate_caps_with_default_values
 from pitivi.utils.misc import isWritable
@@ -56,7 +64,10 @@ from pitivi.utils.misc import quote_uri
 from pitivi.utils.misc import scale_pixbuf
 from pitivi.utils.misc import unicode_error_dialog
 from pitivi.utils.pipeline import Pipeline
+from pitivi.utils.proxy import get_proxy_target
+from pitivi.utils.proxy import ProxyTierSwitcher
 from pitivi.utils.ripple_update_group import RippleUpdateGroup
+from pitivi.utils.threads import Thread
 from pitivi.utils.ui import audio_channels
 from pitivi.utils.ui import audio_rates
 from pitivi.utils.ui import beautify_time_delta
@@ -94,6 +105,65 @@ SCALED_THUMB_HEIGHT = 54
 SCALED_THUMB_DIR = "96x54"
 ORIGINAL_THUMB_DIR = "original"
 
+# The delay before saving a backup when all the changes are journaled,
+# in seconds.
+JOURNALED_BACKUP_DELAY = 300
+
+# How many media files are discovered at the same time when importing.
+IMPORT_MAX_DISCOVERIES = 4
+
+
+class BackupWriter(Thread):
+    """Writes a serialized project to a backup file, atomically.
+
+    Attributes:
+        content (bytes): The serialized project.
+        path (str): The path of the backup file.
+        journal_path (str): Where to prepare a journal starting from the
+            project, or None.
+        journal_marker (int): The position in the journal when the project
+            has been serialized, or None if the prepared journal is obsolete.
+        callback (function): Called in the main thread when done.
+        snapshot_duration (float): How long serializing the project took,
+            in seconds.
+        written (int): The number of bytes written.
+        duration (float): How long the writing took, in seconds.
+        failure (OSError): The error which occurred, if any.
+    """
+
+    def __init__(self, content, path, journal_path, journal_marker, callback,
+                 snapshot_duration=0):
+        Thread.__init__(self)
+        self.content = content
+        self.path = path
+        self.journal_path = journal_path
+        self.journal_marker = journal_marker
+        self.callback = callback
+        self.snapshot_duration = snapshot_duration
+        self.written = 0
+        self.duration = 0
+        self.failure = None
+
+    def process(self):
+        start = time.time()
+        tmp_path = self.path + ".tmp"
+        try:
+            with open(tmp_path, "wb") as backup:
+                backup.write(self.content)
+                backup.flush()
+                os.fsync(backup.fileno())
+            os.replace(tmp_path, self.path)
+            self.written = len(self.content)
+
+            if self.journal_path:
+                content = self.content.decode("utf-8")
+                UndoJournal.prepare(self.journal_path, content)
+                self.written += os.path.getsize(self.journal_path)
+        except OSError as e:
+            self.failure = e
+        self.duration = time.time() - start
+        GLib.idle_add(self.callback, self)
+
 
 class ProjectManager(GObject.Object, Loggable):
     """The project manager.
@@ -129,10 +199,18 @@ class ProjectManager(GObject.Object, Loggable):
         self._backup_lock = 0
         self.exitcode = 0
         self.__start_loading_time = 0
+        self.__journal = None
+        self.__journaled_backup_id = 0
+        self.__backup_writer = None
+        self.__exporters = set()
 
     def _tryUsingBackupFile(self, uri):
         backup_path = self._makeBackupURI(path_from_uri(uri))
+        journal_path = self._makeJournalURI(path_from_uri(uri))
         use_backup = False
+        if has_validate and UndoJournal.has_operations(journal_path):
+            # The journal contains the latest changes.
+            backup_path = journal_path
         try:
             path = path_from_uri(uri)
             time_diff = os.path.getmtime(backup_path) - os.path.getmtime(path)
@@ -147,7 +225,10 @@ class ProjectManager(GObject.Object, Loggable):
                 use_backup = self._restoreFromBackupDialog(time_diff)
 
                 if use_backup:
-                    uri = self._makeBackupURI(uri)
+                    if backup_path == journal_path:
+                        uri = self._makeJournalURI(uri)
+                    else:
+                        uri = self._makeBackupURI(uri)
             self.debug('Loading project from backup: %s', uri)
 
         # For backup files and legacy formats, force the user to use "Save as"
@@ -244,6 +325,10 @@ class ProjectManager(GObject.Object, Loggable):
         is_validate_scenario = self._isValidateScenario(uri)
         if not is_validate_scenario:
             uri = self._tryUsingBackupFile(uri)
+            # The journal is a scenario.
+            is_validate_scenario = self._isValidateScenario(uri)
+
+        if not is_validate_scenario:
             scenario = None
         else:
             scenario = path_from_uri(uri)
@@ -402,77 +487,186 @@ class ProjectManager(GObject.Object, Loggable):
             else:
                 self.debug('Saved backup: %s', uri)
 
+            if self.__journal:
+                # The journaled changes are now saved.
+                self.__discard_pending_journal()
+                try:
+                    self.__reset_journal(uri)
+                except OSError as e:
+                    self.warning("Cannot journal the changes: %s", e)
+                    self.__stop_journal()
+
         return saved
 
-    def exportProject(self, project, uri):
-        """Exports a project and all its media files to a *.tar archive."""
-        # Save the project to a temporary file.
+    def start_journal(self, action_log):
+        """Starts journaling the operations done on the current project.
+
+        The journal allows recovering the latest changes after a crash, so
+        the backups are saved less often while it contains all the
+        operations.
+
+        Args:
+            action_log (UndoableActionLog): The action log of the project.
+        """
+        project = self.current_project
+        if not has_validate or project.uri is None or self.disable_save:
+            # The journal cannot be replayed or would be based on a backup.
+            return
+
+        path = path_from_uri(self._makeJournalURI(project.uri))
+        self.__journal = UndoJournal(action_log, path)
+        # Connected after the journal, to check what it recorded.
+        action_log.connect("commit", self.__journaled_cb)
+        action_log.connect("move", self.__journaled_cb)
+        try:
+            self.__reset_journal(project.uri)
+        except OSError as e:
+            self.warning("Cannot journal the changes to %s: %s", path, e)
+            self.__stop_journal()
+
+    def __reset_journal(self, uri):
+        """Restarts the journal from the project saved at the specified URI."""
+        old_path = self.__journal.path
+        # The project might have been saved to a new location.
+        self.__journal.path = path_from_uri(self._makeJournalURI(self.current_project.uri))
+        with open(path_from_uri(uri)) as project_file:
+            self.__journal.reset(project_file.read())
+        if old_path != self.__journal.path and os.path.exists(old_path):
+            os.remove(old_path)
+
+    def __stop_journal(self):
+        if self.__journaled_backup_id:
+            GLib.source_remove(self.__journaled_backup_id)
+            self.__journaled_backup_id = 0
+        if self.__journal:
+            self.__journal.action_log.disconnect_by_func(self.__journaled_cb)
+            self.__journal.release()
+            self.__journal = None
+
+    def __journaled_cb(self, unused_action_log, unused_stack):
+        if self.__journal.complete or not self.__journaled_backup_id:
+            return
+
+        # The journal cannot recover the changes, so save backups as usual.
+        GLib.source_remove(self.__journaled_backup_id)
+        self.__journaled_backup_id = 0
+        self._projectChangedCb(self.current_project)
+
+    def exportProject(self, project, uri, mode=ExportMode.ALL):
+        """Starts exporting a project and its media files to a *.tar archive.
+
+        Args:
+            project (Project): The project to be exported.
+            uri (str): The URI of the archive.
+            mode (int): The ExportMode specifying which media files
+                are included.
+
+        Returns:
+            ProjectExporter: The started thread writing the archive, or None
+            if the project could not be serialized.
+        """
         project_name = project.name if project.name else _("project")
         asset = GES.Formatter.get_default()
         project_extension = asset.get_meta(GES.META_FORMATTER_EXTENSION)
-        tmp_name = "%s.%s" % (project_name, project_extension)
+        project_file_name = "%s.%s" % (project_name, project_extension)
 
-        directory = os.path.dirname(uri)
-        tmp_uri = os.path.join(directory, tmp_name)
-        try:
-            # saveProject updates the project URI... so we better back it up:
-            _old_uri = self.current_project.uri
-            self.saveProject(tmp_uri)
-            self.current_project.uri = _old_uri
-
-            # create tar file
-            with tarfile.open(path_from_uri(uri), mode="w") as tar:
-                # top directory in tar-file
-                top = "%s-export" % project_name
-                # add temporary project file
-                tar.add(path_from_uri(tmp_uri), os.path.join(top, tmp_name))
-
-                # get common path
-                sources = project.listSources()
-                if self._allSourcesInHomedir(sources):
-                    common = os.path.expanduser("~")
-                else:
-                    common = "/"
-
-                # add all sources
-                for source in sources:
-                    path = path_from_uri(source.get_id())
-                    tar.add(
-                        path, os.path.join(top, os.path.relpath(path, common)))
-                tar.close()
-        # This catches errors with tarring; the GUI already shows errors while
-        # saving projects (ex: permissions), so probably no GUI needed here.
-        # Keep the exception generic enough to catch programming errors:
-        except Exception as e:
-            everything_ok = False
-            self.error(e)
-            tar_file = path_from_uri(uri)
-            if os.path.isfile(tar_file):
-                renamed = os.path.splitext(tar_file)[
-                    0] + " (CORRUPT)" + "." + project_extension + "_tar"
-                self.warning(
-                    'An error occurred, will save the tarball as "%s"', renamed)
-                os.rename(tar_file, renamed)
+        content = self._serialize_project(project)
+        if content is None:
+            return None
+
+        ranges = {}
+        targets = None
+        if mode == ExportMode.USED_RANGES:
+            ranges, targets = find_used_ranges(project.ges_timeline)
+            media_uris = [media_uri for media_uri, used in ranges.items()
+                          if used is None]
         else:
-            everything_ok = True
+            uris = self._listExportedSources(project, mode)
+            if any(media_uri != source_uri for source_uri, media_uri in uris.items()):
+                content = rewrite_project_uris(content, uris)
+            media_uris = list(uris.values())
 
-        # Ensure we remove the temporary project file no matter what:
-        try:
-            os.remove(path_from_uri(tmp_uri))
-        except OSError:
-            pass
+        paths = [path_from_uri(media_uri) for media_uri in media_uris]
+        homedir = os.path.expanduser("~")
+        if all(path_from_uri(media_uri).startswith(homedir)
+               for media_uri in media_uris + list(ranges.keys())):
+            common = homedir
+        else:
+            common = "/"
 
-        return everything_ok
+        # The top directory in the archive.
+        top = "%s-export" % project_name
 
-    def _allSourcesInHomedir(self, sources):
-        """Checks if all sources are located in the user's home directory."""
-        homedir = os.path.expanduser("~")
+        def arcname(path):
+            return os.path.join(top, os.path.relpath(path, common))
 
-        for source in sources:
-            if not path_from_uri(source.get_id()).startswith(homedir):
-                return False
+        sources = [(path, arcname(path)) for path in paths]
+        cuts = self._createExportedCuts(project, ranges, arcname)
+        exporter = ProjectExporter(path_from_uri(uri),
+                                   os.path.join(top, project_file_name),
+                                   content, sources, cuts, targets)
+        exporter.connect("exported", self.__exported_cb)
+        self.__exporters.add(exporter)
+        exporter.start()
+        return exporter
 
-        return True
+    def __exported_cb(self, exporter, unused_failure):
+        self.__exporters.discard(exporter)
+
+    def _createExportedCuts(self, project, ranges, arcname):
+        """Creates the ranges to be copied out of the media files.
+
+        The new media files are named after the copied range and are placed,
+        in the exported project, next to the original media files.
+
+        Returns:
+            List[MediaCut]: The ranges to be copied.
+        """
+        cuts = []
+        for media_uri, used in ranges.items():
+            if not used:
+                continue
+
+            path = path_from_uri(media_uri)
+            duration = project.get_asset(media_uri, GES.UriClip).get_duration()
+            try:
+                size = os.path.getsize(path)
+            except OSError as e:
+                self.warning("Cannot get the size of %s: %s", path, e)
+                size = 0
+            for start, stop in used:
+                cut_path = "%s.%d-%d.mkv" % (os.path.splitext(path)[0],
+                                             start // Gst.MSECOND,
+                                             stop // Gst.MSECOND)
+                cut_size = size * (stop - start) // duration if duration else 0
+                cuts.append(MediaCut(media_uri, start, stop,
+                                     Gst.filename_to_uri(cut_path),
+                                     arcname(cut_path), arcname(path),
+                                     cut_size))
+        return cuts
+
+    def _listExportedSources(self, project, mode):
+        """Lists the media files to be included when exporting a project.
+
+        Returns:
+            dict: The URIs of the files to be included by the URIs of the
+            media files of the project.
+        """
+        uris = {}
+        for asset in project.listSources():
+            uri = asset.get_id()
+            if mode == ExportMode.PROXIES:
+                if get_proxy_target(asset) is not asset:
+                    # Included through its target.
+                    continue
+
+                proxy = asset.get_proxy()
+                if proxy and not proxy.get_error():
+                    uris[uri] = proxy.get_id()
+                    continue
+
+            uris[uri] = uri
+        return uris
 
     def closeRunningProject(self):
         """Closes the current project."""
@@ -505,6 +699,16 @@ class ProjectManager(GObject.Object, Loggable):
             project.pipeline.disconnect_by_function(self._projectPipelineDiedCb)
         except Exception:
             self.fixme("Handle better the errors and not get to this point")
+        for exporter in self.__exporters:
+            exporter.abort()
+            exporter.join()
+        self.__exporters.clear()
+        if self.__backup_writer:
+            # Make sure the backup is not written after being cleaned.
+            self.__discard_pending_journal()
+            self.__backup_writer.join()
+            self.__backup_writer = None
+        self.__stop_journal()
         self._cleanBackup(project.uri)
         self.exitcode = project.release()
 
@@ -563,6 +767,12 @@ class ProjectManager(GObject.Object, Loggable):
         if uri is None:
             return
 
+        if self.__journal and self.__journal.complete:
+            if not self.__journaled_backup_id:
+                self.__journaled_backup_id = GLib.timeout_add_seconds(
+                    JOURNALED_BACKUP_DELAY, self.__save_journaled_backup_cb)
+            return
+
         if self._backup_lock == 0:
             self._backup_lock = 10
             GLib.timeout_add_seconds(
@@ -576,17 +786,131 @@ class ProjectManager(GObject.Object, Loggable):
             self._backup_lock -= 5
             return True
         else:
-            self.saveProject(backup=True)
+            if self.__backup_writer:
+                # Try again when the previous backup has been written.
+                return True
+            self.save_backup_async()
             self._backup_lock = 0
         return False
 
+    def __save_journaled_backup_cb(self):
+        if self.__backup_writer:
+            return True
+        self.__journaled_backup_id = 0
+        self.save_backup_async()
+        return False
+
+    def save_backup_async(self):
+        """Saves a backup of the current project without waiting for the disk.
+
+        The project is serialized in the main thread to a file in the
+        runtime directory, which is usually in memory, and the backup file
+        is written in a separate thread. The journal, if any, restarts from
+        the serialized project.
+
+        Returns:
+            bool: Whether the backup is being written.
+        """
+        project = self.current_project
+        if self.disable_save or project is None or project.uri is None:
+            return False
+
+        start = time.time()
+        content = self._serialize_project(project)
+        if content is None:
+            return False
+        snapshot_duration = time.time() - start
+
+        journal_path = None
+        journal_marker = None
+        if self.__journal:
+            journal_path = self.__journal.path + ".next"
+            journal_marker = self.__journal.mark()
+        path = path_from_uri(self._makeBackupURI(project.uri))
+        self.__backup_writer = BackupWriter(content, path, journal_path,
+                                            journal_marker,
+                                            self.__backup_written_cb,
+                                            snapshot_duration)
+        self.__backup_writer.start()
+        return True
+
+    def _serialize_project(self, project):
+        """Serializes the specified project without changing its URI.
+
+        The project is saved to a file in the runtime directory, which is
+        usually in memory.
+
+        Returns:
+            bytes: The serialized project, or None if it failed.
+        """
+        fd, snapshot_path = tempfile.mkstemp(suffix=".xges",
+                                             dir=GLib.get_user_runtime_dir())
+        os.close(fd)
+        try:
+            if not project.save(project.ges_timeline,
+                                Gst.filename_to_uri(snapshot_path), None,
+                                overwrite=True):
+                self.warning("Failed serializing the project")
+                return None
+            with open(snapshot_path, "rb") as snapshot:
+                return snapshot.read()
+        except (GLib.Error, OSError) as e:
+            self.warning("Failed serializing the project: %s", e)
+            return None
+        finally:
+            os.remove(snapshot_path)
+
+    def __discard_pending_journal(self):
+        """Makes sure the journal is not replaced by the one being written.
+
+        The journal prepared by the backup writer is obsolete when the
+        journal restarts meanwhile, for example because the project has
+        been saved.
+        """
+        if self.__backup_writer:
+            self.__backup_writer.journal_marker = None
+
+    def __backup_written_cb(self, writer):
+        writer.join()
+        if writer is not self.__backup_writer:
+            # The project has been closed meanwhile.
+            self.__remove_prepared_journal(writer)
+            return False
+
+        self.__backup_writer = None
+        if writer.failure:
+            self.warning("Failed saving backup %s: %s", writer.path, writer.failure)
+            self.__remove_prepared_journal(writer)
+            return False
+
+        self.info("Saved backup %s: %d bytes, serialized in the main thread"
+                  " in %.3f s, written in the background in %.3f s",
+                  writer.path, writer.written, writer.snapshot_duration,
+                  writer.duration)
+        if not self.__journal or writer.journal_marker is None:
+            self.__remove_prepared_journal(writer)
+            return False
+
+        try:
+            self.__journal.switch(writer.journal_path, writer.journal_marker)
+        except OSError as e:
+            self.warning("Cannot journal the changes: %s", e)
+            self.__stop_journal()
+        return False
+
+    @staticmethod
+    def __remove_prepared_journal(writer):
+        if writer.journal_path and os.path.exists(writer.journal_path):
+            os.remove(writer.journal_path)
+
     def _cleanBackup(self, uri):
         if uri is None:
             return
-        path = path_from_uri(self._makeBackupURI(uri))
-        if os.path.exists(path):
-            os.remove(path)
-            self.debug('Removed backup file: %s', path)
+        for path in [path_from_uri(self._makeBackupURI(uri)),
+                     path_from_uri(self._makeJournalURI(uri))]:
+            if os.path.exists(path):
+                os.remove(path)
+                self.debug('Removed backup file: %s', path)
 
     def _makeBackupURI(self, uri):
         """Generates a corresponding backup URI or path.
@@ -603,6 +927,17 @@ class ProjectManager(GObject.Object, Loggable):
         name, ext = os.path.splitext(uri)
         return name + ext + "~"
 
+    def _makeJournalURI(self, uri):
+        """Generates the URI or path of the journal of the changes.
+
+        Args:
+            uri (str): The project URI or file path.
+
+        Returns:
+            str: The journal version of the `uri`, a scenario.
+        """
+        return uri + "~.scenario"
+
     def _missingURICb(self, project, error, asset):
         new_uri = self.emit("missing-uri", project, error, asset)
         if not new_uri:
@@ -650,6 +985,7 @@ class Project(Loggable, GES.Project):
         "proxying-error": (GObject.SignalFlags.RUN_LAST, None,
                            (object,)),
         "start-importing": (GObject.SignalFlags.RUN_LAST, None, ()),
+        "import-progress": (GObject.SignalFlags.RUN_LAST, None, (int, int)),
         "project-changed": (GObject.SignalFlags.RUN_LAST, None, ()),
         "rendering-settings-changed": (GObject.SignalFlags.RUN_LAST, None,
                                        (GObject.TYPE_PYOBJECT,)),
@@ -663,6 +999,7 @@ class Project(Loggable, GES.Project):
         GES.Project.__init__(self, uri=uri, extractable_type=GES.Timeline)
         self.log("uri:%s", uri)
         self.pipeline = None
+        self.proxy_tier_switcher = None
         self.ges_timeline = None
         self.uri = uri
         self.loaded = False
@@ -670,6 +1007,15 @@ class Project(Loggable, GES.Project):
         self.app = app
         self.loading_assets = set()
 
+        # The URIs waiting to be imported, in order, and the same URIs for
+        # fast lookups. The URIs missing in the set have been cancelled.
+        self.__import_queue = collections.deque()
+        self.__queued_uris = set()
+        # The URIs of the assets being discovered.
+        self.__importing_uris = set()
+        self.__imported_count = 0
+        self.__import_total = 0
+
         self.relocated_assets = {}
         self.app.proxy_manager.connect("progress", self.__assetTranscodingProgressCb)
         self.app.proxy_manager.connect("error-preparing-asset",
@@ -1304,6 +1650,9 @@ class Project(Loggable, GES.Project):
             self.debug("Ignoring asset: %s", asset.props.id)
             return
 
+        DiscoveryCache.get().store_info(asset.get_id(), asset.get_info())
+        self.__import_done(asset.get_id())
+
         if asset not in self.loading_assets:
             self.debug("Asset %s is not in loading assets, "
                        " it must not be proxied", asset.get_id())
@@ -1333,6 +1682,7 @@ class Project(Loggable, GES.Project):
                 break
 
         self.error("Could not load %s: %s -> %s", asset_id, error, asset)
+        self.__import_done(asset_id)
         asset.error = error
         asset.creation_progress = 100
         if self.loaded:
@@ -1506,7 +1856,12 @@ class Project(Loggable, GES.Project):
                     encoder.set_property(prop, value)
                 assert encoder.save_preset(preset)
 
-        return GES.Project.save(self, ges_timeline, uri, formatter_asset, overwrite)
+        if not self.proxy_tier_switcher:
+            return GES.Project.save(self, ges_timeline, uri, formatter_asset, overwrite)
+
+        # Never save the faster assets used temporarily for playback.
+        with self.proxy_tier_switcher.default_assets():
+            return GES.Project.save(self, ges_timeline, uri, formatter_asset, overwrite)
 
     def use_proxies_for_assets(self, assets):
         originals = []
@@ -1573,6 +1928,8 @@ class Project(Loggable, GES.Project):
             self.warning("Failed to set the pipeline's timeline: %s", self.ges_timeline)
             return False
 
+        self.proxy_tier_switcher = ProxyTierSwitcher(self.app, self.pipeline,
+                                                     self.ges_timeline)
         return True
 
     def update_restriction_caps(self):
@@ -1608,18 +1965,81 @@ class Project(Loggable, GES.Project):
 
         self.pipeline.commit_timeline()
 
-    def addUris(self, uris):
+    def addUris(self, uris, merge_key=None):
         """Adds assets asynchronously.
 
         Args:
             uris (List[str]): The URIs of the assets.
+            merge_key (Optional[object]): Identifies the import the URIs are
+                part of, so the assets added in several batches are removed
+                at once when undoing.
         """
-        with self.app.action_log.started("assets-addition"):
+        with self.app.action_log.started("assets-addition", merge_key=merge_key):
             for uri in uris:
-                if self.create_asset(quote_uri(uri), GES.UriClip):
-                    # The asset was not already part of the project.
-                    action = AssetAddedIntention(self, uri)
-                    self.app.action_log.push(action)
+                quoted_uri = quote_uri(uri)
+                if self.get_asset(quoted_uri, GES.UriClip) or \
+                        quoted_uri in self.__importing_uris or \
+                        quoted_uri in self.__queued_uris:
+                    # The asset is already part of the project.
+                    continue
+
+                action = AssetAddedIntention(self, uri)
+                self.app.action_log.push(action)
+                self.__import_queue.append(quoted_uri)
+                self.__queued_uris.add(quoted_uri)
+                self.__import_total += 1
+
+        self.__import_next()
+
+    def __import_next(self):
+        """Starts discovering the queued URIs, a few at a time."""
+        while self.__queued_uris and \
+                len(self.__importing_uris) < IMPORT_MAX_DISCOVERIES:
+            uri = self.__import_queue.popleft()
+            if uri not in self.__queued_uris:
+                # The import has been cancelled.
+                continue
+            self.__queued_uris.remove(uri)
+            self.__importing_uris.add(uri)
+            if not self.create_asset(uri, GES.UriClip):
+                # The asset was added meanwhile.
+                self.__import_done(uri)
+
+    def __import_done(self, uri):
+        if uri not in self.__importing_uris:
+            return
+
+        self.__importing_uris.remove(uri)
+        self.__imported_count += 1
+        self.__import_progressed()
+
+    def __import_progressed(self):
+        self.emit("import-progress", self.__imported_count, self.__import_total)
+        if not self.__importing_uris and not self.__queued_uris:
+            self.__import_queue.clear()
+            self.__imported_count = 0
+            self.__import_total = 0
+        else:
+            self.__import_next()
+
+    def cancel_import(self, uri):
+        """Cancels adding the asset for the specified URI, if still queued.
+
+        Args:
+            uri (str): The URI passed to `addUris`.
+
+        Returns:
+            bool: Whether the import has been cancelled. When False, the
+                asset is being discovered or has already been added.
+        """
+        quoted_uri = quote_uri(uri)
+        if quoted_uri not in self.__queued_uris:
+            return False
+
+        self.__queued_uris.remove(quoted_uri)
+        self.__import_total -= 1
+        self.__import_progressed()
+        return True
 
     def assetsForUris(self, uris):
         assets = []
@@ -1636,6 +2056,14 @@ class Project(Loggable, GES.Project):
     def release(self):
         res = 0
 
+        # Forget the URIs not imported yet.
+        self.__import_queue.clear()
+        self.__queued_uris.clear()
+
+        if self.proxy_tier_switcher:
+            self.proxy_tier_switcher.release()
+            self.proxy_tier_switcher = None
+
         if self.pipeline:
             self.pipeline.release()
 
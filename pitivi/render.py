@@ -1035,6 +1035,9 @@ class RenderDialog(Loggable):
 
     def _renderButtonClickedCb(self, unused_button):
         """Starts the rendering process."""
+        # The scaled proxies are only meant for the playback.
+        if self.project.proxy_tier_switcher:
+            self.project.proxy_tier_switcher.restore()
         self.__maybeUseSourceAsset()
         self.outfile = os.path.join(self.filebutton.get_uri(),
                                     self.fileentry.get_text())
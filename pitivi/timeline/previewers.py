@@ -17,10 +17,18 @@
 # Free Software Foundation, Inc., 51 Franklin St, Fifth Floor,
 # Boston, MA 02110-1301, USA.
 """Previewers for the timeline."""
+import array
+import bisect
+import collections
 import contextlib
+import functools
+import heapq
+import itertools
 import os
-import random
+import queue
 import sqlite3
+import threading
+import time
 
 import cairo
 import numpy
@@ -43,6 +51,7 @@ from pitivi.utils.misc import quote_uri
 from pitivi.utils.pipeline import MAX_BRINGING_TO_PAUSED_DURATION
 from pitivi.utils.proxy import get_proxy_target
 from pitivi.utils.system import CPUUsageTracker
+from pitivi.utils.threads import Thread
 from pitivi.utils.timeline import Zoomable
 from pitivi.utils.ui import EXPANDED_SIZE
 
@@ -60,9 +69,60 @@ THUMB_MARGIN_PX = 3
 THUMB_HEIGHT = EXPANDED_SIZE - 2 * THUMB_MARGIN_PX
 THUMB_PERIOD = int(Gst.SECOND / 2)
 assert Gst.SECOND % THUMB_PERIOD == 0
-# For the waveforms, ensures we always have a little extra surface when
-# scrolling while playing, in pixels.
-WAVEFORM_SURFACE_EXTRA_PX = 500
+# The number of resolution levels of the thumbnails, each level being half
+# the size of the previous one.
+THUMB_LEVELS = 3
+# How far from the requested position a keyframe can be to be used
+# as a thumbnail, to avoid decoding from the previous keyframe.
+THUMB_KEYFRAME_TOLERANCE = THUMB_PERIOD // 2
+# The minimum number of missing thumbnails for which the clip is played
+# in a single pass instead of seeking for each thumbnail.
+LINEAR_THUMBNAILING_MIN_MISSING = 10
+# The minimum ratio of the displayed thumbnails which must be missing
+# for the clip to be played in a single pass.
+LINEAR_THUMBNAILING_MIN_RATIO = 0.5
+# The maximum interval between the displayed thumbnails for which playing
+# the clip in a single pass is faster than seeking, in nanoseconds.
+LINEAR_THUMBNAILING_MAX_INTERVAL = 4 * THUMB_PERIOD
+# The maximum number of connections to the thumbnails database.
+THUMBS_DB_MAX_CONNECTIONS = 4
+# The number of thumbnails which triggers saving them to the database.
+THUMBS_DB_BATCH_SIZE = 100
+# How long the thumbnails are kept before being saved, in seconds.
+THUMBS_DB_FLUSH_INTERVAL = 2
+# The number of thumbnails on a row of a sprite sheet.
+SPRITE_SHEET_COLUMNS = 16
+# The maximum number of thumbnails packed in a sprite sheet, so a sheet
+# fits comfortably in the decoded thumbnails cache.
+SPRITE_SHEET_MAX_THUMBS = 256
+# For the thumbnails, ensures we always have a little extra surface when
+# scrolling, in pixels.
+THUMBS_SURFACE_EXTRA_PX = 500
+# The duration of the audio for which a waveform value is computed. It's
+# the interval at which the `level` element was posting the values, so the
+# generated waveforms are consistent with the ones in the cache.
+WAVEFORM_BUCKET_DURATION = Gst.SECOND // 10
+# How many values of a waveform pyramid level are combined in a value of
+# the next level.
+WAVEFORM_PYRAMID_FACTOR = 4
+# The width of the tiles the waveforms are drawn in, in pixels.
+WAVEFORM_TILE_WIDTH = 256
+
+
+def get_thumb_level(height):
+    """Gets the lowest resolution level which fills the specified height.
+
+    Args:
+        height (int): The height available for displaying a thumbnail.
+
+    Returns:
+        int: The resolution level, 0 being the full THUMB_HEIGHT resolution.
+    """
+    level = 0
+    while level + 1 < THUMB_LEVELS and THUMB_HEIGHT >> (level + 1) >= height:
+        level += 1
+    return level
+
 
 PREVIEW_GENERATOR_SIGNALS = {
     "done": (GObject.SignalFlags.RUN_LAST, None, ()),
@@ -76,6 +136,29 @@ GlobalSettings.addConfigOption("previewers_max_cpu",
                                key="max-cpu-usage",
                                default=90)
 
+GlobalSettings.addConfigOption("previewers_thumbnail_workers",
+                               section="previewers",
+                               key="thumbnail-workers",
+                               default=2)
+
+# The memory budget for the decoded thumbnails, in MiB.
+GlobalSettings.addConfigOption("previewers_pixbuf_cache_size",
+                               section="previewers",
+                               key="pixbuf-cache-size",
+                               default=64)
+
+# The memory budget for the rendered waveform tiles, in MiB.
+GlobalSettings.addConfigOption("previewers_waveform_tiles_cache_size",
+                               section="previewers",
+                               key="waveform-tiles-cache-size",
+                               default=32)
+
+# Whether the waveforms show the min/max envelope instead of the RMS.
+GlobalSettings.addConfigOption("previewers_waveform_envelope",
+                               section="previewers",
+                               key="waveform-envelope",
+                               default=False)
+
 
 class PreviewerBin(Gst.Bin, Loggable):
     """Baseclass for elements gathering data to create previews."""
@@ -171,7 +254,15 @@ class TeedThumbnailBin(ThumbnailBin):
 
 # pylint: disable=too-many-instance-attributes
 class WaveformPreviewer(PreviewerBin):
-    """Bin to generate and save waveforms as a .npy file."""
+    """Bin to generate and save waveforms as a .npy file.
+
+    The raw audio is analysed in a pad probe, computing the min, max and
+    RMS values for each WAVEFORM_BUCKET_DURATION of audio in bulk.
+
+    Attributes:
+        samples (numpy.ndarray): The RMS values for each SAMPLE_DURATION.
+        pyramid (WaveformPyramid): The min, max and RMS values.
+    """
 
     __gproperties__ = {
         "uri": (str,
@@ -188,19 +279,31 @@ class WaveformPreviewer(PreviewerBin):
     def __init__(self):
         PreviewerBin.__init__(self,
                               "audioconvert ! audioresample ! "
-                              "audio/x-raw,channels=1 ! level name=level"
+                              "capsfilter name=capsfilter "
+                              "caps=audio/x-raw,format=F32LE,channels=1,layout=interleaved"
                               " ! audioconvert ! audioresample")
-        self.level = self.internal_bin.get_by_name("level")
+        capsfilter = self.internal_bin.get_by_name("capsfilter")
+        capsfilter.get_static_pad("src").add_probe(
+            Gst.PadProbeType.BUFFER | Gst.PadProbeType.EVENT_DOWNSTREAM,
+            self._probe_cb)
         self.debug("Creating waveforms!!")
-        self.peaks = None
+        self.pyramid = None
 
         self.uri = None
         self.wavefile = None
         self.passthrough = False
-        self.samples = []
+        self.samples = None
         self.n_samples = 0
         self.duration = 0
-        self.prev_pos = 0
+
+        # The number of audio frames in a bucket.
+        self._bucket_frames = 0
+        # The position of the first bucket, in samples.
+        self._first_pos = None
+        # The audio frames not filling a bucket yet.
+        self._pending = numpy.empty(0, dtype=numpy.float32)
+        # The min, max and RMS values of the buckets, as arrays.
+        self._chunks = []
 
     def do_get_property(self, prop):
         if prop.name == 'uri':
@@ -222,60 +325,83 @@ class WaveformPreviewer(PreviewerBin):
         else:
             raise AttributeError('unknown property %s' % prop.name)
 
-    # pylint: disable=arguments-differ
-    def do_post_message(self, message):
-        if not self.passthrough and \
-                message.type == Gst.MessageType.ELEMENT and \
-                message.src == self.level:
-            struct = message.get_structure()
-            peaks = None
-            if struct:
-                peaks = struct.get_value("rms")
-
-            if peaks:
-                stream_time = struct.get_value("stream-time")
+    def _probe_cb(self, unused_pad, info):
+        """Analyses the raw audio, in the streaming thread."""
+        if self.passthrough:
+            return Gst.PadProbeReturn.OK
 
-                if self.peaks is None:
-                    self.peaks = []
-                    for unused_channel in peaks:
-                        self.peaks.append([0] * int(self.n_samples))
-
-                pos = int(stream_time / SAMPLE_DURATION)
-                if pos >= len(self.peaks[0]):
-                    return False
+        if info.type & Gst.PadProbeType.BUFFER:
+            self.__add_buffer(info.get_buffer())
+        else:
+            event = info.get_event()
+            if event.type == Gst.EventType.CAPS:
+                unused_res, rate = event.parse_caps().get_structure(0).get_int("rate")
+                self._bucket_frames = max(1, rate * WAVEFORM_BUCKET_DURATION // Gst.SECOND)
+            elif event.type == Gst.EventType.EOS and self._pending.size:
+                # The last bucket is shorter.
+                self.__add_buckets(self._pending.reshape(1, -1))
+                self._pending = numpy.empty(0, dtype=numpy.float32)
+
+        return Gst.PadProbeReturn.OK
+
+    def __add_buffer(self, buf):
+        if not self._bucket_frames:
+            self.warning("Got a buffer before the caps")
+            return
 
-                for i, val in enumerate(peaks):
-                    if val < 0:
-                        val = 10 ** (val / 20) * 100
-                    else:
-                        val = self.peaks[i][pos - 1]
+        if self._first_pos is None:
+            pts = buf.pts if buf.pts != Gst.CLOCK_TIME_NONE else 0
+            self._first_pos = int(pts / SAMPLE_DURATION)
 
-                    # Linearly joins values between to known samples values.
-                    unknowns = range(self.prev_pos + 1, pos)
-                    if unknowns:
-                        prev_val = self.peaks[i][self.prev_pos]
-                        linear_const = (val - prev_val) / len(unknowns)
-                        for temppos in unknowns:
-                            self.peaks[i][temppos] = self.peaks[i][temppos - 1] + linear_const
+        success, mapinfo = buf.map(Gst.MapFlags.READ)
+        if not success:
+            self.warning("Failed mapping the audio buffer")
+            return
+        try:
+            frames = numpy.frombuffer(mapinfo.data, dtype="<f4")
+            if self._pending.size:
+                frames = numpy.concatenate((self._pending, frames))
+            n_buckets = len(frames) // self._bucket_frames
+            end = n_buckets * self._bucket_frames
+            if n_buckets:
+                self.__add_buckets(frames[:end].reshape(n_buckets, self._bucket_frames))
+            self._pending = frames[end:].copy()
+        finally:
+            buf.unmap(mapinfo)
 
-                    self.peaks[i][pos] = val
+    def __add_buckets(self, buckets):
+        """Computes the values of the buckets, one bucket per row."""
+        squares = numpy.square(buckets, dtype=numpy.float64)
+        chunk = numpy.empty((len(buckets), 3))
+        chunk[:, WaveformPyramid.MIN] = buckets.min(axis=1) * 100.0
+        chunk[:, WaveformPyramid.MAX] = buckets.max(axis=1) * 100.0
+        chunk[:, WaveformPyramid.RMS] = numpy.sqrt(squares.mean(axis=1)) * 100
+        self._chunks.append(chunk)
 
-                self.prev_pos = pos
+    def _resample(self, values):
+        """Gets the values of the buckets for each SAMPLE_DURATION.
 
-        return Gst.Bin.do_post_message(self, message)
+        The samples between the buckets are linearly interpolated.
+        """
+        samples = numpy.zeros((int(self.n_samples), values.shape[1]))
+        bucket_samples = WAVEFORM_BUCKET_DURATION / SAMPLE_DURATION
+        positions = self._first_pos + numpy.arange(len(values)) * bucket_samples
+        end = min(len(samples), int(positions[-1]) + 1)
+        if end > self._first_pos:
+            indexes = numpy.arange(self._first_pos, end)
+            for column in range(values.shape[1]):
+                samples[self._first_pos:end, column] = numpy.interp(
+                    indexes, positions, values[:, column])
+        return samples
 
     def finalize(self, proxy=None):
         """Finalizes the previewer, saving data to file if needed."""
-        if not self.passthrough and self.peaks:
-            # Let's go mono.
-            if len(self.peaks) > 1:
-                samples = (numpy.array(self.peaks[0]) + numpy.array(self.peaks[1])) / 2
-            else:
-                samples = numpy.array(self.peaks[0])
-
-            self.samples = list(samples)
+        if not self.passthrough and self._chunks:
+            values = self._resample(numpy.concatenate(self._chunks))
+            self.samples = values[:, WaveformPyramid.RMS]
             with open(self.wavefile, 'wb') as wavefile:
-                numpy.save(wavefile, samples)
+                numpy.save(wavefile, self.samples)
+            self.pyramid = WaveformPyramid.create(self.wavefile, values)
 
         if proxy and not proxy.get_error():
             proxy_wavefile = get_wavefile_location_for_uri(proxy.get_id())
@@ -285,6 +411,7 @@ class WaveformPreviewer(PreviewerBin):
             except FileNotFoundError:
                 pass
             os.symlink(self.wavefile, proxy_wavefile)
+            WaveformPyramid.symlink(self.wavefile, proxy_wavefile)
 
 
 Gst.Element.register(None, "waveformbin", Gst.Rank.NONE,
@@ -295,8 +422,552 @@ Gst.Element.register(None, "teedthumbnailbin", Gst.Rank.NONE,
                      TeedThumbnailBin)
 
 
+class ThumbnailJob(object):
+    """A request for the thumbnails of an asset.
+
+    Attributes:
+        uri (str): The URI of the asset.
+        position (int): The position of the thumbnail, in nanoseconds.
+        end (int): When not None, the thumbnails every THUMB_PERIOD from
+            `position` up to `end` are generated in a single pass.
+        callback (function): Called with the job, the position and the
+            GdkPixbuf.Pixbuf of each thumbnail. The pixbuf is None if the
+            thumbnail could not be generated.
+        done_callback (function): Called with the job when it's done.
+        priority (int): The lower, the sooner the job is processed.
+        height (int): The height of the thumbnail, in pixels.
+        tolerance (int): How far from `position` the frame can be,
+            in nanoseconds. When not 0, a keyframe is used if one is close
+            enough, to avoid decoding from the previous keyframe.
+        owner (object): Whoever added the job, to be able to cancel
+            all its jobs at once.
+        cancelled (bool): Whether the job has been cancelled.
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, uri, position, end, callback, done_callback, priority,
+                 height, tolerance, owner):
+        self.uri = uri
+        self.position = position
+        self.end = end
+        self.callback = callback
+        self.done_callback = done_callback
+        self.priority = priority
+        self.height = height
+        self.tolerance = tolerance
+        self.owner = owner
+        self.cancelled = False
+
+
+# pylint: disable=too-many-instance-attributes
+class ThumbnailWorker(Loggable):
+    """Pipeline generating thumbnails for the jobs of a ThumbnailEngine.
+
+    For single thumbnails the pipeline seeks to the position and takes the
+    prerolled frame. The pipeline is reused between such jobs and it's
+    rebuilt only when a job for a different URI or height comes in.
+
+    For ranges of thumbnails the pipeline plays the range once and the
+    `videorate` element lets through a frame every THUMB_PERIOD.
+
+    Attributes:
+        engine (ThumbnailEngine): The engine owning the worker.
+        job (ThumbnailJob): The job being processed, if any.
+    """
+
+    def __init__(self, engine):
+        Loggable.__init__(self)
+        self.engine = engine
+        self.job = None
+        self.uri = None
+        self.height = 0
+        self.pipeline = None
+        self.gdkpixbufsink = None
+        self._preroll_timeout_id = 0
+        # Whether the pipeline is being brought to PAUSED the first time.
+        self._prerolling = False
+        # Whether we are waiting for the pixbuf of a seek.
+        self._seeking = False
+        # Whether the current seek is an accurate seek.
+        self._accurate = True
+        # The last pixbuf received for the current seek.
+        self._pixbuf = None
+        # Whether the range of the job is being played.
+        self._playing = False
+
+    def process(self, job):
+        """Starts generating the thumbnails for the specified job."""
+        self.job = job
+        if job.end is None and self.pipeline and not self._playing and \
+                job.uri == self.uri and job.height == self.height:
+            self._seek()
+            return
+
+        self.release()
+        self._setup_pipeline(job.uri, job.height, throttled=job.end is not None)
+
+    def _setup_pipeline(self, uri, height, throttled):
+        pipeline = Gst.parse_launch(
+            "uridecodebin uri={uri} name=decode ! "
+            "videoconvert ! "
+            "videorate ! "
+            "videoscale method=lanczos ! "
+            "capsfilter caps=video/x-raw,format=(string)RGBA,height=(int){height},"
+            "pixel-aspect-ratio=(fraction)1/1,framerate={thumbs_per_second}/1 ! "
+            "gdkpixbufsink name=gdkpixbufsink".format(
+                uri=uri,
+                height=height,
+                thumbs_per_second=int(Gst.SECOND / THUMB_PERIOD)))
+
+        self.gdkpixbufsink = pipeline.get_by_name("gdkpixbufsink")
+
+        if throttled:
+            # This line is necessary so we can instantiate GstTranscoder's
+            # GstCpuThrottlingClock below.
+            Gst.ElementFactory.make("uritranscodebin", None)
+            clock = GObject.new(GObject.type_from_name("GstCpuThrottlingClock"))
+            clock.props.cpu_usage = self.engine.max_cpu_usage
+            pipeline.use_clock(clock)
+
+        decode = pipeline.get_by_name("decode")
+        decode.connect("autoplug-select", self._autoplug_select_cb)
+
+        self._preroll_timeout_id = GLib.timeout_add_seconds(MAX_BRINGING_TO_PAUSED_DURATION,
+                                                            self.__preroll_timed_out_cb)
+        pipeline.get_bus().add_signal_watch()
+        pipeline.get_bus().connect("message", self.__bus_message_cb)
+        self.uri = uri
+        self.height = height
+        self.pipeline = pipeline
+        self._prerolling = True
+        pipeline.set_state(Gst.State.PAUSED)
+
+    def _seek(self, accurate=None):
+        job = self.job
+        if accurate is None:
+            accurate = not job.tolerance or job.uri in self.engine.sparse_keyframes_uris
+
+        if accurate:
+            flags = Gst.SeekFlags.FLUSH | Gst.SeekFlags.ACCURATE
+        else:
+            flags = Gst.SeekFlags.FLUSH | Gst.SeekFlags.KEY_UNIT | Gst.SeekFlags.SNAP_NEAREST
+
+        self.log("Creating thumb at %s for %s", job.position, job.uri)
+        self._accurate = accurate
+        self._pixbuf = None
+        self._seeking = True
+        self.pipeline.seek(1.0,
+                           Gst.Format.TIME,
+                           flags,
+                           Gst.SeekType.SET, job.position,
+                           Gst.SeekType.NONE, -1)
+
+    def _seek_done(self):
+        """Handles the end of a seek, when the frame has been prerolled."""
+        job = self.job
+        self._seeking = False
+        if not self._accurate and self._pixbuf:
+            res, position = self.pipeline.query_position(Gst.Format.TIME)
+            if not res or abs(position - job.position) > job.tolerance:
+                # The keyframes are too far apart in this asset.
+                self.debug("No keyframe close to %s in %s, seeking accurately",
+                           job.position, job.uri)
+                self.engine.sparse_keyframes_uris.add(job.uri)
+                self._seek(accurate=True)
+                return
+
+        if not self._pixbuf:
+            self.warning("Thumbnail generation failed at %s", job.position)
+        self.engine.thumbnail_ready(job, job.position, self._pixbuf)
+        self._finish()
+
+    def _play(self):
+        """Plays the range of the job."""
+        job = self.job
+        self.debug("Creating thumbs from %s to %s for %s", job.position, job.end, job.uri)
+        self._playing = True
+        self.gdkpixbufsink.props.sync = True
+        self.pipeline.seek(1.0,
+                           Gst.Format.TIME,
+                           Gst.SeekFlags.FLUSH | Gst.SeekFlags.ACCURATE,
+                           Gst.SeekType.SET, job.position,
+                           Gst.SeekType.SET, job.end)
+        self.pipeline.set_state(Gst.State.PLAYING)
+
+    def _finish(self):
+        job = self.job
+        self.job = None
+        self._pixbuf = None
+        self.engine.job_done(self, job)
+
+    def __bus_message_cb(self, unused_bus, message):
+        if message.src == self.gdkpixbufsink and \
+                message.type == Gst.MessageType.ELEMENT:
+            struct = message.get_structure()
+            struct_name = struct.get_name()
+            if self._seeking and struct_name == "preroll-pixbuf":
+                self._pixbuf = struct.get_value("pixbuf")
+            elif self._playing and struct_name == "pixbuf":
+                self.__add_played_thumbnail(struct)
+        elif message.src == self.pipeline and \
+                message.type == Gst.MessageType.ASYNC_DONE:
+            if self._prerolling:
+                # The pipeline is ready to be used.
+                self._prerolling = False
+                if self._preroll_timeout_id:
+                    GLib.source_remove(self._preroll_timeout_id)
+                    self._preroll_timeout_id = 0
+                if self.job.end is None:
+                    self._seek()
+                else:
+                    self._play()
+            elif self._seeking:
+                self._seek_done()
+        elif message.src == self.pipeline and \
+                message.type == Gst.MessageType.EOS:
+            if self._playing:
+                # The range has been played entirely.
+                self.release()
+                self._finish()
+        elif message.type == Gst.MessageType.ERROR:
+            self.warning("Thumbnail generation failed for %s: %s",
+                         self.uri, message.parse_error())
+            self.release()
+            if self.job:
+                if self.job.end is None:
+                    self.engine.thumbnail_ready(self.job, self.job.position, None)
+                self._finish()
+
+    def __add_played_thumbnail(self, struct):
+        job = self.job
+        if job.cancelled:
+            # No need to play the rest of the range.
+            self.release()
+            self._finish()
+            return
+
+        stream_time = struct.get_value("stream-time")
+        # The frames let through by videorate are THUMB_PERIOD apart.
+        position = int(round(stream_time / THUMB_PERIOD)) * THUMB_PERIOD
+        self.log("New thumb at %s for %s", position, job.uri)
+        self.engine.thumbnail_ready(job, position, struct.get_value("pixbuf"))
+
+    def __preroll_timed_out_cb(self):
+        self._preroll_timeout_id = 0
+        self.warning("Timed out prerolling %s", self.uri)
+        self.release()
+        if self.job:
+            if self.job.end is None:
+                self.engine.thumbnail_ready(self.job, self.job.position, None)
+            self._finish()
+        return False
+
+    # pylint: disable=no-self-use
+    def _autoplug_select_cb(self, unused_decode, unused_pad, unused_caps, factory):
+        # Don't plug audio decoders / parsers.
+        if "Audio" in factory.get_klass():
+            return True
+        return False
+
+    def pause(self):
+        """Pauses the playback of the range, if any."""
+        if self._playing:
+            self.pipeline.set_state(Gst.State.PAUSED)
+
+    def resume(self):
+        """Resumes the playback of the range, if any."""
+        if self._playing:
+            self.pipeline.set_state(Gst.State.PLAYING)
+
+    def release(self):
+        """Stops and discards the pipeline."""
+        if self._preroll_timeout_id:
+            GLib.source_remove(self._preroll_timeout_id)
+            self._preroll_timeout_id = 0
+
+        if self.pipeline:
+            self.pipeline.get_bus().remove_signal_watch()
+            self.pipeline.get_bus().disconnect_by_func(self.__bus_message_cb)
+            self.pipeline.set_state(Gst.State.NULL)
+            self.pipeline.get_state(Gst.CLOCK_TIME_NONE)
+            self.pipeline = None
+            self.gdkpixbufsink = None
+
+        self.uri = None
+        self.height = 0
+        self._prerolling = False
+        self._seeking = False
+        self._playing = False
+
+
+# pylint: disable=too-many-instance-attributes
+class ThumbnailEngine(Loggable):
+    """Generates thumbnails with a pool of pipelines.
+
+    The jobs are taken from a shared queue in the order of their priority,
+    and in the order in which they have been added for equal priorities.
+
+    Attributes:
+        max_workers (int): The maximum number of pipelines to use.
+        max_cpu_usage (int): The CPU usage percentage above which the
+            generation is slowed down.
+        sparse_keyframes_uris (set): The URIs of the assets for which seeking
+            to a keyframe is not precise enough.
+    """
+
+    def __init__(self, max_workers=2, max_cpu_usage=90):
+        Loggable.__init__(self)
+
+        self.max_workers = max_workers
+        self.max_cpu_usage = max_cpu_usage
+        self.sparse_keyframes_uris = set()
+
+        # The heap of (priority, counter, ThumbnailJob) tuples.
+        self._queue = []
+        self._counter = itertools.count()
+        self._workers = []
+        self._idle_workers = []
+        self._paused = False
+        self._dispatch_id = 0
+
+        self.cpu_usage_tracker = CPUUsageTracker()
+        # Delay before handing out the next jobs, in millis.
+        self.interval = 500
+
+        # The time when the current batch of jobs started being processed.
+        self._busy_since = None
+        # The number of thumbnails generated in the current batch.
+        self._generated = 0
+        # The throughput of the last batch.
+        self._last_thumbs_per_second = 0.0
+
+    @property
+    def thumbs_per_second(self):
+        """Gets the throughput of the thumbnails generation.
+
+        Returns:
+            float: The throughput of the current batch of jobs if any is being
+                processed, otherwise the throughput of the previous batch.
+        """
+        if self._busy_since is None:
+            return self._last_thumbs_per_second
+
+        elapsed = time.time() - self._busy_since
+        if not elapsed:
+            return 0.0
+        return self._generated / elapsed
+
+    # pylint: disable=too-many-arguments
+    def add_job(self, uri, position, callback, end=None, done_callback=None,
+                priority=0, height=THUMB_HEIGHT, tolerance=0, owner=None):
+        """Queues thumbnails to be generated.
+
+        Args:
+            uri (str): The URI of the asset.
+            position (int): The position of the thumbnail, in nanoseconds.
+            callback (function): Called with the job, the position and the
+                pixbuf of each thumbnail, the pixbuf being None if the
+                thumbnail could not be generated.
+            end (Optional[int]): When set, all the thumbnails between
+                `position` and `end` are generated in a single pass.
+            done_callback (Optional[function]): Called with the job when
+                it's done.
+            priority (int): The lower, the sooner the job is processed.
+            height (int): The height of the thumbnail, in pixels.
+            tolerance (int): How far from `position` the frame can be.
+            owner (object): Whoever requested the thumbnail.
+
+        Returns:
+            ThumbnailJob: The job, which can be cancelled later.
+        """
+        job = ThumbnailJob(uri, position, end, callback, done_callback,
+                           priority, height, tolerance, owner)
+        heapq.heappush(self._queue, (priority, next(self._counter), job))
+        self._schedule_dispatch()
+        return job
+
+    def cancel_jobs(self, owner):
+        """Cancels all the jobs added by the specified owner."""
+        queue = []
+        for entry in self._queue:
+            job = entry[2]
+            if job.owner is owner:
+                job.cancelled = True
+            elif not job.cancelled:
+                queue.append(entry)
+        heapq.heapify(queue)
+        self._queue = queue
+
+        for worker in self._workers:
+            if worker.job and worker.job.owner is owner:
+                worker.job.cancelled = True
+
+    def reprioritize(self, get_priority):
+        """Updates the priorities of the queued jobs.
+
+        Args:
+            get_priority (function): Gets the new priority of a job.
+        """
+        queue = []
+        for unused_priority, counter, job in self._queue:
+            if job.cancelled:
+                continue
+            job.priority = get_priority(job)
+            queue.append((job.priority, counter, job))
+        heapq.heapify(queue)
+        self._queue = queue
+
+    def pause(self):
+        """Stops handing out jobs until `resume` is called."""
+        self._paused = True
+        if self._dispatch_id:
+            GLib.source_remove(self._dispatch_id)
+            self._dispatch_id = 0
+
+        for worker in self._workers:
+            worker.pause()
+
+    def resume(self):
+        """Resumes handing out jobs."""
+        self._paused = False
+        for worker in self._workers:
+            worker.resume()
+        self._schedule_dispatch()
+
+    def stop(self):
+        """Cancels all the jobs and releases the pipelines."""
+        for unused_priority, unused_counter, job in self._queue:
+            job.cancelled = True
+        self._queue = []
+
+        for worker in self._workers:
+            if worker.job:
+                worker.job.cancelled = True
+            worker.release()
+        self._workers = []
+        self._idle_workers = []
+
+        if self._dispatch_id:
+            GLib.source_remove(self._dispatch_id)
+            self._dispatch_id = 0
+        self._busy_since = None
+
+    def thumbnail_ready(self, job, position, pixbuf):
+        """Handles a thumbnail generated for a job.
+
+        Args:
+            job (ThumbnailJob): The job being processed.
+            position (int): The position of the thumbnail.
+            pixbuf (GdkPixbuf.Pixbuf): The thumbnail, or None on failure.
+        """
+        if pixbuf:
+            self._generated += 1
+
+        if not job.cancelled:
+            job.callback(job, position, pixbuf)
+
+    def job_done(self, worker, job):
+        """Handles the end of a job.
+
+        Args:
+            worker (ThumbnailWorker): The worker which processed the job.
+            job (ThumbnailJob): The processed job.
+        """
+        self._idle_workers.append(worker)
+
+        if not job.cancelled and job.done_callback:
+            job.done_callback(job)
+
+        self._schedule_dispatch(throttle=True)
+
+    def _schedule_dispatch(self, throttle=False):
+        """Schedules the handing out of the queued jobs to the workers.
+
+        When throttling, checks the CPU usage and adjusts the waiting time
+        at which the next jobs are handed out +/- 10%.
+        """
+        if self._dispatch_id or self._paused:
+            return
+
+        if not throttle:
+            self._dispatch_id = GLib.idle_add(self._dispatch_cb,
+                                              priority=GLib.PRIORITY_LOW)
+            return
+
+        usage_percent = self.cpu_usage_tracker.usage()
+        if usage_percent < self.max_cpu_usage:
+            self.interval *= 0.9
+            self.log("Thumbnailing sped up to a %.1f ms interval", self.interval)
+        else:
+            self.interval *= 1.1
+            self.log("Thumbnailing slowed down to a %.1f ms interval", self.interval)
+        self.cpu_usage_tracker.reset()
+        self._dispatch_id = GLib.timeout_add(self.interval, self._dispatch_cb,
+                                             priority=GLib.PRIORITY_LOW)
+
+    def _dispatch_cb(self):
+        self._dispatch_id = 0
+
+        while self._queue and \
+                (self._idle_workers or len(self._workers) < self.max_workers):
+            job = heapq.heappop(self._queue)[2]
+            if job.cancelled:
+                continue
+
+            if self._busy_since is None:
+                self._busy_since = time.time()
+                self._generated = 0
+
+            worker = self._take_worker(job)
+            worker.process(job)
+
+        if not self._queue and len(self._idle_workers) == len(self._workers):
+            self._all_done()
+
+        # Stop calling me.
+        return False
+
+    def _take_worker(self, job):
+        """Gets an idle worker for the job, or creates a new one."""
+        for worker in self._idle_workers:
+            if worker.uri == job.uri and worker.height == job.height:
+                # Reuse the pipeline.
+                self._idle_workers.remove(worker)
+                return worker
+
+        if len(self._workers) < self.max_workers:
+            worker = ThumbnailWorker(self)
+            self._workers.append(worker)
+            return worker
+
+        return self._idle_workers.pop(0)
+
+    def _all_done(self):
+        """Releases the pipelines when there is nothing left to do."""
+        if self._busy_since is not None:
+            self._last_thumbs_per_second = self.thumbs_per_second
+            self.debug("Generated %d thumbnails at %.1f thumbs/s with %d workers",
+                       self._generated, self._last_thumbs_per_second,
+                       len(self._workers))
+            self._busy_since = None
+
+        for worker in self._workers:
+            worker.release()
+        self._workers = []
+        self._idle_workers = []
+
+
 class PreviewGeneratorManager(Loggable):
-    """Manager for running the previewers."""
+    """Manager for running the previewers.
+
+    The work for the elements in the visible range of the timeline is done
+    first, then the work for the elements closer to it.
+
+    Attributes:
+        viewport (Tuple[int, int]): The visible range of the timeline,
+            in nanoseconds, or None if unknown.
+        playhead (int): The position of the playhead, in nanoseconds.
+    """
 
     def __init__(self):
         Loggable.__init__(self)
@@ -309,6 +980,12 @@ class PreviewGeneratorManager(Loggable):
             GES.TrackType.VIDEO: []
         }
         self._running = True
+        # The pool of pipelines generating the thumbnails.
+        self.thumbnailer = ThumbnailEngine()
+
+        self.viewport = None
+        self.playhead = 0
+        self.__reprioritize_id = 0
 
     def add_previewer(self, previewer):
         """Adds the specified previewer to the queue.
@@ -326,7 +1003,61 @@ class PreviewGeneratorManager(Loggable):
         if not self._previewers[track_type] and current is None:
             self._start_previewer(previewer)
         else:
-            self._previewers[track_type].insert(0, previewer)
+            self._previewers[track_type].append(previewer)
+
+    def get_priority(self, start, end):
+        """Computes the priority of the work for a range of the timeline.
+
+        Args:
+            start (int): The start of the range, in nanoseconds.
+            end (int): The end of the range, in nanoseconds.
+
+        Returns:
+            int: The lower, the sooner the work should be done. Visible
+                ranges get a priority between 0 and the width of the
+                viewport, depending on how far they are from the playhead.
+        """
+        if self.viewport is None:
+            return 0
+
+        viewport_start, viewport_end = self.viewport
+        width = viewport_end - viewport_start
+        if end < viewport_start:
+            return width + 1 + viewport_start - end
+        if start > viewport_end:
+            return width + 1 + start - viewport_end
+        if start <= self.playhead <= end:
+            return 0
+        return min(abs(start - self.playhead), abs(end - self.playhead), width)
+
+    def set_viewport(self, start, end):
+        """Sets the visible range of the timeline.
+
+        Args:
+            start (int): The start of the visible range, in nanoseconds.
+            end (int): The end of the visible range, in nanoseconds.
+        """
+        if self.viewport == (start, end):
+            return
+
+        self.viewport = (start, end)
+        if not self.__reprioritize_id:
+            # Reorder the work only once when scrolling continuously.
+            self.__reprioritize_id = GLib.idle_add(self.__reprioritize_cb)
+
+    def __reprioritize_cb(self):
+        self.__reprioritize_id = 0
+        self.thumbnailer.reprioritize(self.__job_priority)
+        # Stop calling me.
+        return False
+
+    @staticmethod
+    def __job_priority(job):
+        if not isinstance(job.owner, Previewer):
+            return job.priority
+        if job.end is not None:
+            return job.owner.get_priority()
+        return job.owner.get_priority(job.position)
 
     def _start_previewer(self, previewer):
         self._current_previewers[previewer.track_type] = previewer
@@ -337,6 +1068,7 @@ class PreviewGeneratorManager(Loggable):
     def paused(self, interrupt=False):
         """Pauses (and flushes if interrupt=True) managed previewers."""
         if interrupt:
+            self.thumbnailer.stop()
             for previewer in list(self._current_previewers.values()):
                 previewer.stop_generation()
 
@@ -344,6 +1076,7 @@ class PreviewGeneratorManager(Loggable):
                 for previewer in previewers:
                     previewer.stop_generation()
         else:
+            self.thumbnailer.pause()
             for previewer in list(self._current_previewers.values()):
                 previewer.pause_generation()
 
@@ -359,6 +1092,7 @@ class PreviewGeneratorManager(Loggable):
             raise
         finally:
             self._running = True
+            self.thumbnailer.resume()
             for track_type in self._previewers:
                 self.__start_next_previewer(track_type)
 
@@ -373,8 +1107,12 @@ class PreviewGeneratorManager(Loggable):
         if not self._running:
             return
 
-        if self._previewers[track_type]:
-            self._start_previewer(self._previewers[track_type].pop())
+        previewers = self._previewers[track_type]
+        if previewers:
+            # The first one with the lowest priority.
+            previewer = min(previewers, key=lambda previewer: previewer.get_priority())
+            previewers.remove(previewer)
+            self._start_previewer(previewer)
 
 
 class Previewer(Gtk.Layout):
@@ -382,6 +1120,7 @@ class Previewer(Gtk.Layout):
 
     Attributes:
         track_type (GES.TrackType): The type of content.
+        ges_elem (GES.TrackElement): The previewed element.
     """
 
     # We only need one PreviewGeneratorManager to manage all previewers.
@@ -405,6 +1144,24 @@ class Previewer(Gtk.Layout):
         """Lets the PreviewGeneratorManager control our execution."""
         Previewer.manager.add_previewer(self)
 
+    def get_priority(self, position=None):
+        """Gets the priority of the work for the previewed element.
+
+        Args:
+            position (Optional[int]): A position in the asset, if only the
+                work for this position is considered.
+
+        Returns:
+            int: The lower, the sooner the work should be done.
+        """
+        start = self.ges_elem.props.start
+        if position is None:
+            end = start + self.ges_elem.props.duration
+            return Previewer.manager.get_priority(start, end)
+
+        timeline_position = start + position - self.ges_elem.props.in_point
+        return Previewer.manager.get_priority(timeline_position, timeline_position)
+
     def set_selected(self, selected):
         """Marks this instance as being selected."""
         pass
@@ -417,10 +1174,15 @@ class Previewer(Gtk.Layout):
 class VideoPreviewer(Previewer, Zoomable, Loggable):
     """A video previewer widget, drawing thumbnails.
 
+    The thumbnails are generated by the ThumbnailEngine of the manager.
+    The visible thumbnails are painted on a single cairo surface.
+
     Attributes:
         ges_elem (GES.TrackElement): The previewed element.
-        thumbs (dict): Maps (quantized) times to Thumbnail widgets.
+        thumbs (dict): Maps (quantized) times to the displayed pixbufs,
+            or to None when the thumbnail is not available yet.
         thumb_cache (ThumbnailCache): The pixmaps persistent cache.
+        thumb_level (int): The resolution level of the displayed thumbnails.
     """
 
     # We could define them in Previewer, but for some reason they are ignored.
@@ -437,32 +1199,36 @@ class VideoPreviewer(Previewer, Zoomable, Loggable):
         self.uri = quote_uri(get_proxy_target(ges_elem).props.id)
 
         self.__start_id = 0
-        self.__preroll_timeout_id = 0
-        self._thumb_cb_id = 0
 
-        # The thumbs to be generated.
+        # The positions of the thumbs to be generated.
         self.queue = []
-        # The position for which a thumbnail is currently being generated.
-        self.position = -1
+        # Maps positions to the ThumbnailJobs being processed.
+        self._jobs = {}
+        # The ThumbnailJob playing the clip in a single pass, if any.
+        self._linear_job = None
+        # Whether the clip has been played in a single pass already.
+        self._linear_tried = False
         # The positions for which we failed to get a pixbuf.
         self.failures = set()
-        self._thumb_cb_id = None
 
         self.thumbs = {}
+        self.thumb_level = 0
         self.thumb_height = THUMB_HEIGHT
         self.thumb_width = 0
+        # The width of the full resolution thumbnails.
+        self.__full_thumb_width = 0
+        self.__opacity = 1.0
+
+        # The surface on which the thumbnails are painted.
+        self.surface = None
+        # The horizontal position of self.surface, in pixels.
+        self._surface_x = 0
 
         self.__image_pixbuf = None
         if not isinstance(ges_elem, GES.ImageSource):
             self.thumb_cache = ThumbnailCache.get(self.uri)
             self._ensure_proxy_thumbnails_cache()
-            self.thumb_width, unused_height = self.thumb_cache.image_size
-        self.pipeline = None
-        self.gdkpixbufsink = None
-
-        self.cpu_usage_tracker = CPUUsageTracker()
-        # Initial delay before generating the next thumbnail, in millis.
-        self.interval = 500
+            self.__full_thumb_width, unused_height = self.thumb_cache.image_size
 
         # Connect signals and fire things up
         self.ges_elem.connect("notify::in-point", self._inpoint_changed_cb)
@@ -472,159 +1238,161 @@ class VideoPreviewer(Previewer, Zoomable, Loggable):
 
         self.connect("notify::height-request", self._height_changed_cb)
 
-    def pause_generation(self):
-        if self.pipeline:
-            self.pipeline.set_state(Gst.State.READY)
+    def _start_thumbnailing_cb(self):
+        if not self.__start_id:
+            # Can happen if stopGeneration is called because the clip has been
+            # removed from the timeline after the PreviewGeneratorManager
+            # started this job.
+            return False
 
-    def _setup_pipeline(self):
-        """Creates the pipeline.
+        self.__start_id = None
 
-        It has the form "playbin ! thumbnailsink" where thumbnailsink
-        is a Bin made out of "videorate ! capsfilter ! gdkpixbufsink"
-        """
-        if self.pipeline:
-            # Generation was just PAUSED... keep going
-            # bringing the pipeline back to PAUSED.
-            self.pipeline.set_state(Gst.State.PAUSED)
-            return
+        if isinstance(self.ges_elem, GES.ImageSource):
+            self.debug("Generating thumbnail for image: %s", path_from_uri(self.uri))
+            self.__image_pixbuf = GdkPixbuf.Pixbuf.new_from_file_at_scale(
+                Gst.uri_get_location(self.uri), -1, self.thumb_height, True)
+            self._update_thumbnails()
+        else:
+            if not self.__full_thumb_width:
+                self.debug("Finding thumb width")
+                # The thumb_width will be set when the first thumbnail arrives.
+                self.queue = [quantize(self.ges_elem.props.in_point, THUMB_PERIOD)]
+            else:
+                # Update the thumbnails with what we already have, if anything.
+                self._update_thumbnails()
 
-        pipeline = Gst.parse_launch(
-            "uridecodebin uri={uri} name=decode ! "
-            "videoconvert ! "
-            "videorate ! "
-            "videoscale method=lanczos ! "
-            "capsfilter caps=video/x-raw,format=(string)RGBA,height=(int){height},"
-            "pixel-aspect-ratio=(fraction)1/1,framerate={thumbs_per_second}/1 ! "
-            "gdkpixbufsink name=gdkpixbufsink".format(
-                uri=self.uri,
-                height=self.thumb_height,
-                thumbs_per_second=int(Gst.SECOND / THUMB_PERIOD)))
-
-        # Get the gdkpixbufsink which contains the the sinkpad.
-        self.gdkpixbufsink = pipeline.get_by_name("gdkpixbufsink")
-
-        decode = pipeline.get_by_name("decode")
-        decode.connect("autoplug-select", self._autoplug_select_cb)
+            if self.queue:
+                self.debug("Generating thumbnails for video: %s, %s", path_from_uri(self.uri), self.queue)
+                self._submit_jobs()
 
-        self.__preroll_timeout_id = GLib.timeout_add_seconds(MAX_BRINGING_TO_PAUSED_DURATION,
-                                                             self.__preroll_timed_out_cb)
-        pipeline.get_bus().add_signal_watch()
-        pipeline.get_bus().connect("message", self.__bus_message_cb)
-        pipeline.set_state(Gst.State.PAUSED)
-        self.pipeline = pipeline
+        # The thumbnailer takes it from here.
+        self.emit("done")
 
-    def _schedule_next_thumb_generation(self):
-        """Schedules the generation of the next thumbnail, or stop.
+        # Stop calling me, I started already.
+        return False
 
-        Checks the CPU usage and adjusts the waiting time at which the next
-        thumbnail will be generated +/- 10%. Even then, it will only
-        happen when the gobject loop is idle to avoid blocking the UI.
+    def _submit_jobs(self):
+        """Hands out the missing thumbnails to the thumbnailer."""
+        thumbnailer = Previewer.manager.thumbnailer
+        if not self._linear_tried and self._should_play_linearly():
+            self.debug("Generating the thumbnails in a single pass for: %s",
+                       path_from_uri(self.uri))
+            self._linear_tried = True
+            self._linear_job = thumbnailer.add_job(
+                self.uri, quantize(self.ges_elem.props.in_point, THUMB_PERIOD),
+                self.__thumbnail_cb,
+                end=self.ges_elem.props.in_point + self.ges_elem.props.duration,
+                done_callback=self.__linear_job_done_cb,
+                priority=self.get_priority(),
+                height=THUMB_HEIGHT,
+                owner=self)
+
+        queued = set(self.queue)
+        for position, job in list(self._jobs.items()):
+            if position not in queued or self.__linearly_generated(position):
+                job.cancelled = True
+                del self._jobs[position]
+
+        for position in self.queue:
+            if self.__linearly_generated(position):
+                continue
+            job = self._jobs.get(position)
+            if job and not job.cancelled:
+                continue
+            self._jobs[position] = thumbnailer.add_job(
+                self.uri, position, self.__thumbnail_cb,
+                priority=self.get_priority(position),
+                height=THUMB_HEIGHT, tolerance=THUMB_KEYFRAME_TOLERANCE,
+                owner=self)
+
+    def _should_play_linearly(self):
+        """Checks whether playing the clip is faster than seeking.
+
+        Seeking for each thumbnail involves decoding from the previous
+        keyframe, so when most of the densely displayed thumbnails are
+        missing, it's faster to decode the clip once.
         """
-        if self._thumb_cb_id is not None:
-            # A thumb has already been scheduled.
-            return
+        if len(self.queue) < LINEAR_THUMBNAILING_MIN_MISSING:
+            return False
 
-        if not self.queue:
-            # Nothing left to do.
-            self.debug("Thumbnails generation complete")
-            self.stop_generation()
-            return
+        if self.thumb_interval > LINEAR_THUMBNAILING_MAX_INTERVAL:
+            return False
 
-        usage_percent = self.cpu_usage_tracker.usage()
-        if usage_percent < self._max_cpu_usage:
-            self.interval *= 0.9
-            self.log("Thumbnailing sped up to a %.1f ms interval for `%s`",
-                     self.interval, path_from_uri(self.uri))
-        else:
-            self.interval *= 1.1
-            self.log("Thumbnailing slowed down to a %.1f ms interval for `%s`",
-                     self.interval, path_from_uri(self.uri))
-        self.cpu_usage_tracker.reset()
-        self._thumb_cb_id = GLib.timeout_add(self.interval,
-                                             self._create_next_thumb_cb,
-                                             priority=GLib.PRIORITY_LOW)
+        return len(self.queue) >= len(self.thumbs) * LINEAR_THUMBNAILING_MIN_RATIO
 
-    def _start_thumbnailing_cb(self):
-        if not self.__start_id:
-            # Can happen if stopGeneration is called because the clip has been
-            # removed from the timeline after the PreviewGeneratorManager
-            # started this job.
-            return False
+    def __linearly_generated(self, position):
+        """Checks whether the thumbnail is generated by the single pass."""
+        job = self._linear_job
+        return job is not None and job.position <= position < job.end
 
-        self.__start_id = None
+    def __thumbnail_cb(self, job, position, pixbuf):
+        if self._jobs.get(position) is job:
+            del self._jobs[position]
 
-        if isinstance(self.ges_elem, GES.ImageSource):
-            self.debug("Generating thumbnail for image: %s", path_from_uri(self.uri))
-            self.__image_pixbuf = GdkPixbuf.Pixbuf.new_from_file_at_scale(
-                Gst.uri_get_location(self.uri), -1, self.thumb_height, True)
-            self.thumb_width = self.__image_pixbuf.props.width
-            self._update_thumbnails()
-            self.emit("done")
+        if not pixbuf:
+            self.failures.add(position)
         else:
-            if not self.thumb_width:
-                self.debug("Finding thumb width")
-                self._setup_pipeline()
-                return False
-
-            # Update the thumbnails with what we already have, if anything.
-            self._update_thumbnails()
-            if self.queue:
-                self.debug("Generating thumbnails for video: %s, %s", path_from_uri(self.uri), self.queue)
-                # When the pipeline status is set to PAUSED,
-                # the first thumbnail generation will be scheduled.
-                self._setup_pipeline()
+            self.thumb_cache[position] = pixbuf
+            if not self.__full_thumb_width:
+                self.__full_thumb_width = pixbuf.props.width
+                self._update_thumbnails()
+            elif self.thumb_level == 0:
+                self._set_pixbuf(position, pixbuf)
             else:
-                self.emit("done")
-
-        # Stop calling me, I started already.
-        return False
-
-    def _create_next_thumb_cb(self):
-        """Creates a missing thumbnail."""
-        self._thumb_cb_id = None
+                self._set_pixbuf(position, self.thumb_cache.get_level(position, self.thumb_level))
 
-        try:
-            self.position = self.queue.pop(0)
-        except IndexError:
-            # The queue is empty. Can happen if _update_thumbnails
-            # has been called in the meanwhile.
-            self.stop_generation()
-            return False
-
-        self.log("Creating thumb at %s", self.position)
-        self.pipeline.seek(1.0,
-                           Gst.Format.TIME,
-                           Gst.SeekFlags.FLUSH | Gst.SeekFlags.ACCURATE,
-                           Gst.SeekType.SET, self.position,
-                           Gst.SeekType.NONE, -1)
+        if not self._jobs and not self._linear_job:
+            self.debug("Thumbnails generation complete")
+            self._ensure_proxy_thumbnails_cache()
+            self.thumb_cache.pack()
 
-        # Stop calling me.
-        # The seek operation will generate an ASYNC_DONE message on the bus,
-        # and then the next thumbnail generation operation will be scheduled.
-        return False
+    def __linear_job_done_cb(self, job):
+        if self._linear_job is job:
+            self._linear_job = None
+        # Seek for the thumbnails which have not been generated, if any.
+        self._update_thumbnails()
+        if not self._jobs:
+            self.debug("Thumbnails generation complete")
+            self._ensure_proxy_thumbnails_cache()
+            self.thumb_cache.pack()
 
     @property
     def thumb_interval(self):
         """Gets the interval for which a thumbnail is displayed.
 
+        The intervals form coarser and coarser time levels, each twice as
+        long as the previous one, so the thumbnails displayed at a zoom
+        level are also displayed at the more detailed zoom levels.
+
         Returns:
-            int: a duration in nanos, multiple of THUMB_PERIOD.
+            int: a duration in nanos, power of two multiple of THUMB_PERIOD.
         """
         interval = Zoomable.pixelToNs(self.thumb_width + THUMB_MARGIN_PX)
-        # Make sure the thumb interval is a multiple of THUMB_PERIOD.
-        quantized = quantize(interval, THUMB_PERIOD)
+        # Make sure we don't show thumbs more often than THUMB_PERIOD.
+        quantized = THUMB_PERIOD
         # Make sure the quantized thumb interval fits
         # the thumb and the margin.
-        if quantized < interval:
-            quantized += THUMB_PERIOD
-        # Make sure we don't show thumbs more often than THUMB_PERIOD.
-        return max(THUMB_PERIOD, quantized)
+        while quantized < interval:
+            quantized *= 2
+        return quantized
+
+    def _update_thumb_size(self):
+        """Picks the lowest resolution level which fills the previewer."""
+        if isinstance(self.ges_elem, GES.ImageSource):
+            self.thumb_width = self.__image_pixbuf.props.width if self.__image_pixbuf else 0
+            return
+
+        height = self.props.height_request - 2 * THUMB_MARGIN_PX
+        self.thumb_level = get_thumb_level(height) if height > 0 else 0
+        self.thumb_height = THUMB_HEIGHT >> self.thumb_level
+        self.thumb_width = max(1, self.__full_thumb_width >> self.thumb_level) if self.__full_thumb_width else 0
 
     def _update_thumbnails(self):
         """Updates the thumbnail widgets for the clip at the current zoom."""
+        self._update_thumb_size()
         if not self.thumb_width:
-            # The thumb_width will be available when pipeline has been started
-            # or the __image_pixbuf is ready.
+            # The thumb_width will be available when the first thumbnail
+            # has been generated or the __image_pixbuf is ready.
             return
 
         thumbs = {}
@@ -632,92 +1400,97 @@ class VideoPreviewer(Previewer, Zoomable, Loggable):
         interval = self.thumb_interval
         element_left = quantize(self.ges_elem.props.in_point, interval)
         element_right = self.ges_elem.props.in_point + self.ges_elem.props.duration
-        y = (self.props.height_request - self.thumb_height) / 2
         for position in range(element_left, element_right, interval):
-            x = Zoomable.nsToPixel(position) - self.nsToPixel(self.ges_elem.props.in_point)
-            try:
-                thumb = self.thumbs.pop(position)
-                self.move(thumb, x, y)
-            except KeyError:
-                thumb = Thumbnail(self.thumb_width, self.thumb_height)
-                self.put(thumb, x, y)
-
-            thumbs[position] = thumb
             if isinstance(self.ges_elem, GES.ImageSource):
-                thumb.set_from_pixbuf(self.__image_pixbuf)
-                thumb.set_visible(True)
+                thumbs[position] = self.__image_pixbuf
             elif position in self.thumb_cache:
-                pixbuf = self.thumb_cache[position]
-                thumb.set_from_pixbuf(pixbuf)
-                thumb.set_visible(True)
+                thumbs[position] = self.thumb_cache.get_level(position, self.thumb_level)
             else:
-                if position not in self.failures and position != self.position:
+                thumbs[position] = self.__get_placeholder(position, interval)
+                if position not in self.failures:
                     queue.append(position)
-        for thumb in self.thumbs.values():
-            self.remove(thumb)
         self.thumbs = thumbs
         self.queue = queue
+        self.__invalidate_surface()
         if queue:
             self.become_controlled()
 
-    def _set_pixbuf(self, pixbuf):
-        """Sets the pixbuf for the thumbnail at the expected position."""
-        position = self.position
-        self.position = -1
+    def __invalidate_surface(self):
+        if self.surface:
+            self.surface.finish()
+            self.surface = None
+        self.queue_draw()
+
+    def __thumb_x(self, position):
+        """Gets the horizontal position of a thumbnail, in pixels."""
+        return Zoomable.nsToPixel(position) - self.nsToPixel(self.ges_elem.props.in_point)
 
-        try:
-            thumb = self.thumbs[position]
-        except KeyError:
-            # Can happen because we don't stop the pipeline before
-            # updating the thumbnails in _update_thumbnails.
+    def __paint_thumb(self, context, position, pixbuf):
+        """Paints a thumbnail on self.surface."""
+        x = self.__thumb_x(position) - self._surface_x
+        y = (self.surface.get_height() - self.thumb_height) / 2
+        Gdk.cairo_set_source_pixbuf(context, pixbuf, x, y)
+        context.rectangle(x, y, self.thumb_width, self.thumb_height)
+        context.fill()
+
+    def do_draw(self, context):
+        if not self.thumbs:
+            # Nothing to draw.
             return
-        thumb.set_from_pixbuf(pixbuf)
-        self.thumb_cache[position] = pixbuf
-        self.queue_draw()
 
-    def zoomChanged(self):
-        self._update_thumbnails()
+        rect = Gdk.cairo_get_clip_rectangle(context)[1]
+        height = self.get_allocation().height
+        if not self.surface or \
+                height != self.surface.get_height() or \
+                rect.x < self._surface_x or \
+                rect.x + rect.width > self._surface_x + self.surface.get_width():
+            if self.surface:
+                self.surface.finish()
+            # The surface is for an extended area, so if the user scrolls
+            # we don't paint all the thumbnails again every time.
+            self._surface_x = max(0, rect.x - THUMBS_SURFACE_EXTRA_PX)
+            surface_width = rect.x + rect.width + THUMBS_SURFACE_EXTRA_PX - self._surface_x
+            self.surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, surface_width, height)
+            surface_context = cairo.Context(self.surface)
+            for position, pixbuf in self.thumbs.items():
+                x = self.__thumb_x(position)
+                if pixbuf and self._surface_x - self.thumb_width < x < self._surface_x + surface_width:
+                    self.__paint_thumb(surface_context, position, pixbuf)
 
-    def __bus_message_cb(self, unused_bus, message):
-        if message.src == self.pipeline and \
-                message.type == Gst.MessageType.STATE_CHANGED:
-            if message.parse_state_changed()[1] == Gst.State.PAUSED:
-                # The pipeline is ready to be used.
-                if self.__preroll_timeout_id:
-                    GLib.source_remove(self.__preroll_timeout_id)
-                    self.__preroll_timeout_id = 0
-                    sinkpad = self.gdkpixbufsink.get_static_pad("sink")
-                    neg_caps = sinkpad.get_current_caps()[0]
-                    self.thumb_width = neg_caps["width"]
+        context.set_operator(cairo.OPERATOR_OVER)
+        context.set_source_surface(self.surface, self._surface_x, 0)
+        context.paint_with_alpha(self.__opacity)
 
-                self._update_thumbnails()
-        elif message.src == self.gdkpixbufsink and \
-                message.type == Gst.MessageType.ELEMENT and \
-                self.__preroll_timeout_id == 0:
-            # We got a thumbnail pixbuf.
-            struct = message.get_structure()
-            struct_name = struct.get_name()
-            if struct_name == "preroll-pixbuf":
-                pixbuf = struct.get_value("pixbuf")
-                self._set_pixbuf(pixbuf)
-        elif message.src == self.pipeline and \
-                message.type == Gst.MessageType.ASYNC_DONE:
-            if self.position >= 0:
-                self.warning("Thumbnail generation failed at %s", self.position)
-                self.failures.add(self.position)
-                self.position = -1
-            self._schedule_next_thumb_generation()
-        return Gst.BusSyncReply.PASS
+    def __get_placeholder(self, position, interval):
+        """Gets a pixbuf to show until the exact thumbnail is generated.
 
-    def __preroll_timed_out_cb(self):
-        self.stop_generation()
+        The nearest available thumbnail is used, taken at the lowest
+        resolution, which is the fastest to decode, and scaled up.
 
-    # pylint: disable=no-self-use
-    def _autoplug_select_cb(self, unused_decode, unused_pad, unused_caps, factory):
-        # Don't plug audio decoders / parsers.
-        if "Audio" in factory.get_klass():
-            return True
-        return False
+        Returns:
+            Optional[GdkPixbuf.Pixbuf]: The placeholder, if any.
+        """
+        nearest = self.thumb_cache.get_nearest_position(position, interval // 2)
+        if nearest is None:
+            return None
+        pixbuf = self.thumb_cache.get_level(nearest, THUMB_LEVELS - 1)
+        return pixbuf.scale_simple(self.thumb_width, self.thumb_height,
+                                   GdkPixbuf.InterpType.BILINEAR)
+
+    def _set_pixbuf(self, position, pixbuf):
+        """Sets the pixbuf for the thumbnail at the specified position."""
+        if position not in self.thumbs:
+            # Can happen because the thumbnails have been updated
+            # while the thumbnail was being generated.
+            return
+        self.thumbs[position] = pixbuf
+        if self.surface:
+            self.__paint_thumb(cairo.Context(self.surface), position, pixbuf)
+        x = self.__thumb_x(position)
+        self.queue_draw_area(x, 0, self.thumb_width, self.get_allocation().height)
+
+    def zoomChanged(self):
+        self._update_thumbnails()
 
     def _height_changed_cb(self, unused_widget, unused_param_spec):
         self._update_thumbnails()
@@ -732,12 +1505,10 @@ class VideoPreviewer(Previewer, Zoomable, Loggable):
 
     def set_selected(self, selected):
         if selected:
-            opacity = 0.5
+            self.__opacity = 0.5
         else:
-            opacity = 1.0
-
-        for thumb in self.get_children():
-            thumb.props.opacity = opacity
+            self.__opacity = 1.0
+        self.queue_draw()
 
     def start_generation(self):
         self.debug("Waiting for UI to become idle for: %s",
@@ -757,21 +1528,11 @@ class VideoPreviewer(Previewer, Zoomable, Loggable):
             GLib.source_remove(self.__start_id)
             self.__start_id = None
 
-        if self.__preroll_timeout_id:
-            # Stop waiting for the pipeline to be ready.
-            GLib.source_remove(self.__preroll_timeout_id)
-            self.__preroll_timeout_id = None
-
-        if self._thumb_cb_id:
+        if self._jobs or self._linear_job:
             # Cancel the thumbnailing.
-            GLib.source_remove(self._thumb_cb_id)
-            self._thumb_cb_id = None
-
-        if self.pipeline:
-            self.pipeline.get_bus().remove_signal_watch()
-            self.pipeline.set_state(Gst.State.NULL)
-            self.pipeline.get_state(Gst.CLOCK_TIME_NONE)
-            self.pipeline = None
+            Previewer.manager.thumbnailer.cancel_jobs(self)
+            self._jobs = {}
+            self._linear_job = None
 
         self._ensure_proxy_thumbnails_cache()
         self.emit("done")
@@ -782,44 +1543,360 @@ class VideoPreviewer(Previewer, Zoomable, Loggable):
         Zoomable.__del__(self)
 
 
-class Thumbnail(Gtk.Image):
-    """Simple widget representing a Thumbnail."""
+class ThumbnailStore(Loggable):
+    """Storage for the thumbnails of all the assets.
+
+    Uses a single sqlite3 database in WAL mode, in which the thumbnails are
+    identified by the hash of the asset file, the position and the height.
+    The writes are batched and performed in a single transaction.
+    """
+
+    # The stores by database file.
+    stores_by_dbfile = {}
+
+    def __init__(self, dbfile, max_connections=THUMBS_DB_MAX_CONNECTIONS):
+        Loggable.__init__(self)
+        self.dbfile = dbfile
+        # The idle connections.
+        self._pool = queue.Queue()
+        self._max_connections = max_connections
+        self._num_connections = 0
+        self._lock = threading.Lock()
+        # Maps (filehash, position, height) to the JPEG data not saved yet.
+        self._pending = {}
+        # The ID of the flush event.
+        self.__flush_id = 0
+
+        with self.connection() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS Thumbs "
+                         "(Hash TEXT NOT NULL, "
+                         " Time INTEGER NOT NULL, "
+                         " Height INTEGER NOT NULL, "
+                         " Jpeg BLOB NOT NULL, "
+                         " PRIMARY KEY (Hash, Time, Height)) WITHOUT ROWID")
+            conn.execute("CREATE TABLE IF NOT EXISTS Aliases "
+                         "(Hash TEXT NOT NULL PRIMARY KEY, "
+                         " Target TEXT NOT NULL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS Sprites "
+                         "(Hash TEXT NOT NULL, "
+                         " Height INTEGER NOT NULL, "
+                         " Sheet INTEGER NOT NULL, "
+                         " Columns INTEGER NOT NULL, "
+                         " Positions BLOB NOT NULL, "
+                         " Jpeg BLOB NOT NULL, "
+                         " PRIMARY KEY (Hash, Height, Sheet)) WITHOUT ROWID")
+            conn.commit()
+
+    @classmethod
+    def get(cls):
+        """Gets the store of the current cache directory."""
+        dbfile = os.path.join(xdg_cache_home(), "thumbs.db")
+        if dbfile not in cls.stores_by_dbfile:
+            cls.stores_by_dbfile[dbfile] = ThumbnailStore(dbfile)
+        return cls.stores_by_dbfile[dbfile]
+
+    def __connect(self):
+        conn = sqlite3.connect(self.dbfile, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        # In WAL mode this is safe from corruption, only the last
+        # transactions can be lost in case of power failure.
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    @contextlib.contextmanager
+    def connection(self):
+        """Provides a connection, waiting for one if all are being used."""
+        try:
+            conn = self._pool.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                create = self._num_connections < self._max_connections
+                if create:
+                    self._num_connections += 1
+            if create:
+                conn = self.__connect()
+            else:
+                conn = self._pool.get()
+
+        try:
+            yield conn
+        finally:
+            self._pool.put(conn)
+
+    def resolve(self, filehash):
+        """Gets the hash under which the thumbnails of a file are stored."""
+        with self.connection() as conn:
+            row = conn.execute("SELECT Target FROM Aliases WHERE Hash = ?",
+                               (filehash,)).fetchone()
+        if not row:
+            return filehash
+        return row[0]
+
+    def set_alias(self, filehash, target):
+        """Makes the thumbnails of a file be the ones of another file."""
+        target = self.resolve(target)
+        if filehash == target:
+            return
+        with self.connection() as conn:
+            with conn:
+                conn.execute("INSERT OR REPLACE INTO Aliases VALUES (?, ?)",
+                             (filehash, target))
+
+    def positions(self, filehash, height):
+        """Gets the positions of the thumbnails of a file."""
+        with self.connection() as conn:
+            rows = conn.execute("SELECT Time FROM Thumbs WHERE Hash = ? AND Height = ?",
+                                (filehash, height)).fetchall()
+        positions = {row[0] for row in rows}
+        with self._lock:
+            positions.update(key[1] for key in self._pending
+                             if key[0] == filehash and key[2] == height)
+        return positions
+
+    def get_jpeg(self, filehash, position, height):
+        """Gets the JPEG data of a thumbnail, or None if it's missing."""
+        with self._lock:
+            jpeg = self._pending.get((filehash, position, height))
+        if jpeg is not None:
+            return jpeg
+
+        with self.connection() as conn:
+            row = conn.execute("SELECT Jpeg FROM Thumbs "
+                               "WHERE Hash = ? AND Time = ? AND Height = ?",
+                               (filehash, position, height)).fetchone()
+        if not row:
+            return None
+        return row[0]
+
+    def get_any_jpeg(self, filehash, height):
+        """Gets the JPEG data of any thumbnail of a file, or None."""
+        with self.connection() as conn:
+            row = conn.execute("SELECT Jpeg FROM Thumbs "
+                               "WHERE Hash = ? AND Height = ? LIMIT 1",
+                               (filehash, height)).fetchone()
+        if row:
+            return row[0]
+
+        with self._lock:
+            for key, jpeg in self._pending.items():
+                if key[0] == filehash and key[2] == height:
+                    return jpeg
+        return None
+
+    def get_sprites_index(self, filehash, height):
+        """Gets the layout of the sprite sheets of a file.
+
+        Returns:
+            List[Tuple[int, int, List[int]]]: The sheet number, the number of
+                columns and the positions of the packed thumbnails, in order,
+                for each sprite sheet.
+        """
+        with self.connection() as conn:
+            rows = conn.execute("SELECT Sheet, Columns, Positions FROM Sprites "
+                                "WHERE Hash = ? AND Height = ? ORDER BY Sheet",
+                                (filehash, height)).fetchall()
+        return [(sheet, columns, array.array("q", bytes(positions)).tolist())
+                for sheet, columns, positions in rows]
+
+    def get_sprite_jpeg(self, filehash, height, sheet):
+        """Gets the JPEG data of a sprite sheet, or None if it's missing."""
+        with self.connection() as conn:
+            row = conn.execute("SELECT Jpeg FROM Sprites "
+                               "WHERE Hash = ? AND Height = ? AND Sheet = ?",
+                               (filehash, height, sheet)).fetchone()
+        if not row:
+            return None
+        return row[0]
+
+    def put_sprites(self, filehash, height, sheets):
+        """Replaces the sprite sheets of a file.
+
+        Args:
+            filehash (str): The hash of the asset file.
+            height (int): The height of the packed thumbnails.
+            sheets (List[Tuple[int, List[int], bytes]]): The number of
+                columns, the positions of the packed thumbnails and the
+                JPEG data of each sprite sheet.
+        """
+        rows = [(filehash, height, sheet, columns,
+                 sqlite3.Binary(array.array("q", positions).tobytes()),
+                 sqlite3.Binary(jpeg))
+                for sheet, (columns, positions, jpeg) in enumerate(sheets)]
+        with self.connection() as conn:
+            with conn:
+                conn.execute("DELETE FROM Sprites WHERE Hash = ? AND Height = ?",
+                             (filehash, height))
+                conn.executemany("INSERT INTO Sprites VALUES (?, ?, ?, ?, ?, ?)", rows)
+
+    def put_jpeg(self, filehash, position, height, jpeg):
+        """Schedules the JPEG data of a thumbnail to be saved."""
+        with self._lock:
+            self._pending[(filehash, position, height)] = jpeg
+            num_pending = len(self._pending)
+
+        if num_pending >= THUMBS_DB_BATCH_SIZE:
+            self.flush()
+        elif not self.__flush_id:
+            self.__flush_id = GLib.timeout_add_seconds(THUMBS_DB_FLUSH_INTERVAL,
+                                                       self.__flush_cb)
+
+    def __flush_cb(self):
+        self.__flush_id = 0
+        self.flush()
+        # Stop calling me.
+        return False
+
+    def flush(self):
+        """Saves the pending thumbnails in a single transaction."""
+        if self.__flush_id:
+            GLib.source_remove(self.__flush_id)
+            self.__flush_id = 0
+
+        with self._lock:
+            pending = self._pending
+            self._pending = {}
+        if not pending:
+            return
+
+        rows = [(filehash, position, height, sqlite3.Binary(jpeg))
+                for (filehash, position, height), jpeg in pending.items()]
+        with self.connection() as conn:
+            with conn:
+                conn.executemany("INSERT OR REPLACE INTO Thumbs VALUES (?, ?, ?, ?)", rows)
+        self.log("Saved %d thumbnails to %s", len(rows), self.dbfile)
+
+    def migrate(self, filehash, legacy_dbfile, height):
+        """Imports the thumbnails from a legacy per-asset database, if any.
+
+        Args:
+            filehash (str): The hash of the asset file.
+            legacy_dbfile (str): The path of the legacy database.
+            height (int): The height of the thumbnails in the legacy database.
+        """
+        if os.path.islink(legacy_dbfile):
+            # The legacy proxy caches are symlinks to the target caches.
+            target = os.path.basename(os.readlink(legacy_dbfile))
+            self.set_alias(filehash, target)
+        elif os.path.exists(legacy_dbfile):
+            self.info("Migrating thumbnails cache %s", legacy_dbfile)
+            with self.connection() as conn:
+                try:
+                    conn.execute("ATTACH DATABASE ? AS legacy", (legacy_dbfile,))
+                    try:
+                        with conn:
+                            conn.execute("INSERT OR IGNORE INTO Thumbs "
+                                         "SELECT ?, Time, ?, Jpeg FROM legacy.Thumbs",
+                                         (filehash, height))
+                    finally:
+                        conn.execute("DETACH DATABASE legacy")
+                except sqlite3.Error as e:
+                    # Keep the legacy database, for trying again later.
+                    self.warning("Failed to migrate %s: %s", legacy_dbfile, e)
+                    return
+        else:
+            return
+
+        os.remove(legacy_dbfile)
+
+
+class PixbufCache(Loggable):
+    """LRU cache of decoded thumbnails, bounded by their memory usage.
+
+    Attributes:
+        max_bytes (int): The memory budget, in bytes.
+        size (int): The memory used by the pixbufs, in bytes.
+        hits (int): The number of lookups which found a pixbuf.
+        misses (int): The number of lookups which did not find a pixbuf.
+    """
+
+    def __init__(self, max_bytes):
+        Loggable.__init__(self)
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        # Maps keys to pixbufs, the least recently used first.
+        self._pixbufs = collections.OrderedDict()
+
+    @staticmethod
+    def _pixbuf_size(pixbuf):
+        return pixbuf.get_rowstride() * pixbuf.get_height()
+
+    def get(self, key):
+        """Gets the pixbuf for the specified key, or None if missing."""
+        pixbuf = self._pixbufs.get(key)
+        if pixbuf is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._pixbufs.move_to_end(key)
+        return pixbuf
+
+    def put(self, key, pixbuf):
+        """Adds a pixbuf, evicting the least recently used ones if needed."""
+        old_pixbuf = self._pixbufs.pop(key, None)
+        if old_pixbuf is not None:
+            self.size -= self._pixbuf_size(old_pixbuf)
+
+        self._pixbufs[key] = pixbuf
+        self.size += self._pixbuf_size(pixbuf)
+        while self.size > self.max_bytes and self._pixbufs:
+            unused_key, evicted = self._pixbufs.popitem(last=False)
+            self.size -= self._pixbuf_size(evicted)
 
-    def __init__(self, width, height):
-        Gtk.Image.__init__(self)
-        self.props.width_request = width
-        self.props.height_request = height
+    def remove(self, key):
+        """Removes the pixbuf for the specified key, if any."""
+        pixbuf = self._pixbufs.pop(key, None)
+        if pixbuf is not None:
+            self.size -= self._pixbuf_size(pixbuf)
+
+    def clear(self):
+        """Removes all the pixbufs."""
+        self._pixbufs.clear()
+        self.size = 0
 
 
 class ThumbnailCache(Loggable):
     """Cache for the thumbnails of an asset.
 
-    Uses a separate sqlite3 database for each asset.
+    The thumbnails of all the assets are kept in the shared ThumbnailStore.
+    Besides the full resolution, each thumbnail is kept at THUMB_LEVELS - 1
+    lower resolutions, each half the size of the previous one.
+
+    Once generated, the thumbnails are also packed in sprite sheets, so
+    loading the filmstrip of a clip takes a single read and decode
+    instead of one for each thumbnail.
+
+    Attributes:
+        height (int): The height of the full resolution thumbnails.
+        positions (set): The positions of the available thumbnails.
     """
 
     # The cache of caches.
     caches_by_uri = {}
 
-    def __init__(self, uri):
+    # The decoded thumbnails of all the assets.
+    pixbufs = PixbufCache(max_bytes=GlobalSettings.previewers_pixbuf_cache_size * 1024 * 1024)
+
+    def __init__(self, uri, height=THUMB_HEIGHT):
         Loggable.__init__(self)
-        self._filehash = hash_file(Gst.uri_get_location(uri))
-        thumbs_cache_dir = get_dir(os.path.join(xdg_cache_home(), "thumbs"))
-        self._dbfile = os.path.join(thumbs_cache_dir, self._filehash)
-        self._db = sqlite3.connect(self._dbfile)
-        self._cur = self._db.cursor()
-        self._cur.execute("CREATE TABLE IF NOT EXISTS Thumbs "
-                          "(Time INTEGER NOT NULL PRIMARY KEY, "
-                          " Jpeg BLOB NOT NULL)")
+        self._store = ThumbnailStore.get()
+        filehash = hash_file(Gst.uri_get_location(uri))
+        legacy_dbfile = os.path.join(xdg_cache_home(), "thumbs", filehash)
+        self._store.migrate(filehash, legacy_dbfile, THUMB_HEIGHT)
+        self._filehash = self._store.resolve(filehash)
+        self.height = height
         # The cached (width, height) of the images.
         self._image_size = (0, 0)
         # The cached positions available in the database.
-        self.positions = self.__existing_positions()
-        # The ID of the autosave event.
-        self.__autosave_id = None
-
-    def __existing_positions(self):
-        self._cur.execute("SELECT Time FROM Thumbs")
-        return {row[0] for row in self._cur.fetchall()}
+        self.positions = self._store.positions(self._filehash, self.height)
+        # The sorted positions, computed when needed.
+        self.__sorted_positions = None
+        # Maps heights to dicts mapping the positions of the packed
+        # thumbnails to (sheet, columns, index) tuples.
+        self.__sprites_cells = {}
+        self.__packer = None
 
     @classmethod
     def get(cls, obj):
@@ -850,14 +1927,7 @@ class ThumbnailCache(Loggable):
             uri (str): The place where to copy/save the ThumbnailCache
         """
         filehash = hash_file(Gst.uri_get_location(uri))
-        thumbs_cache_dir = get_dir(os.path.join(xdg_cache_home(), "thumbs"))
-        dbfile = os.path.join(thumbs_cache_dir, filehash)
-
-        try:
-            os.remove(dbfile)
-        except FileNotFoundError:
-            pass
-        os.symlink(self._dbfile, dbfile)
+        self._store.set_alias(filehash, self._filehash)
 
     @property
     def image_size(self):
@@ -866,11 +1936,10 @@ class ThumbnailCache(Loggable):
         Returns:
             List[int]: The width and height of the images in the cache.
         """
-        if self._image_size[0] is 0:
-            self._cur.execute("SELECT * FROM Thumbs LIMIT 1")
-            row = self._cur.fetchone()
-            if row:
-                pixbuf = self.__pixbuf_from_row(row)
+        if self._image_size[0] == 0:
+            jpeg = self._store.get_any_jpeg(self._filehash, self.height)
+            if jpeg:
+                pixbuf = self.__pixbuf_from_jpeg(jpeg)
                 self._image_size = (pixbuf.get_width(), pixbuf.get_height())
         return self._image_size
 
@@ -883,10 +1952,184 @@ class ThumbnailCache(Loggable):
         position = sorted(list(self.positions))[middle]
         return self[position]
 
+    def get_nearest_position(self, position, max_distance):
+        """Gets the closest position for which a thumbnail exists.
+
+        Args:
+            position (int): The position for which a thumbnail is needed.
+            max_distance (int): How far from `position` to look.
+
+        Returns:
+            Optional[int]: The closest available position, if any.
+        """
+        if self.__sorted_positions is None:
+            self.__sorted_positions = sorted(self.positions)
+        positions = self.__sorted_positions
+        index = bisect.bisect_left(positions, position)
+        candidates = positions[max(0, index - 1):index + 1]
+        if not candidates:
+            return None
+        nearest = min(candidates, key=lambda candidate: abs(candidate - position))
+        if abs(nearest - position) > max_distance:
+            return None
+        return nearest
+
+    def get_level(self, position, level):
+        """Gets the GdkPixbuf.Pixbuf for the specified resolution level.
+
+        Args:
+            position (int): The position of the thumbnail.
+            level (int): The resolution level, 0 being the full resolution.
+
+        Returns:
+            GdkPixbuf.Pixbuf: The thumbnail at the specified resolution.
+        """
+        height = self.height >> level
+        key = (self._filehash, position, height)
+        pixbuf = self.pixbufs.get(key)
+        if pixbuf is not None:
+            return pixbuf
+
+        pixbuf = self.__get_sprite(position, height)
+        if pixbuf is not None:
+            return pixbuf
+
+        jpeg = self._store.get_jpeg(self._filehash, position, height)
+        if jpeg is None:
+            if level == 0:
+                raise KeyError(position)
+            # Can happen when the thumbnails have been migrated from
+            # the legacy cache, which had only the full resolution.
+            pixbuf = self.__scale(self[position], level)
+            self.__save(position, height, pixbuf)
+        else:
+            pixbuf = self.__pixbuf_from_jpeg(jpeg)
+            self.pixbufs.put(key, pixbuf)
+        return pixbuf
+
+    def __get_sprites_cells(self, height):
+        cells = self.__sprites_cells.get(height)
+        if cells is None:
+            cells = {}
+            for sheet, columns, positions in self._store.get_sprites_index(self._filehash, height):
+                for index, position in enumerate(positions):
+                    cells[position] = (sheet, columns, index)
+            self.__sprites_cells[height] = cells
+        return cells
+
+    def __get_sprite(self, position, height):
+        """Gets the thumbnail from the sprite sheet containing it, if any."""
+        cell = self.__get_sprites_cells(height).get(position)
+        if cell is None:
+            return None
+
+        sheet, columns, index = cell
+        key = (self._filehash, height, "sheet", sheet)
+        sheet_pixbuf = self.pixbufs.get(key)
+        if sheet_pixbuf is None:
+            jpeg = self._store.get_sprite_jpeg(self._filehash, height, sheet)
+            if jpeg is None:
+                return None
+            sheet_pixbuf = self.__pixbuf_from_jpeg(jpeg)
+            self.pixbufs.put(key, sheet_pixbuf)
+
+        # The thumbnail shares the memory of the sprite sheet.
+        width = sheet_pixbuf.props.width // columns
+        return sheet_pixbuf.new_subpixbuf((index % columns) * width, (index // columns) * height,
+                                          width, height)
+
+    def pack(self):
+        """Packs the thumbnails in sprite sheets, in a separate thread."""
+        if self.__packer:
+            return
+
+        positions = sorted(self.positions)
+        if not positions or self.positions == set(self.__get_sprites_cells(self.height)):
+            # Nothing new to pack.
+            return
+
+        self.debug("Packing %d thumbnails of %s", len(positions), self._filehash)
+        # Make sure the thumbnails are in the database.
+        self._store.flush()
+        self.__packer = SpritePacker(self._pack_sheets, positions, self.__packed_cb)
+        self.__packer.start()
+
+    def _pack_sheets(self, positions, level):
+        """Creates the sprite sheets of a resolution level.
+
+        Called from the SpritePacker thread, so it must use only the store.
+
+        Returns:
+            List[Tuple[int, List[int], bytes]]: The number of columns, the
+                positions of the packed thumbnails and the JPEG data of each
+                sprite sheet, or None if a thumbnail is missing.
+        """
+        height = self.height >> level
+        sheets = []
+        for start in range(0, len(positions), SPRITE_SHEET_MAX_THUMBS):
+            sheet_positions = positions[start:start + SPRITE_SHEET_MAX_THUMBS]
+            pixbufs = []
+            for position in sheet_positions:
+                jpeg = self._store.get_jpeg(self._filehash, position, height)
+                if jpeg is not None:
+                    pixbufs.append(self.__pixbuf_from_jpeg(jpeg))
+                    continue
+                jpeg = self._store.get_jpeg(self._filehash, position, self.height)
+                if jpeg is None:
+                    return None
+                pixbufs.append(self.__scale(self.__pixbuf_from_jpeg(jpeg), level))
+
+            width = pixbufs[0].props.width
+            columns = min(len(pixbufs), SPRITE_SHEET_COLUMNS)
+            rows = (len(pixbufs) + columns - 1) // columns
+            sheet_pixbuf = GdkPixbuf.Pixbuf.new(GdkPixbuf.Colorspace.RGB, False, 8,
+                                                columns * width, rows * height)
+            sheet_pixbuf.fill(0)
+            for index, pixbuf in enumerate(pixbufs):
+                pixbuf.copy_area(0, 0,
+                                 min(width, pixbuf.props.width),
+                                 min(height, pixbuf.props.height),
+                                 sheet_pixbuf,
+                                 (index % columns) * width, (index // columns) * height)
+            success, jpeg = sheet_pixbuf.save_to_bufferv(
+                "jpeg", ["quality", None], ["90"])
+            if not success:
+                return None
+            sheets.append((columns, sheet_positions, jpeg))
+        return sheets
+
+    def _save_sprites(self, sheets_by_level):
+        """Replaces the sprite sheets with the packed ones.
+
+        Args:
+            sheets_by_level (dict): Maps resolution levels to the sprite
+                sheets returned by `_pack_sheets`.
+        """
+        for level, sheets in sheets_by_level.items():
+            height = self.height >> level
+            # The sheets in the cache might have a different layout.
+            old_sheets = {sheet for sheet, unused_columns, unused_index
+                          in self.__get_sprites_cells(height).values()}
+            for sheet in old_sheets:
+                self.pixbufs.remove((self._filehash, height, "sheet", sheet))
+            self._store.put_sprites(self._filehash, height, sheets)
+            self.__sprites_cells.pop(height, None)
+
+    def __packed_cb(self, sheets_by_level):
+        self.__packer = None
+        self._save_sprites(sheets_by_level)
+        self.debug("Packed the thumbnails of %s", self._filehash)
+
+    @staticmethod
+    def __scale(pixbuf, level):
+        """Scales down the pixbuf of a full resolution thumbnail."""
+        return pixbuf.scale_simple(max(1, pixbuf.props.width >> level),
+                                   max(1, pixbuf.props.height >> level),
+                                   GdkPixbuf.InterpType.BILINEAR)
+
     @staticmethod
-    def __pixbuf_from_row(row):
-        """Returns the GdkPixbuf.Pixbuf from the specified row."""
-        jpeg = row[1]
+    def __pixbuf_from_jpeg(jpeg):
+        """Returns the GdkPixbuf.Pixbuf from the specified JPEG data."""
         loader = GdkPixbuf.PixbufLoader.new()
         loader.write(jpeg)
         loader.close()
@@ -894,54 +2137,261 @@ class ThumbnailCache(Loggable):
         return pixbuf
 
     def __contains__(self, position):
-        """Returns whether a row for the specified position exists in the DB."""
+        """Returns whether a thumbnail for the specified position exists."""
         return position in self.positions
 
     def __getitem__(self, position):
         """Gets the GdkPixbuf.Pixbuf for the specified position."""
-        self._cur.execute("SELECT * FROM Thumbs WHERE Time = ?", (position,))
-        row = self._cur.fetchone()
-        if not row:
-            raise KeyError(position)
-        return self.__pixbuf_from_row(row)
+        return self.get_level(position, 0)
 
     def __setitem__(self, position, pixbuf):
         """Sets a GdkPixbuf.Pixbuf for the specified position."""
+        if not self.__save(position, self.height, pixbuf):
+            return
+        # Precompute the lower resolutions while the pixbuf is at hand.
+        for level in range(1, THUMB_LEVELS):
+            self.__save(position, self.height >> level, self.__scale(pixbuf, level))
+        self.positions.add(position)
+        self.__sorted_positions = None
+
+    def __save(self, position, height, pixbuf):
+        """Stores the pixbuf at the specified resolution."""
         success, jpeg = pixbuf.save_to_bufferv(
             "jpeg", ["quality", None], ["90"])
         if not success:
             self.warning("JPEG compression failed")
-            return
-        blob = sqlite3.Binary(jpeg)
-        # Replace if a row with the same time already exists.
-        self._cur.execute("DELETE FROM Thumbs WHERE  time=?", (position,))
-        self._cur.execute("INSERT INTO Thumbs VALUES (?,?)", (position, blob,))
-        self.positions.add(position)
-        self._schedule_commit()
+            return False
+        self._store.put_jpeg(self._filehash, position, height, jpeg)
+        self.pixbufs.put((self._filehash, position, height), pixbuf)
+        return True
 
-    def _schedule_commit(self):
-        """Schedules an autosave at a random later time."""
-        if self.__autosave_id is not None:
-            # A commit is already scheduled.
-            return
-        # Save after some time, to avoid saving too often.
-        # Randomize to avoid concurrent disk writes.
-        random_time = random.randrange(10, 20)
-        self.__autosave_id = GLib.timeout_add_seconds(random_time, self._autosave_cb)
+    def commit(self):
+        """Saves the cache on disk (in the database)."""
+        self._store.flush()
+        self.log("Saved thumbnail cache file: %s", self._filehash)
+
+
+class SpritePacker(Thread):
+    """Thread packing the thumbnails of an asset in sprite sheets."""
 
-    def _autosave_cb(self):
-        """Handles the autosave event."""
+    def __init__(self, pack_sheets, positions, callback):
+        Thread.__init__(self)
+        self.pack_sheets = pack_sheets
+        self.positions = positions
+        self.callback = callback
+
+    def process(self):
+        sheets_by_level = {}
         try:
-            self.commit()
-        finally:
-            self.__autosave_id = None
-        # Stop calling me.
+            for level in range(THUMB_LEVELS):
+                sheets = self.pack_sheets(self.positions, level)
+                if sheets is None:
+                    self.warning("Failed packing the thumbnails at level %d", level)
+                    continue
+                sheets_by_level[level] = sheets
+        except (GLib.Error, sqlite3.Error) as e:
+            self.warning("Failed packing the thumbnails: %s", e)
+            sheets_by_level = {}
+        # Always report back, otherwise the cache would never pack again.
+        GLib.idle_add(self.callback, sheets_by_level)
+
+
+class SurfaceCache(PixbufCache):
+    """LRU cache of cairo image surfaces, bounded by their memory usage."""
+
+    @staticmethod
+    def _pixbuf_size(pixbuf):
+        return pixbuf.get_stride() * pixbuf.get_height()
+
+
+class WaveformTileRenderer(Thread):
+    """Thread rendering the waveform tiles requested by the previewers.
+
+    The most recently requested tiles are rendered first, as they are the
+    most likely to be still visible.
+    """
+
+    # The renderer shared by the previewers.
+    __renderer = None
+
+    def __init__(self):
+        Thread.__init__(self)
+        self.daemon = True
+        self._jobs = queue.LifoQueue()
+        # Maps the keys of the tiles being rendered to their callbacks.
+        # Used only in the main thread.
+        self._pending = {}
+
+    @classmethod
+    def get(cls):
+        """Gets the renderer shared by the previewers, started."""
+        if not cls.__renderer:
+            cls.__renderer = WaveformTileRenderer()
+            cls.__renderer.start()
+        return cls.__renderer
+
+    def render(self, key, render_func, wanted_func, callback):
+        """Renders a tile.
+
+        Args:
+            key (object): The key identifying the tile.
+            render_func (function): Creates the surface of the tile. Called
+                in the rendering thread.
+            wanted_func (function): Returns whether the tile is still
+                needed. Called in the rendering thread.
+            callback (function): The function called in the main thread
+                with the key and the surface when the tile is rendered.
+        """
+        callbacks = self._pending.get(key)
+        if callbacks is not None:
+            # Already being rendered.
+            if callback not in callbacks:
+                callbacks.append(callback)
+            return
+
+        self._pending[key] = [callback]
+        self._jobs.put((key, render_func, wanted_func))
+
+    def process(self):
+        while True:
+            key, render_func, wanted_func = self._jobs.get()
+            if key is None:
+                break
+
+            surface = None
+            if wanted_func():
+                try:
+                    surface = render_func()
+                except (IndexError, TypeError, ValueError) as e:
+                    self.error("Failed rendering the waveform tile %s: %s", key, e)
+            GLib.idle_add(self.__rendered_cb, key, surface)
+
+    def __rendered_cb(self, key, surface):
+        callbacks = self._pending.pop(key, [])
+        if surface is not None:
+            for callback in callbacks:
+                callback(key, surface)
         return False
 
-    def commit(self):
-        """Saves the cache on disk (in the database)."""
-        self._db.commit()
-        self.log("Saved thumbnail cache file: %s", self._filehash)
+    def abort(self):
+        self._jobs.put((None, None, None))
+
+
+class WaveformPyramid(object):
+    """Multi-resolution waveform, for drawing at any zoom level quickly.
+
+    The first level has a value for each SAMPLE_DURATION, and each next level
+    has WAVEFORM_PYRAMID_FACTOR times fewer values. Each level is saved next
+    to the .wave.npy file in a separate .npy file, so it can be memory-mapped.
+
+    Attributes:
+        levels (List[numpy.ndarray]): The levels, the most detailed first,
+            each having the MIN, MAX and RMS columns.
+    """
+
+    MIN = 0
+    MAX = 1
+    RMS = 2
+
+    def __init__(self, levels):
+        self.levels = levels
+
+    @staticmethod
+    def _get_level_location(wavefile, level):
+        root, ext = os.path.splitext(wavefile)
+        return "%s.%d%s" % (root, level, ext)
+
+    @classmethod
+    def create(cls, wavefile, values):
+        """Computes and saves the pyramid of a waveform.
+
+        Args:
+            wavefile (str): The path of the .wave.npy file.
+            values (numpy.ndarray): The MIN, MAX and RMS values for each
+                SAMPLE_DURATION.
+
+        Returns:
+            WaveformPyramid: The pyramid, or None if `values` is empty.
+        """
+        if not values.size:
+            return None
+
+        levels = [values.astype(numpy.float32)]
+        while len(levels[-1]) > WAVEFORM_PYRAMID_FACTOR:
+            levels.append(cls._reduce(levels[-1]))
+
+        for level, level_values in enumerate(levels):
+            numpy.save(cls._get_level_location(wavefile, level), level_values)
+        return cls(levels)
+
+    @classmethod
+    def create_from_samples(cls, wavefile, samples):
+        """Computes the pyramid of a waveform cached as RMS values only.
+
+        The envelope of the audio being unknown, it is approximated
+        with the RMS values.
+        """
+        values = numpy.stack((-samples, samples, samples), axis=1)
+        return cls.create(wavefile, values)
+
+    @classmethod
+    def _reduce(cls, values):
+        """Computes the next level from the values of a level."""
+        starts = numpy.arange(0, len(values), WAVEFORM_PYRAMID_FACTOR)
+        counts = numpy.diff(numpy.append(starts, len(values)))
+        reduced = numpy.empty((len(starts), 3), dtype=numpy.float32)
+        reduced[:, cls.MIN] = numpy.minimum.reduceat(values[:, cls.MIN], starts)
+        reduced[:, cls.MAX] = numpy.maximum.reduceat(values[:, cls.MAX], starts)
+        squares = numpy.square(values[:, cls.RMS], dtype=numpy.float64)
+        reduced[:, cls.RMS] = numpy.sqrt(numpy.add.reduceat(squares, starts) / counts)
+        return reduced
+
+    @classmethod
+    def load(cls, wavefile):
+        """Memory-maps the saved pyramid of a waveform.
+
+        Returns:
+            WaveformPyramid: The pyramid, or None if it has not been saved.
+        """
+        levels = []
+        while True:
+            location = cls._get_level_location(wavefile, len(levels))
+            if not os.path.exists(location):
+                break
+            levels.append(numpy.load(location, mmap_mode="r"))
+        if not levels:
+            return None
+        return cls(levels)
+
+    @classmethod
+    def symlink(cls, wavefile, link_wavefile):
+        """Makes the pyramid of a waveform be the one of another."""
+        level = 0
+        while True:
+            location = cls._get_level_location(wavefile, level)
+            if not os.path.exists(location):
+                break
+            link = cls._get_level_location(link_wavefile, level)
+            try:
+                os.remove(link)
+            except FileNotFoundError:
+                pass
+            os.symlink(location, link)
+            level += 1
+
+    def get_level(self, ns_per_pixel):
+        """Gets the least detailed level with at least a value per pixel.
+
+        Returns:
+            (numpy.ndarray, float): The values of the level and the duration
+                of a value, in nanos.
+        """
+        level = 0
+        duration = SAMPLE_DURATION
+        while level + 1 < len(self.levels) and duration * WAVEFORM_PYRAMID_FACTOR <= ns_per_pixel:
+            level += 1
+            duration *= WAVEFORM_PYRAMID_FACTOR
+        return self.levels[level], duration
 
 
 def get_wavefile_location_for_uri(uri):
@@ -953,10 +2403,24 @@ def get_wavefile_location_for_uri(uri):
 
 
 class AudioPreviewer(Previewer, Zoomable, Loggable):
-    """Audio previewer using the results from the "level" GStreamer element."""
+    """Audio previewer drawing the waveform pyramid of the asset.
+
+    The waveform is drawn in tiles of WAVEFORM_TILE_WIDTH pixels which are
+    rendered in a separate thread and cached, so scrolling and zooming
+    back never block the UI.
+
+    Attributes:
+        envelope (bool): Whether to draw the min/max envelope of the audio
+            instead of the RMS.
+    """
 
     __gsignals__ = PREVIEW_GENERATOR_SIGNALS
 
+    envelope = GlobalSettings.previewers_waveform_envelope
+
+    # The rendered tiles of all the assets.
+    tiles = SurfaceCache(max_bytes=GlobalSettings.previewers_waveform_tiles_cache_size * 1024 * 1024)
+
     def __init__(self, ges_elem, max_cpu_usage):
         Previewer.__init__(self, GES.TrackType.AUDIO, max_cpu_usage)
         Zoomable.__init__(self)
@@ -967,14 +2431,7 @@ class AudioPreviewer(Previewer, Zoomable, Loggable):
 
         self.ges_elem = ges_elem
 
-        self.samples = None
-        self.peaks = None
-        self.surface = None
-        # The zoom level when self.surface has been created.
-        self._surface_zoom_level = 0
-        # The samples range used when self.surface has been created.
-        self._surface_start_ns = 0
-        self._surface_end_ns = 0
+        self.pyramid = None
 
         # Guard against malformed URIs
         self.wavefile = None
@@ -987,8 +2444,12 @@ class AudioPreviewer(Previewer, Zoomable, Loggable):
         filename = get_wavefile_location_for_uri(self._uri)
 
         if os.path.exists(filename):
-            with open(filename, "rb") as samples:
-                self.samples = list(numpy.load(samples))
+            self.pyramid = WaveformPyramid.load(filename)
+            if not self.pyramid:
+                # The waveform has been cached before the pyramids existed.
+                samples = numpy.load(filename, mmap_mode="r")
+                WaveformPyramid.create_from_samples(filename, samples)
+                self.pyramid = WaveformPyramid.load(filename)
             self.queue_draw()
         else:
             self.wavefile = filename
@@ -1021,7 +2482,7 @@ class AudioPreviewer(Previewer, Zoomable, Loggable):
     def _prepareSamples(self):
         proxy = self.ges_elem.get_parent().get_asset().get_proxy_target()
         self._wavebin.finalize(proxy=proxy)
-        self.samples = self._wavebin.samples
+        self.pyramid = WaveformPyramid.load(self._wavebin.wavefile)
 
     def _busMessageCb(self, bus, message):
         if message.type == Gst.MessageType.EOS:
@@ -1056,52 +2517,83 @@ class AudioPreviewer(Previewer, Zoomable, Loggable):
             return True
         return False
 
-    # pylint: disable=arguments-differ,too-many-locals
+    # pylint: disable=arguments-differ
     def do_draw(self, context):
-        if not self.samples:
+        if not self.pyramid:
             # Nothing to draw.
             return
 
-        # The area we have to refresh is determined by the start and end
-        # calculated in the context of the asset duration.
+        # The tiles are positioned relative to the start of the asset,
+        # so they can be shared by all the clips of the asset.
         rect = Gdk.cairo_get_clip_rectangle(context)[1]
-        inpoint = self.ges_elem.props.in_point
-        max_duration = self.ges_elem.get_asset().get_filesource_asset().get_duration()
-        start_ns = min(max(0, self.pixelToNs(rect.x) + inpoint), max_duration)
-        end_ns = min(max(0, self.pixelToNs(rect.x + rect.width) + inpoint), max_duration)
-
-        zoom = self.getCurrentZoomLevel()
+        inpoint_px = self.nsToPixel(self.ges_elem.props.in_point)
+        first_tile = max(0, (rect.x + inpoint_px) // WAVEFORM_TILE_WIDTH)
+        last_tile = (rect.x + rect.width + inpoint_px) // WAVEFORM_TILE_WIDTH
         height = self.get_allocation().height
-        if not self.surface or \
-                height != self.surface.get_height() or \
-                zoom != self._surface_zoom_level or \
-                start_ns < self._surface_start_ns or \
-                end_ns > self._surface_end_ns:
-            if self.surface:
-                self.surface.finish()
-                self.surface = None
-            self._surface_zoom_level = zoom
-            # The generated waveform is for an extended range if possible,
-            # so if the user scrolls we don't rebuild the waveform every time.
-            extra = self.pixelToNs(WAVEFORM_SURFACE_EXTRA_PX)
-            self._surface_start_ns = max(0, start_ns - extra)
-            self._surface_end_ns = min(end_ns + extra, max_duration)
-
-            range_start = min(max(0, int(self._surface_start_ns / SAMPLE_DURATION)), len(self.samples))
-            range_end = min(max(0, int(self._surface_end_ns / SAMPLE_DURATION)), len(self.samples))
-            samples = self.samples[range_start:range_end]
-            surface_width = self.nsToPixel(self._surface_end_ns - self._surface_start_ns)
-            self.surface = renderer.fill_surface(samples, surface_width, height)
-
-        # Paint the surface, ignoring the clipped rect.
-        # We only have to make sure the offset is correct:
-        # 1. + self._start_surface_ns, because that's the position of
-        # the surface in context, if the entire asset would be drawn.
-        # 2. - inpoint, because we're drawing a clip, not the entire asset.
+
         context.set_operator(cairo.OPERATOR_OVER)
-        offset = self.nsToPixel(self._surface_start_ns - inpoint)
-        context.set_source_surface(self.surface, offset, 0)
-        context.paint()
+        for index in range(first_tile, last_tile + 1):
+            key = (self._uri, self.zoomratio, index, height, self.envelope)
+            surface = self.tiles.get(key)
+            if surface is None:
+                # Composited when rendered.
+                self.__render_tile(key)
+                continue
+            context.set_source_surface(surface, index * WAVEFORM_TILE_WIDTH - inpoint_px, 0)
+            context.paint()
+
+    def __render_tile(self, key):
+        unused_uri, zoomratio, index, height, envelope = key
+        # Only the values of the tile range of the least detailed
+        # level which fits the zoom are read from the disk.
+        values, value_duration = self.pyramid.get_level(self.pixelToNs(1))
+        start_ns = self.pixelToNs(index * WAVEFORM_TILE_WIDTH)
+        end_ns = self.pixelToNs((index + 1) * WAVEFORM_TILE_WIDTH)
+        range_start = min(int(start_ns / value_duration), len(values))
+        range_end = min(int(end_ns / value_duration), len(values))
+        if range_start >= range_end:
+            # Past the end of the asset.
+            return
+
+        # The last tile of the asset is narrower.
+        width = min(WAVEFORM_TILE_WIDTH,
+                    self.nsToPixel(range_end * value_duration) - index * WAVEFORM_TILE_WIDTH)
+        if width <= 0:
+            return
+
+        # The renderer reads the columns of the range straight from
+        # the memory-mapped level.
+        columns = values.shape[1]
+        offset = range_start * columns
+        count = range_end - range_start
+        if envelope:
+            render_func = functools.partial(
+                renderer.fill_envelope, values, width, height,
+                min_offset=offset + WaveformPyramid.MIN,
+                max_offset=offset + WaveformPyramid.MAX,
+                stride=columns, count=count)
+        else:
+            render_func = functools.partial(
+                renderer.fill_surface, values, width, height,
+                offset=offset + WaveformPyramid.RMS,
+                stride=columns, count=count)
+
+        def wanted_func():
+            # The tiles of a previous zoom are not needed anymore.
+            return Zoomable.zoomratio == zoomratio
+
+        WaveformTileRenderer.get().render(key, render_func, wanted_func,
+                                          self.__tile_rendered_cb)
+
+    def __tile_rendered_cb(self, key, surface):
+        self.tiles.put(key, surface)
+        unused_uri, zoomratio, index, height, unused_envelope = key
+        if zoomratio != self.zoomratio or height != self.get_allocation().height:
+            return
+
+        inpoint_px = self.nsToPixel(self.ges_elem.props.in_point)
+        self.queue_draw_area(index * WAVEFORM_TILE_WIDTH - inpoint_px, 0,
+                             surface.get_width(), height)
 
     def _emit_done_on_idle(self):
         self.emit("done")
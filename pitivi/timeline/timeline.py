@@ -38,7 +38,9 @@ from pitivi.timeline.elements import TrimHandle
 from pitivi.timeline.layer import Layer
 from pitivi.timeline.layer import LayerControls
 from pitivi.timeline.layer import SpacedSeparator
+from pitivi.timeline.previewers import AudioPreviewer
 from pitivi.timeline.previewers import Previewer
+from pitivi.timeline.previewers import ThumbnailCache
 from pitivi.timeline.ruler import ScaleRuler
 from pitivi.undo.timeline import CommitTimelineFinalizingAction
 from pitivi.utils.loggable import Loggable
@@ -406,6 +408,18 @@ class Timeline(Gtk.EventBox, Zoomable, Loggable):
         self.app.settings.connect("edgeSnapDeadbandChanged",
                                   self.__snap_distance_changed_cb)
 
+        thumbnailer = Previewer.manager.thumbnailer
+        thumbnailer.max_workers = self.app.settings.previewers_thumbnail_workers
+        thumbnailer.max_cpu_usage = self.app.settings.previewers_max_cpu
+        ThumbnailCache.pixbufs.max_bytes = \
+            self.app.settings.previewers_pixbuf_cache_size * 1024 * 1024
+        AudioPreviewer.envelope = self.app.settings.previewers_waveform_envelope
+        AudioPreviewer.tiles.max_bytes = \
+            self.app.settings.previewers_waveform_tiles_cache_size * 1024 * 1024
+        # Generate the previews of what the user is looking at first.
+        self.hadj.connect("value-changed", self.__hadj_changed_cb)
+        self.hadj.connect("changed", self.__hadj_changed_cb)
+
     @property
     def media_types(self):
         """Gets the media types present in the layers.
@@ -514,6 +528,7 @@ class Timeline(Gtk.EventBox, Zoomable, Loggable):
             return
 
         self.__last_position = position
+        Previewer.manager.playhead = position
         self.layout.playhead_position = position
         self.layout.queue_draw()
         layout_width = self.layout.get_allocation().width
@@ -523,6 +538,15 @@ class Timeline(Gtk.EventBox, Zoomable, Loggable):
         if not pipeline.playing():
             self.update_visible_overlays()
 
+    def __hadj_changed_cb(self, unused_hadj):
+        self.__update_previewers_viewport()
+
+    def __update_previewers_viewport(self):
+        """Lets the previewers know which part of the timeline is visible."""
+        start = self.pixelToNs(self.hadj.get_value())
+        end = self.pixelToNs(self.hadj.get_value() + self.hadj.get_page_size())
+        Previewer.manager.set_viewport(start, end)
+
     def __snapping_started_cb(self, unused_timeline, unused_obj1, unused_obj2, position):
         """Handles a clip snap update operation."""
         self.layout.snap_position = position
@@ -1137,6 +1161,7 @@ class Timeline(Gtk.EventBox, Zoomable, Loggable):
         self.zoomed_fitted = False
 
         self.updatePosition()
+        self.__update_previewers_viewport()
 
     def set_best_zoom_ratio(self, allow_zoom_in=False):
         """Sets the zoom level so that the entire timeline is in view."""
@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+# Pitivi video editor
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this program; if not, write to the
+# Free Software Foundation, Inc., 51 Franklin St, Fifth Floor,
+# Boston, MA 02110-1301, USA.
+"""Journal of the undoable operations, for recovering after a crash."""
+import os
+
+from gi.repository import GLib
+from gi.repository import Gst
+
+from pitivi.undo.undo import UndoableAction
+from pitivi.utils.loggable import Loggable
+
+
+# How often the journal is written to the disk, in milliseconds.
+JOURNAL_SYNC_INTERVAL = 1000
+
+
+class UndoJournal(Loggable):
+    """Append-only journal of the operations recorded by an action log.
+
+    The journal is a GstValidate scenario which loads a copy of the project
+    and then applies the committed operations and the changes done when
+    undoing and redoing, so it can be replayed when recovering after a
+    crash. It is written to the disk at most once per
+    JOURNAL_SYNC_INTERVAL.
+
+    Not all the actions can be serialized, and some are recorded only by
+    the scenario of the application, so the journal is not complete as
+    soon as an operation contains such an action.
+
+    Attributes:
+        action_log (UndoableActionLog): The action log being journaled.
+        path (str): The path of the journal file.
+    """
+
+    HEADER = "description, seek=true, handles-states=true\n"
+
+    def __init__(self, action_log, path):
+        Loggable.__init__(self)
+        self.action_log = action_log
+        self.path = path
+        self._file = None
+        self._sync_id = 0
+
+        # The serialized actions of the operations being recorded, by stack.
+        self._pending = {}
+        # The serialized actions done while undoing or redoing.
+        self._moving = []
+        # The lines written since the journal has been reset.
+        self._lines = []
+        # The position in the lines of the first operation which
+        # could not be journaled, if any.
+        self._missing_from = None
+
+        action_log.connect("pre-push", self._pre_push_cb)
+        action_log.connect("commit", self._commit_cb)
+        action_log.connect("rollback", self._rollback_cb)
+        action_log.connect("move", self._move_cb)
+
+    def release(self):
+        """Writes the pending operations and stops journaling."""
+        self.action_log.disconnect_by_func(self._pre_push_cb)
+        self.action_log.disconnect_by_func(self._commit_cb)
+        self.action_log.disconnect_by_func(self._rollback_cb)
+        self.action_log.disconnect_by_func(self._move_cb)
+
+        if self._sync_id:
+            GLib.source_remove(self._sync_id)
+            self._sync_id = 0
+        if self._file:
+            self.sync()
+            self._file.close()
+            self._file = None
+
+    def reset(self, project_content):
+        """Starts a new journal from the specified project state.
+
+        Args:
+            project_content (str): The serialized project to which
+                the following operations apply.
+        """
+        tmp_path = self.path + ".tmp"
+        self.prepare(tmp_path, project_content)
+        self.switch(tmp_path, self.mark())
+        self._moving = []
+        self._missing_from = None
+
+    @property
+    def complete(self):
+        """Whether the journal contains all the operations done."""
+        return self._missing_from is None
+
+    @classmethod
+    def prepare(cls, path, project_content):
+        """Writes a journal containing only the specified project state.
+
+        Can be called from any thread.
+
+        Args:
+            path (str): The path of the new journal file.
+            project_content (str): The serialized project.
+        """
+        load_project = Gst.Structure.new_empty("load-project")
+        load_project["serialized-content"] = project_content.replace("\n", "")
+
+        with open(path, "w") as journal:
+            journal.write(cls.HEADER)
+            journal.write(load_project.to_string() + "\n")
+            journal.flush()
+            os.fsync(journal.fileno())
+
+    def mark(self):
+        """Gets a marker of the current position in the journal.
+
+        Returns:
+            int: The marker to be passed to `switch`.
+        """
+        return len(self._lines)
+
+    def switch(self, prepared_path, marker):
+        """Replaces the journal with a prepared one.
+
+        Args:
+            prepared_path (str): The journal written by `prepare` with the
+                project state at the time of the marker.
+            marker (int): The value returned by `mark` when the project
+                state has been serialized. The operations journaled since
+                then are kept.
+        """
+        lines = self._lines[marker:]
+        with open(prepared_path, "a") as journal:
+            journal.write("".join(line + "\n" for line in lines))
+
+        if self._file:
+            self._file.close()
+        os.replace(prepared_path, self.path)
+        self._file = open(self.path, "a")
+        self._lines = lines
+        if self._missing_from is not None:
+            if self._missing_from < marker:
+                # The operation is included in the prepared project.
+                self._missing_from = None
+            else:
+                self._missing_from -= marker
+        if lines:
+            self.__schedule_sync()
+
+    @classmethod
+    def has_operations(cls, path):
+        """Checks whether the specified journal has operations to replay.
+
+        Args:
+            path (str): The path of the journal file.
+
+        Returns:
+            bool: True iff the journal contains more than the project.
+        """
+        try:
+            with open(path) as journal:
+                # Skip the header and the project.
+                for unused_i in range(2):
+                    if not journal.readline():
+                        return False
+                return bool(journal.readline().strip())
+        except OSError:
+            return False
+
+    def _pre_push_cb(self, action_log, action):
+        if not isinstance(action, UndoableAction):
+            return
+
+        try:
+            st = action.asScenarioAction()
+        except NotImplementedError:
+            self.debug("No serialization method for action %s", action)
+            st = None
+        # None marks the operation as not journaled completely.
+        line = st.to_string() if st else None
+
+        if action_log.running:
+            self._moving.append(line)
+        elif action_log.stacks:
+            stack = action_log.stacks[-1]
+            self._pending.setdefault(stack, []).append(line)
+
+    def _commit_cb(self, action_log, stack):
+        lines = self._pending.pop(stack, [])
+        if action_log.stacks:
+            # Journaled when the toplevel operation is committed.
+            parent = action_log.stacks[-1]
+            self._pending.setdefault(parent, []).extend(lines)
+        else:
+            self._write(lines)
+
+    def _rollback_cb(self, unused_action_log, stack):
+        self._pending.pop(stack, None)
+
+    def _move_cb(self, unused_action_log, unused_stack):
+        lines = self._moving
+        self._moving = []
+        self._write(lines)
+
+    def _write(self, lines):
+        if None in lines:
+            if self._missing_from is None:
+                self.info("The journal is not complete anymore")
+                self._missing_from = len(self._lines)
+            lines = [line for line in lines if line is not None]
+
+        if not lines or not self._file:
+            return
+
+        self._file.write("".join(line + "\n" for line in lines))
+        self._lines.extend(lines)
+        self.__schedule_sync()
+
+    def __schedule_sync(self):
+        if not self._sync_id:
+            self._sync_id = GLib.timeout_add(JOURNAL_SYNC_INTERVAL, self._sync_cb)
+
+    def _sync_cb(self):
+        self._sync_id = 0
+        self.sync()
+        return False
+
+    def sync(self):
+        """Makes sure the journaled operations are written to the disk."""
+        if not self._file:
+            return
+
+        self._file.flush()
+        os.fsync(self._file.fileno())
@@ -38,21 +38,32 @@ class AssetAddedIntention(UndoableAction):
         self.project = project
         self.uri = uri
         self.asset = None
+        # Whether undone before the asset has been added.
+        self.cancelled = False
         self.project.connect("asset-added", self._asset_added_cb)
 
     def _asset_added_cb(self, project, asset):
         if asset.get_id() == self.uri:
             self.asset = asset
             self.project.disconnect_by_func(self._asset_added_cb)
+            if self.cancelled:
+                # It was being discovered when undone.
+                self.project.remove_asset(asset)
 
     def undo(self):
-        # The asset might be missing if removed before it's added
         if self.asset:
             self.project.remove_asset(self.asset)
+        else:
+            # The asset is not added yet, make sure it does not appear.
+            self.cancelled = True
+            self.project.cancel_import(self.uri)
 
     def do(self):
         if self.asset:
             self.project.add_asset(self.asset)
+        elif self.cancelled:
+            self.cancelled = False
+            self.project.addUris([self.uri])
 
 
 class AssetAddedAction(Action):
@@ -16,7 +16,10 @@
 # License along with this program; if not, write to the
 # Free Software Foundation, Inc., 51 Franklin St, Fifth Floor,
 # Boston, MA 02110-1301, USA.
+import itertools
+
 from gi.repository import GES
+from gi.repository import GLib
 from gi.repository import GObject
 from gi.repository import Gst
 from gi.repository import GstController
@@ -33,6 +36,9 @@ from pitivi.utils.loggable import Loggable
 
 TRANSITION_PROPS = ["border", "invert", "transition-type"]
 
+# How many clips are observed at once when observing them in the background.
+OBSERVER_ATTACH_BATCH = 100
+
 
 def child_property_name(pspec):
     return "%s::%s" % (pspec.owner_type.name, pspec.name)
@@ -324,7 +330,12 @@ class ClipAdded(ClipAction):
         st = Gst.Structure.new_empty("add-clip")
         st.set_value("name", self.clip.get_name())
         st.set_value("layer-priority", self.layer.props.priority)
-        st.set_value("asset-id", self.clip.get_asset().get_id())
+        asset = self.clip.get_asset()
+        switcher = getattr(timeline.get_asset(), "proxy_tier_switcher", None)
+        if switcher:
+            # Never record the faster assets used temporarily for playback.
+            asset = switcher.get_default_asset(asset)
+        st.set_value("asset-id", asset.get_id())
         st.set_value("type", GObject.type_name(self.clip))
         st.set_value("start", float(self.clip.props.start / Gst.SECOND))
         st.set_value("inpoint", float(self.clip.props.in_point / Gst.SECOND))
@@ -649,12 +660,15 @@ class LayerObserver(MetaContainerObserver, Loggable):
 
     Args:
         ges_layer (GES.Layer): The layer to observe.
+        lazy (Optional[bool]): Whether the clips already in the layer are
+            observed only when `attach_pending_clips` is called.
 
     Attributes:
         action_log (UndoableActionLog): The action log where to report actions.
+        pending_clips (dict): The clips of the layer not yet observed, as keys.
     """
 
-    def __init__(self, ges_layer, action_log):
+    def __init__(self, ges_layer, action_log, lazy=False):
         MetaContainerObserver.__init__(self, ges_layer, action_log)
         Loggable.__init__(self)
         self.action_log = action_log
@@ -668,15 +682,33 @@ class LayerObserver(MetaContainerObserver, Loggable):
         ges_layer.connect("notify::priority", self.__layer_moved_cb)
 
         self.clip_observers = {}
-        for ges_clip in ges_layer.get_clips():
-            self._connectToClip(ges_clip)
-
-    def _connectToClip(self, ges_clip):
+        self.pending_clips = dict.fromkeys(ges_layer.get_clips())
+        if not lazy:
+            self.attach_pending_clips()
+
+    def attach_pending_clips(self, count=None):
+        """Starts observing the clips not yet observed.
+
+        Args:
+            count (Optional[int]): The maximum number of clips to observe,
+                or None to observe all of them.
+
+        Returns:
+            int: The number of clips which are now observed.
+        """
+        ges_clips = list(itertools.islice(self.pending_clips, count))
+        for ges_clip in ges_clips:
+            del self.pending_clips[ges_clip]
+            # The clips were there before, nothing to report.
+            self._connectToClip(ges_clip, report=False)
+        return len(ges_clips)
+
+    def _connectToClip(self, ges_clip, report=True):
         ges_clip.connect("child-added", self._clipTrackElementAddedCb)
         ges_clip.connect("child-removed", self._clipTrackElementRemovedCb)
 
         for track_element in ges_clip.get_children(recursive=True):
-            self._connectToTrackElement(track_element)
+            self._connectToTrackElement(track_element, report)
 
         if isinstance(ges_clip, GES.TransitionClip):
             return
@@ -708,13 +740,14 @@ class LayerObserver(MetaContainerObserver, Loggable):
         action = ControlSourceRemoveAction(track_element, binding)
         self.action_log.push(action)
 
-    def _connectToTrackElement(self, track_element):
+    def _connectToTrackElement(self, track_element, report=True):
         if isinstance(track_element, GES.VideoTransition):
-            ges_clip = track_element.get_toplevel_parent()
-            ges_layer = ges_clip.props.layer
-            action = TransitionClipAddedAction(ges_layer, ges_clip,
-                                               track_element)
-            self.action_log.push(action)
+            if report:
+                ges_clip = track_element.get_toplevel_parent()
+                ges_layer = ges_clip.props.layer
+                action = TransitionClipAddedAction(ges_layer, ges_clip,
+                                                   track_element)
+                self.action_log.push(action)
 
             observer = GObjectObserver(track_element, TRANSITION_PROPS,
                                        self.action_log)
@@ -765,7 +798,10 @@ class LayerObserver(MetaContainerObserver, Loggable):
         self.action_log.push(action)
 
     def _clipRemovedCb(self, layer, clip):
-        self._disconnectFromClip(clip)
+        if clip in self.pending_clips:
+            del self.pending_clips[clip]
+        else:
+            self._disconnectFromClip(clip)
         if isinstance(clip, GES.TransitionClip):
             action = TransitionClipRemovedAction.new(layer, clip)
             if action:
@@ -857,6 +893,10 @@ class GroupObserver(Loggable):
 class TimelineObserver(Loggable):
     """Monitors a project's timeline and reports UndoableActions.
 
+    The clips already in the timeline are observed in batches when idle,
+    so a large timeline does not delay the loading, and all the remaining
+    ones as soon as an operation starts being recorded.
+
     Attributes:
         ges_timeline (GES.Timeline): The timeline to be monitored.
         action_log (UndoableActionLog): The action log where to report actions.
@@ -870,7 +910,14 @@ class TimelineObserver(Loggable):
         self.layer_observers = {}
         self.group_observers = {}
         for ges_layer in ges_timeline.get_layers():
-            self._connect_to_layer(ges_layer)
+            self.layer_observers[ges_layer] = LayerObserver(ges_layer, self.action_log,
+                                                            lazy=True)
+
+        self._attach_id = 0
+        if self.has_pending_clips():
+            self._attach_id = GLib.idle_add(self.__attach_idle_cb,
+                                            priority=GLib.PRIORITY_LOW)
+        action_log.connect("begin", self.__action_log_begin_cb)
 
         ges_timeline.connect("layer-added", self.__layer_added_cb)
         ges_timeline.connect("layer-removed", self.__layer_removed_cb)
@@ -882,6 +929,42 @@ class TimelineObserver(Loggable):
         # We don't care about the group-removed signal because this greatly
         # simplifies the logic.
 
+    def has_pending_clips(self):
+        """Checks whether some clips are not yet observed."""
+        return any(layer_observer.pending_clips
+                   for layer_observer in self.layer_observers.values())
+
+    def attach_pending_clips(self, count=None):
+        """Starts observing the clips not yet observed.
+
+        Args:
+            count (Optional[int]): The maximum number of clips to observe,
+                or None to observe all of them.
+        """
+        for layer_observer in self.layer_observers.values():
+            if count is None:
+                layer_observer.attach_pending_clips()
+                continue
+
+            count -= layer_observer.attach_pending_clips(count)
+            if count <= 0:
+                break
+
+    def __attach_idle_cb(self):
+        self.attach_pending_clips(OBSERVER_ATTACH_BATCH)
+        if self.has_pending_clips():
+            return True
+
+        self._attach_id = 0
+        return False
+
+    def __action_log_begin_cb(self, unused_action_log, unused_stack):
+        # The changes have to be reported from now on.
+        if self._attach_id:
+            GLib.source_remove(self._attach_id)
+            self._attach_id = 0
+            self.attach_pending_clips()
+
     def __layer_added_cb(self, ges_timeline, ges_layer):
         action = LayerAdded(self.ges_timeline, ges_layer)
         self.action_log.push(action)
@@ -18,12 +18,47 @@
 # Boston, MA 02110-1301, USA.
 """Undo/redo."""
 import contextlib
+import sys
 
 from gi.repository import GObject
 
+from pitivi.settings import GlobalSettings
 from pitivi.utils.loggable import Loggable
 
 
+GlobalSettings.addConfigSection("undo")
+# The maximum number of operations which can be undone, 0 for no limit.
+GlobalSettings.addConfigOption("undoMaxOperations",
+                               section="undo",
+                               key="max-operations",
+                               default=1000)
+# The maximum estimated memory used by the operations which can be undone
+# or redone, in bytes, 0 for no limit.
+GlobalSettings.addConfigOption("undoMaxSize",
+                               section="undo",
+                               key="max-size",
+                               default=64 * 1024 * 1024)
+
+# The estimated memory used by an action object, in bytes.
+ACTION_BASE_SIZE = 512
+
+
+def estimate_size(action):
+    """Estimates the memory used by an action.
+
+    Args:
+        action (UndoableAction): The action, possibly an UndoableActionStack.
+
+    Returns:
+        int: The estimated number of bytes.
+    """
+    if isinstance(action, UndoableActionStack):
+        return ACTION_BASE_SIZE + sum(estimate_size(child)
+                                      for child in action.done_actions)
+    return ACTION_BASE_SIZE + sum(sys.getsizeof(value)
+                                  for value in vars(action).values())
+
+
 class UndoError(Exception):
     """Base class for undo/redo exceptions."""
     pass
@@ -122,13 +157,22 @@ class UndoableActionStack(UndoableAction):
             the stack.
         finalizing_action (FinalizingAction): The action to be performed
             at the end of undoing or redoing the stacked actions.
+        generation (int): What identifies the state of the project after
+            the operation, set when committed.
+        size (int): The estimated memory used by the operation, in bytes,
+            set when committed.
+        merge_key (object): If not None, the operation is included in the
+            previous operation with the same name and key, if any.
     """
 
-    def __init__(self, action_group_name, finalizing_action=None):
+    def __init__(self, action_group_name, finalizing_action=None, merge_key=None):
         UndoableAction.__init__(self)
         self.action_group_name = action_group_name
         self.done_actions = []
         self.finalizing_action = finalizing_action
+        self.merge_key = merge_key
+        self.generation = 0
+        self.size = 0
 
     def __repr__(self):
         return "%s: %s" % (self.action_group_name, self.done_actions)
@@ -147,6 +191,40 @@ class UndoableActionStack(UndoableAction):
             method()
         self.finish_operation()
 
+    def merge(self, stack):
+        """Includes the following operation if it continues this one.
+
+        Args:
+            stack (UndoableActionStack): The operation committed after
+                this one.
+
+        Returns:
+            bool: Whether the operation has been included, which happens
+                when both have the same merge key or when both change the
+                same properties of the same objects.
+        """
+        if stack.action_group_name != self.action_group_name:
+            return False
+
+        if stack.merge_key is not None:
+            if stack.merge_key is not self.merge_key:
+                return False
+            self.done_actions.extend(stack.done_actions)
+            return True
+
+        if len(stack.done_actions) != len(self.done_actions):
+            return False
+
+        pairs = list(zip(self.done_actions, stack.done_actions))
+        for action, next_action in pairs:
+            if not isinstance(action, PropertyChangedAction) or \
+                    not action.changes_same_property(next_action):
+                return False
+
+        for action, next_action in pairs:
+            action.expand(next_action)
+        return True
+
     def do(self):
         self._run_action(self.done_actions, "do")
 
@@ -163,6 +241,17 @@ class UndoableActionLog(GObject.Object, Loggable):
     """The undo/redo manager.
 
     A separate instance should be created for each Project instance.
+
+    The oldest operations are forgotten when there are too many of them or
+    when they use too much memory.
+
+    Attributes:
+        max_operations (int): The maximum number of operations which can be
+            undone, 0 for no limit.
+        max_size (int): The maximum estimated memory used by the operations
+            which can be undone or redone, 0 for no limit.
+        size (int): The estimated memory used by the operations which can be
+            undone or redone, in bytes.
     """
 
     __gsignals__ = {
@@ -174,7 +263,7 @@ class UndoableActionLog(GObject.Object, Loggable):
         "move": (GObject.SignalFlags.RUN_LAST, None, (object,)),
     }
 
-    def __init__(self):
+    def __init__(self, max_operations=0, max_size=0):
         GObject.Object.__init__(self)
         Loggable.__init__(self)
 
@@ -182,7 +271,17 @@ class UndoableActionLog(GObject.Object, Loggable):
         self.redo_stacks = []
         self.stacks = []
         self.running = False
-        self._checkpoint = self._takeSnapshot()
+        self.max_operations = max_operations
+        self.max_size = max_size
+        self.size = 0
+
+        # The last generation given to a committed operation.
+        self._generation = 0
+        # The generation of the state before the oldest operation which
+        # can be undone.
+        self._base_generation = 0
+        self._forgot_assets_operations = False
+        self._checkpoint = self._current_generation()
 
     @contextlib.contextmanager
     def started(self, action_group_name, **kwargs):
@@ -198,14 +297,17 @@ class UndoableActionLog(GObject.Object, Loggable):
         else:
             self.commit(action_group_name)
 
-    def begin(self, action_group_name, finalizing_action=None, toplevel=False):
+    def begin(self, action_group_name, finalizing_action=None, toplevel=False,
+              merge_key=None):
         """Starts recording a high-level operation which later can be undone.
 
         The recording can be stopped by calling the `commit` method or
         canceled by calling the `rollback` method.
 
         The operation will be composed of all the actions which have been
-        pushed and also of the committed sub-operations.
+        pushed and also of the committed sub-operations. When a `merge_key`
+        is specified, the operation is undone together with the previous
+        operation started with the same name and key, if it is the last one.
         """
         if self.running:
             self.debug("Abort because running")
@@ -214,7 +316,7 @@ class UndoableActionLog(GObject.Object, Loggable):
         if toplevel and self.is_in_transaction():
             raise UndoWrongStateError("Toplevel operation started as suboperation", self.stacks)
 
-        stack = UndoableActionStack(action_group_name, finalizing_action)
+        stack = UndoableActionStack(action_group_name, finalizing_action, merge_key)
         self.stacks.append(stack)
         self.debug("begin action group %s, nested %s",
                    stack.action_group_name, len(self.stacks))
@@ -285,14 +387,32 @@ class UndoableActionLog(GObject.Object, Loggable):
             self.debug("Ignore empty stack %s", stack.action_group_name)
             return
         if not self.stacks:
-            self.undo_stacks.append(stack)
+            self._generation += 1
+            previous = self.undo_stacks[-1] if self.undo_stacks else None
+            # Never merge with the saved state, to be able to go back to it.
+            if previous and previous.generation != self._checkpoint and \
+                    previous.merge(stack):
+                self.debug("Merged %s in the previous operation", stack.action_group_name)
+                self.size -= previous.size
+                previous.size = estimate_size(previous)
+                previous.generation = self._generation
+                self.size += previous.size
+            else:
+                stack.size = estimate_size(stack)
+                stack.generation = self._generation
+                self.size += stack.size
+                self.undo_stacks.append(stack)
             stack.finish_operation()
         else:
             self.stacks[-1].push(stack)
 
         if self.redo_stacks:
+            self.size -= sum(redo_stack.size for redo_stack in self.redo_stacks)
             self.redo_stacks = []
 
+        if not self.stacks:
+            self._forget_oldest_operations()
+
         self.debug("commit action group %s nested %s",
                    stack.action_group_name, len(self.stacks))
         self.emit("commit", stack)
@@ -323,18 +443,31 @@ class UndoableActionLog(GObject.Object, Loggable):
         self.undo_stacks.append(stack)
         self.emit("move", stack)
 
-    def _takeSnapshot(self):
-        return list(self.undo_stacks)
+    def _forget_oldest_operations(self):
+        """Forgets the oldest operations until the history fits its limits."""
+        while len(self.undo_stacks) > 1 and \
+                (0 < self.max_operations < len(self.undo_stacks) or
+                 0 < self.max_size < self.size):
+            stack = self.undo_stacks.pop(0)
+            self.debug("Forgetting operation %s", stack.action_group_name)
+            self._base_generation = stack.generation
+            self.size -= stack.size
+            if stack.action_group_name in ["assets-addition", "assets-removal"]:
+                self._forgot_assets_operations = True
+
+    def _current_generation(self):
+        if self.undo_stacks:
+            return self.undo_stacks[-1].generation
+        return self._base_generation
 
     def checkpoint(self):
         if self.stacks:
             raise UndoWrongStateError("Recording a transaction", self.stacks)
 
-        self._checkpoint = self._takeSnapshot()
+        self._checkpoint = self._current_generation()
 
     def dirty(self):
-        current_snapshot = self._takeSnapshot()
-        return current_snapshot != self._checkpoint
+        return self._current_generation() != self._checkpoint
 
     def _run(self, operation):
         self.running = True
@@ -360,6 +493,8 @@ class UndoableActionLog(GObject.Object, Loggable):
 
     def has_assets_operations(self):
         """Checks whether user added/removed assets while working on the project."""
+        if self._forgot_assets_operations:
+            return True
         for stack in self.undo_stacks:
             if stack.action_group_name in ["assets-addition", "assets-removal"]:
                 return True
@@ -430,10 +565,14 @@ class PropertyChangedAction(UndoableAutomaticObjectAction):
     def undo(self):
         self.auto_object.set_property(self.field_name, self.old_value)
 
+    def changes_same_property(self, action):
+        """Checks whether the specified action changes the same property."""
+        return isinstance(action, PropertyChangedAction) and \
+            self.auto_object == action.auto_object and \
+            self.field_name == action.field_name
+
     def expand(self, action):
-        if not isinstance(action, PropertyChangedAction) or \
-                self.auto_object != action.auto_object or \
-                self.field_name != action.field_name:
+        if not self.changes_same_property(action):
             return False
         self.new_value = action.new_value
         return True
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+# Pitivi video editor
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this program; if not, write to the
+# Free Software Foundation, Inc., 51 Franklin St, Fifth Floor,
+# Boston, MA 02110-1301, USA.
+"""Persistent cache of the results of the media files discovery."""
+import os
+import sqlite3
+import threading
+
+from gi.repository import GES
+from gi.repository import GLib
+from gi.repository import Gst
+from gi.repository import GstPbutils
+
+from pitivi.settings import xdg_cache_home
+from pitivi.utils.loggable import Loggable
+
+
+# How long the discovered infos are kept in memory before being saved,
+# in seconds.
+DISCOVERY_CACHE_FLUSH_DELAY = 1
+
+
+class DiscoveryCache(Loggable):
+    """Cache of the discovered infos of the media files.
+
+    The infos are serialized in a sqlite3 database and identified by the
+    path, the size and the modification time of the media files, so
+    a modified file is discovered again.
+
+    GES 1.24 and newer use the cache instead of discovering the files
+    which did not change.
+
+    Attributes:
+        installed (bool): Whether GES uses the cache.
+    """
+
+    # The caches by database file.
+    caches_by_dbfile = {}
+
+    def __init__(self, dbfile):
+        Loggable.__init__(self)
+        self.dbfile = dbfile
+        self.installed = False
+        self._lock = threading.Lock()
+        # Maps the paths to the rows not saved yet.
+        self._pending = {}
+        self.__flush_id = 0
+
+        self._conn = sqlite3.connect(dbfile, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS Infos "
+                           "(Path TEXT NOT NULL PRIMARY KEY, "
+                           " Size INTEGER NOT NULL, "
+                           " Mtime INTEGER NOT NULL, "
+                           " Type TEXT NOT NULL, "
+                           " Info BLOB NOT NULL) WITHOUT ROWID")
+        self._conn.commit()
+
+    @classmethod
+    def get(cls):
+        """Gets the cache of the current cache directory."""
+        dbfile = os.path.join(xdg_cache_home(), "discovery.db")
+        if dbfile not in cls.caches_by_dbfile:
+            cls.caches_by_dbfile[dbfile] = DiscoveryCache(dbfile)
+        return cls.caches_by_dbfile[dbfile]
+
+    def install(self):
+        """Makes GES use the cache when discovering media files.
+
+        Returns:
+            bool: Whether GES supports it.
+        """
+        manager_class = getattr(GES, "DiscovererManager", None)
+        if manager_class is None:
+            self.info("GES always discovers the media files")
+            return False
+
+        manager = manager_class.get_default()
+        manager.connect("load-serialized-info", self.__load_serialized_info_cb)
+        self.installed = True
+        return True
+
+    def __load_serialized_info_cb(self, unused_manager, uri):
+        return self.get_info(uri)
+
+    @staticmethod
+    def _stat(uri):
+        try:
+            stat = os.stat(Gst.uri_get_location(uri))
+        except (OSError, TypeError):
+            return None
+        return stat.st_size, stat.st_mtime_ns
+
+    def get_info(self, uri):
+        """Gets the cached info of the specified media file.
+
+        Args:
+            uri (str): The URI of the media file.
+
+        Returns:
+            GstPbutils.DiscovererInfo: The info, or None if the media file
+            has not been discovered since it changed.
+        """
+        stat = self._stat(uri)
+        if not stat:
+            return None
+
+        path = Gst.uri_get_location(uri)
+        with self._lock:
+            row = self._pending.get(path)
+            if not row:
+                row = self._conn.execute(
+                    "SELECT Size, Mtime, Type, Info FROM Infos WHERE Path = ?",
+                    (path,)).fetchone()
+        if not row or tuple(row[:2]) != stat:
+            return None
+
+        type_string, data = row[2:]
+        variant = GLib.Variant.new_from_bytes(GLib.VariantType.new(type_string),
+                                              GLib.Bytes.new(data), False)
+        self.debug("Using the cached info of %s", uri)
+        return GstPbutils.DiscovererInfo.from_variant(variant)
+
+    def store_info(self, uri, info):
+        """Caches the info of the specified media file.
+
+        Args:
+            uri (str): The URI of the media file.
+            info (GstPbutils.DiscovererInfo): The discovered info.
+        """
+        stat = self._stat(uri)
+        if not stat or not info:
+            return
+
+        variant = info.to_variant(GstPbutils.DiscovererSerializeFlags.ALL)
+        row = (stat[0], stat[1], variant.get_type_string(),
+               sqlite3.Binary(variant.get_data_as_bytes().get_data()))
+        with self._lock:
+            self._pending[Gst.uri_get_location(uri)] = row
+        if not self.__flush_id:
+            self.__flush_id = GLib.timeout_add_seconds(
+                DISCOVERY_CACHE_FLUSH_DELAY, self.__flush_cb)
+
+    def __flush_cb(self):
+        self.__flush_id = 0
+        self.flush()
+        return False
+
+    def flush(self):
+        """Saves the infos cached in memory."""
+        with self._lock:
+            rows = [(path,) + row for path, row in self._pending.items()]
+            self._pending = {}
+            self._conn.executemany("INSERT OR REPLACE INTO Infos "
+                                   "VALUES (?, ?, ?, ?, ?)", rows)
+            self._conn.commit()
@@ -0,0 +1,633 @@
+# -*- coding: utf-8 -*-
+# Pitivi video editor
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this program; if not, write to the
+# Free Software Foundation, Inc., 51 Franklin St, Fifth Floor,
+# Boston, MA 02110-1301, USA.
+"""Exporting of projects with their media files to tar archives."""
+import copy
+import hashlib
+import io
+import os
+import shutil
+import tarfile
+import tempfile
+import threading
+import time
+from xml.etree import ElementTree
+
+from gi.repository import GES
+from gi.repository import GLib
+from gi.repository import GObject
+from gi.repository import Gst
+
+from pitivi.utils.loggable import Loggable
+from pitivi.utils.proxy import get_proxy_target
+from pitivi.utils.threads import Thread
+
+
+# The size of the chunks read from the media files.
+EXPORT_BUFFER_SIZE = 4 * 1024 * 1024
+# The minimum interval between two progress reports, in seconds.
+EXPORT_PROGRESS_INTERVAL = 0.2
+# How much of the media files is kept around the used ranges.
+CONSOLIDATE_HANDLE = Gst.SECOND
+# How long to wait for the streams of a media file to be cut, in seconds.
+CUT_STREAMS_TIMEOUT = 10
+
+
+class ExportMode:
+    """The media files included when exporting a project."""
+
+    # The media files used by the project.
+    ALL = 0
+    # The proxies of the media files, when available.
+    PROXIES = 1
+    # The ranges of the media files used by the clips.
+    USED_RANGES = 2
+
+
+class ExportAborted(Exception):
+    """Raised in the export thread when the export has been aborted."""
+
+
+class CutError(Exception):
+    """Raised when a range cannot be copied out of a media file."""
+
+
+def rewrite_project_uris(content, uris):
+    """Makes a serialized project use other media files.
+
+    Args:
+        content (bytes): The serialized project.
+        uris (dict): The new URIs by the URIs to be replaced.
+
+    Returns:
+        bytes: The serialized project using the new URIs.
+    """
+    root = ElementTree.fromstring(content)
+    ids = {asset.get("id") for asset in root.iter("asset")}
+    for ressources in root.iter("ressources"):
+        for asset in ressources.findall("asset"):
+            new_uri = uris.get(asset.get("id"))
+            if not new_uri:
+                continue
+
+            if new_uri in ids:
+                # The project already has an asset for the new URI,
+                # for example the proxy replacing the asset.
+                ressources.remove(asset)
+                continue
+
+            asset.set("id", new_uri)
+            ids.add(new_uri)
+            # The proxies are for the replaced media files.
+            asset.attrib.pop("proxy-id", None)
+
+    for clip in root.iter("clip"):
+        new_uri = uris.get(clip.get("asset-id"))
+        if new_uri:
+            clip.set("asset-id", new_uri)
+
+    return ElementTree.tostring(root, encoding="UTF-8")
+
+
+def find_used_ranges(ges_timeline, handle=CONSOLIDATE_HANDLE):
+    """Finds the ranges of the media files used by the clips of a timeline.
+
+    Args:
+        ges_timeline (GES.Timeline): The timeline.
+        handle (int): How much is kept before and after each clip,
+            in nanoseconds.
+
+    Returns:
+        Tuple[dict, dict]: The sorted and merged (start, stop) ranges by
+        media file URI, None for the media files to be kept whole, and the
+        media file URIs by the URIs of the assets used by the clips, for
+        example proxies.
+    """
+    clip_ranges = {}
+    durations = {}
+    targets = {}
+    for ges_layer in ges_timeline.get_layers():
+        for ges_clip in ges_layer.get_clips():
+            if not isinstance(ges_clip, GES.UriClip):
+                continue
+
+            asset = get_proxy_target(ges_clip)
+            uri = asset.get_id()
+            targets[ges_clip.get_asset().get_id()] = uri
+            targets[uri] = uri
+            if asset.is_image():
+                clip_ranges[uri] = None
+                continue
+
+            durations[uri] = asset.get_duration()
+            start = max(0, ges_clip.props.in_point - handle)
+            stop = min(durations[uri],
+                       ges_clip.props.in_point + ges_clip.props.duration + handle)
+            clip_ranges.setdefault(uri, []).append((start, stop))
+
+    ranges = {}
+    for uri, used in clip_ranges.items():
+        if used is None:
+            ranges[uri] = None
+            continue
+
+        merged = []
+        for start, stop in sorted(used):
+            if merged and start <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], stop))
+            else:
+                merged.append((start, stop))
+        if merged == [(0, durations[uri])]:
+            # The media file is used entirely.
+            merged = None
+        ranges[uri] = merged
+    return ranges, targets
+
+
+def _shift_keyframes(element, offset):
+    for binding in element.iter("binding"):
+        values = []
+        for value in binding.get("values", "").split():
+            timestamp, value = value.split(":", 1)
+            timestamp = int(timestamp) - offset
+            if timestamp >= 0:
+                values.append("%d:%s" % (timestamp, value))
+        binding.set("values", " %s " % "  ".join(values))
+
+
+def consolidate_project(content, cuts, targets):
+    """Makes a serialized project use the ranges cut out of its media files.
+
+    The clips use the media files into which their range has been copied,
+    and their inpoint and keyframes are shifted accordingly. The clips
+    whose range could not be copied use the original media file.
+
+    Args:
+        content (bytes): The serialized project.
+        cuts (List[MediaCut]): The ranges cut out of the media files.
+        targets (dict): The media file URIs by the URIs of the assets used
+            by the clips, as returned by `find_used_ranges`.
+
+    Returns:
+        bytes: The serialized project using the cut media files.
+    """
+    cuts_by_uri = {}
+    for cut in cuts:
+        cuts_by_uri.setdefault(cut.uri, []).append(cut)
+    # The media files included entirely, for example the images, the media
+    # files used entirely and those whose range could not be copied.
+    kept = {uri for uri in targets.values()
+            if not cuts_by_uri.get(uri) or
+            any(not cut.path for cut in cuts_by_uri[uri])}
+
+    root = ElementTree.fromstring(content)
+    for ressources in root.iter("ressources"):
+        for asset in ressources.findall("asset"):
+            if asset.get("extractable-type-name") != "GESUriClip":
+                continue
+
+            uri = asset.get("id")
+            # The proxies are not included.
+            asset.attrib.pop("proxy-id", None)
+            index = list(ressources).index(asset)
+            for cut in cuts_by_uri.get(uri, []):
+                if cut.path:
+                    cut_asset = copy.deepcopy(asset)
+                    cut_asset.set("id", cut.new_uri)
+                    ressources.insert(index, cut_asset)
+                    index += 1
+            if uri not in kept:
+                ressources.remove(asset)
+
+    for clip in root.iter("clip"):
+        uri = targets.get(clip.get("asset-id"))
+        if not uri:
+            continue
+
+        clip.set("asset-id", uri)
+        inpoint = int(clip.get("inpoint", 0))
+        for cut in cuts_by_uri.get(uri, []):
+            if cut.path and cut.start <= inpoint < cut.stop:
+                clip.set("asset-id", cut.new_uri)
+                clip.set("inpoint", str(inpoint - cut.actual_start))
+                # The keyframes of the effects are relative to the clip.
+                for source in clip.iter("source"):
+                    _shift_keyframes(source, cut.actual_start)
+                break
+
+    return ElementTree.tostring(root, encoding="UTF-8")
+
+
+class MediaCut:
+    """A range of a media file to be copied into a separate media file.
+
+    Attributes:
+        uri (str): The URI of the media file.
+        start (int): The start of the range, in nanoseconds.
+        stop (int): The end of the range, in nanoseconds.
+        new_uri (str): The URI of the media file containing the range,
+            in the exported project.
+        arcname (str): The name of the media file containing the range,
+            in the archive.
+        source_arcname (str): The name of the media file in the archive,
+            if the range cannot be copied.
+        size (int): The estimated size of the range, in bytes.
+        path (str): The path of the media file into which the range has
+            been copied, or None.
+        actual_start (int): The position of the media file corresponding to
+            the start of the copy, as it starts at a keyframe.
+    """
+
+    def __init__(self, uri, start, stop, new_uri, arcname, source_arcname, size):
+        self.uri = uri
+        self.start = start
+        self.stop = stop
+        self.new_uri = new_uri
+        self.arcname = arcname
+        self.source_arcname = source_arcname
+        self.size = size
+        self.path = None
+        self.actual_start = start
+
+
+class MediaCutter(Loggable):
+    """Copies a range of a media file without re-encoding it.
+
+    The streams of the media file are parsed and muxed in a Matroska file,
+    starting with the keyframe preceding the range.
+
+    Attributes:
+        cut (MediaCut): The range to be copied.
+    """
+
+    def __init__(self, cut):
+        Loggable.__init__(self)
+        self.cut = cut
+        self.pipeline = None
+        self._mux = None
+        self._probes = []
+        self._segment_starts = []
+        self._seeked = False
+        self._incompatible = False
+        self._pads_ready = threading.Event()
+
+    def run(self, path, is_aborted):
+        """Copies the range to the specified file, blocking until done.
+
+        Args:
+            path (str): The path of the new media file.
+            is_aborted (function): Called regularly, stops the cut if it
+                returns True.
+
+        Raises:
+            CutError: The range could not be copied.
+            ExportAborted: The cut has been stopped.
+        """
+        self.pipeline = Gst.Pipeline.new("cutter")
+        filesrc = Gst.ElementFactory.make("filesrc", None)
+        parsebin = Gst.ElementFactory.make("parsebin", None)
+        self._mux = Gst.ElementFactory.make("matroskamux", None)
+        filesink = Gst.ElementFactory.make("filesink", None)
+        if not all((filesrc, parsebin, self._mux, filesink)):
+            raise CutError("Missing GStreamer elements")
+
+        filesrc.props.location = Gst.uri_get_location(self.cut.uri)
+        filesink.props.location = path
+        # Pausing has to succeed before the first buffer, for seeking.
+        filesink.set_property("async", False)
+        for element in (filesrc, parsebin, self._mux, filesink):
+            self.pipeline.add(element)
+        filesrc.link(parsebin)
+        self._mux.link(filesink)
+        parsebin.connect("pad-added", self._pad_added_cb)
+        parsebin.connect("no-more-pads", self._no_more_pads_cb)
+
+        bus = self.pipeline.get_bus()
+        try:
+            self.pipeline.set_state(Gst.State.PAUSED)
+            waited = 0
+            while not self._pads_ready.wait(0.1):
+                self._check_bus(bus, is_aborted)
+                waited += 0.1
+                if waited > CUT_STREAMS_TIMEOUT:
+                    raise CutError("Timed out waiting for the streams")
+            if self._incompatible:
+                raise CutError("The streams cannot be muxed without re-encoding")
+
+            # Flushing releases the blocked buffers from the beginning.
+            self._seeked = True
+            if not self.pipeline.seek(1.0, Gst.Format.TIME,
+                                      Gst.SeekFlags.FLUSH |
+                                      Gst.SeekFlags.KEY_UNIT |
+                                      Gst.SeekFlags.SNAP_BEFORE,
+                                      Gst.SeekType.SET, self.cut.start,
+                                      Gst.SeekType.SET, self.cut.stop):
+                raise CutError("Seeking failed")
+            for pad, probe_id in self._probes:
+                pad.remove_probe(probe_id)
+
+            self.pipeline.set_state(Gst.State.PLAYING)
+            while not self._check_bus(bus, is_aborted):
+                pass
+        finally:
+            self.pipeline.set_state(Gst.State.NULL)
+            self.pipeline = None
+
+        if self._segment_starts:
+            self.cut.actual_start = min(self._segment_starts)
+
+    def _check_bus(self, bus, is_aborted):
+        if is_aborted():
+            raise ExportAborted()
+
+        message = bus.timed_pop_filtered(
+            100 * Gst.MSECOND, Gst.MessageType.EOS | Gst.MessageType.ERROR)
+        if not message:
+            return False
+        if message.type == Gst.MessageType.ERROR:
+            error, unused_details = message.parse_error()
+            raise CutError(error.message)
+        return True
+
+    def _pad_added_cb(self, unused_parsebin, pad):
+        queue = Gst.ElementFactory.make("queue", None)
+        self.pipeline.add(queue)
+        queue.sync_state_with_parent()
+        pad.link(queue.get_static_pad("sink"))
+        if not queue.link(self._mux):
+            self.warning("Cannot mux %s", pad.get_current_caps())
+            self._incompatible = True
+
+        # Block the data until seeking to the range.
+        probe_id = pad.add_probe(
+            Gst.PadProbeType.BLOCK | Gst.PadProbeType.BUFFER,
+            self._block_cb)
+        self._probes.append((pad, probe_id))
+        pad.add_probe(Gst.PadProbeType.EVENT_DOWNSTREAM, self._event_cb)
+
+    def _no_more_pads_cb(self, unused_parsebin):
+        self._pads_ready.set()
+
+    def _block_cb(self, unused_pad, unused_info):
+        return Gst.PadProbeReturn.OK
+
+    def _event_cb(self, unused_pad, info):
+        event = info.get_event()
+        if self._seeked and event.type == Gst.EventType.SEGMENT:
+            segment = event.parse_segment()
+            self._segment_starts.append(segment.start)
+        return Gst.PadProbeReturn.OK
+
+
+class ProjectExporter(Thread):
+    """Thread writing a project and its media files to a tar archive.
+
+    The media files are streamed into the archive in big chunks. A file
+    included several times, for example through symlinks or copies,
+    is stored only once and the other occurrences are hard links to it.
+
+    When consolidating, the used ranges of the media files are first
+    copied into separate media files and the project is changed to use
+    them. A media file whose range cannot be copied is included entirely.
+
+    The signals are emitted in the main thread.
+
+    Attributes:
+        path (str): The path of the archive.
+        project_name (str): The name of the project file in the archive.
+        project_content (bytes): The serialized project.
+        sources (List[Tuple[str, str]]): The paths of the media files and
+            their names in the archive.
+        cuts (List[MediaCut]): The ranges to be copied out of media files.
+        targets (dict): The media file URIs by the URIs of the assets used
+            by the clips, when consolidating.
+        failure (Exception): The error which occurred, if any.
+    """
+
+    __gsignals__ = {
+        "progress": (GObject.SignalFlags.RUN_LAST, None, (float, int)),
+        "exported": (GObject.SignalFlags.RUN_LAST, None, (object,)),
+    }
+
+    def __init__(self, path, project_name, project_content, sources,
+                 cuts=(), targets=None):
+        Thread.__init__(self)
+        self.path = path
+        self.project_name = project_name
+        self.project_content = project_content
+        self.sources = list(sources)
+        self.cuts = cuts
+        self.targets = targets
+        self.failure = None
+
+        self._aborted = False
+        self._total = 0
+        self._done = 0
+        self._start_time = 0
+        self._last_report = 0
+
+    def abort(self):
+        """Stops the export as soon as possible and removes the archive."""
+        self._aborted = True
+
+    def process(self):
+        self._start_time = time.time()
+        cuts_dir = None
+        try:
+            if self.cuts:
+                cuts_dir = tempfile.mkdtemp(prefix=".cuts-",
+                                            dir=os.path.dirname(self.path))
+                self._cut(cuts_dir)
+            files = self._find_duplicates()
+            self._write(files)
+        except ExportAborted:
+            self.info("Export aborted, removing %s", self.path)
+            self._remove_archive()
+        except Exception as e:
+            # Keep the exception generic enough to catch programming errors.
+            self.failure = e
+            self.error("Failed exporting to %s: %s", self.path, e)
+            self._keep_corrupt_archive()
+        else:
+            self.info("Exported %d bytes in %.1f s", self._done,
+                      time.time() - self._start_time)
+        if cuts_dir:
+            shutil.rmtree(cuts_dir, ignore_errors=True)
+        GLib.idle_add(self.__exported_cb)
+
+    def __exported_cb(self):
+        self.join()
+        self.emit("exported", self.failure)
+        return False
+
+    def _cut(self, cuts_dir):
+        # The ranges are read, and then written to the archive.
+        self._total += sum(cut.size for cut in self.cuts) * 2
+        for index, cut in enumerate(self.cuts):
+            path = os.path.join(cuts_dir, "%d.mkv" % index)
+            try:
+                MediaCutter(cut).run(path, lambda: self._aborted)
+            except CutError as e:
+                self.warning("Including %s entirely, cannot copy %d-%d: %s",
+                             cut.uri, cut.start, cut.stop, e)
+                source = (Gst.uri_get_location(cut.uri), cut.source_arcname)
+                if source not in self.sources:
+                    self.sources.append(source)
+            else:
+                cut.path = path
+                self.sources.append((path, cut.arcname))
+            # The actual sizes are counted when writing the archive.
+            self._done += cut.size
+            self._total -= cut.size
+            self._report_progress()
+
+        self.project_content = consolidate_project(self.project_content,
+                                                   self.cuts, self.targets)
+
+    def _find_duplicates(self):
+        """Finds the media files included more than once.
+
+        Returns:
+            List[Tuple[str, str, str]]: The path and the name in the archive
+            of each media file, and the name of the member with the same
+            content, or None.
+        """
+        stats = [os.stat(path) for path, unused_arcname in self.sources]
+        inodes_by_size = {}
+        for stat in stats:
+            inodes = inodes_by_size.setdefault(stat.st_size, set())
+            inodes.add((stat.st_dev, stat.st_ino))
+
+        # Only the distinct files having the same size need to be hashed.
+        hashed_sizes = {size for size, inodes in inodes_by_size.items()
+                        if len(inodes) > 1}
+        for size, inodes in inodes_by_size.items():
+            copies = 2 if size in hashed_sizes else 1
+            self._total += size * len(inodes) * copies
+
+        files = []
+        arcnames = {}
+        digests = {}
+        for (path, arcname), stat in zip(self.sources, stats):
+            key = (stat.st_dev, stat.st_ino)
+            if stat.st_size in hashed_sizes:
+                if key not in digests:
+                    digests[key] = (stat.st_size, self._hash(path))
+                    if digests[key] in arcnames:
+                        # A copy of a file already included.
+                        self._total -= stat.st_size
+                key = digests[key]
+
+            if key in arcnames:
+                self.debug("%s is the same as %s", path, arcnames[key])
+                files.append((path, arcname, arcnames[key]))
+            else:
+                arcnames[key] = arcname
+                files.append((path, arcname, None))
+        return files
+
+    def _hash(self, path):
+        digest = hashlib.sha256()
+        with open(path, "rb") as media:
+            while True:
+                data = self.read_chunk(media, EXPORT_BUFFER_SIZE)
+                if not data:
+                    break
+                digest.update(data)
+        return digest.digest()
+
+    def read_chunk(self, fileobj, size):
+        """Reads data to be exported and reports the progress.
+
+        Args:
+            fileobj (io.BufferedReader): The file being exported.
+            size (int): The maximum number of bytes to read.
+
+        Returns:
+            bytes: The data read, empty at the end of the file.
+
+        Raises:
+            ExportAborted: The export has been aborted.
+        """
+        if self._aborted:
+            raise ExportAborted()
+
+        data = fileobj.read(size)
+        self._done += len(data)
+        self._report_progress()
+        return data
+
+    def _write(self, files):
+        with tarfile.open(self.path, mode="w") as tar:
+            tar.dereference = True
+            tar.copybufsize = EXPORT_BUFFER_SIZE
+
+            tarinfo = tarfile.TarInfo(self.project_name)
+            tarinfo.size = len(self.project_content)
+            tarinfo.mtime = int(time.time())
+            tar.addfile(tarinfo, io.BytesIO(self.project_content))
+
+            for path, arcname, linkname in files:
+                tarinfo = tar.gettarinfo(path, arcname)
+                if linkname:
+                    tarinfo.type = tarfile.LNKTYPE
+                    tarinfo.linkname = linkname
+                    tarinfo.size = 0
+                    tar.addfile(tarinfo)
+                    continue
+
+                with open(path, "rb") as media:
+                    tar.addfile(tarinfo, _ProgressReader(self, media))
+
+    def _report_progress(self):
+        now = time.time()
+        if now - self._last_report < EXPORT_PROGRESS_INTERVAL:
+            return
+        self._last_report = now
+
+        fraction = self._done / self._total if self._total else 1
+        elapsed = now - self._start_time
+        remaining = 0
+        if self._done:
+            remaining = int(elapsed * (self._total - self._done) / self._done)
+        GLib.idle_add(self.emit, "progress", min(fraction, 1), remaining)
+
+    def _remove_archive(self):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+    def _keep_corrupt_archive(self):
+        if not os.path.isfile(self.path):
+            return
+
+        name, extension = os.path.splitext(self.path)
+        renamed = name + " (CORRUPT)" + extension
+        self.warning('An error occurred, will save the tarball as "%s"', renamed)
+        os.rename(self.path, renamed)
+
+
+class _ProgressReader:
+    """File wrapper reporting the progress of an export."""
+
+    def __init__(self, exporter, fileobj):
+        self.exporter = exporter
+        self.fileobj = fileobj
+
+    def read(self, size=-1):
+        return self.exporter.read_chunk(self.fileobj, size)
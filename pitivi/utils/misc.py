@@ -20,6 +20,7 @@
 import bisect
 import hashlib
 import os
+import queue
 import subprocess
 import threading
 import time
@@ -30,6 +31,7 @@ from urllib.parse import urlsplit
 
 from gi.repository import GdkPixbuf
 from gi.repository import GES
+from gi.repository import Gio
 from gi.repository import GLib
 from gi.repository import Gst
 from gi.repository import Gtk
@@ -185,18 +187,53 @@ def quote_uri(uri):
     return Gst.filename_to_uri(raw_path)
 
 
+# How many URIs are found before being passed at once to the callback.
+PATH_WALKER_BATCH_SIZE = 100
+# The maximum interval between passing the found URIs, in seconds.
+PATH_WALKER_BATCH_INTERVAL = 0.1
+# How many directories are scanned at the same time, which helps with the
+# latency of network file systems.
+PATH_WALKER_THREADS = 4
+
+
 class PathWalker(Thread):
-    """Thread for recursively searching in a list of directories."""
+    """Thread for recursively searching in a list of directories.
 
-    def __init__(self, uris, callback):
+    The URIs of the found files are passed to the callback in batches while
+    searching, in the main thread. An empty batch signals the end of the
+    search.
+
+    Args:
+        uris (List[str]): The URIs of the files and directories to search.
+        callback (function): The function called with lists of URIs.
+        mime_types (Optional[List[str]]): The MIME types of the files to be
+            found in the directories. When specified, the files whose name
+            indicates a type which is neither audio, video, image, nor a
+            subtype of these types are skipped.
+        num_threads (Optional[int]): How many directories are scanned at
+            the same time.
+    """
+
+    def __init__(self, uris, callback, mime_types=None,
+                 num_threads=PATH_WALKER_THREADS):
         Thread.__init__(self)
         self.log("New PathWalker for %s", uris)
         self.uris = uris
         self.callback = callback
+        self.mime_types = set(mime_types) if mime_types is not None else None
+        self.num_threads = num_threads
         self.stopme = threading.Event()
 
+        # Whether the files are supported, by extension.
+        self._supported_extensions = {}
+        # The directories to be scanned.
+        self._folders = queue.Queue()
+        self._lock = threading.Lock()
+        self._batch = []
+        self._last_delivery = 0
+
     def _scan(self, uris):
-        """Scans the URIs and yields the file URIs."""
+        """Scans the URIs, queues the directories and yields the file URIs."""
         for uri in uris:
             if self.stopme.is_set():
                 return
@@ -208,24 +245,93 @@ class PathWalker(Thread):
             if os.path.isfile(path):
                 yield uri
             elif os.path.isdir(path):
-                yield from self._scan_dir(path)
+                self._folders.put(path)
             else:
                 self.warning("Unusable, not a file nor a dir: %s, %s", uri, path)
 
+    def _scan_folders(self):
+        """Scans the queued directories until getting None."""
+        while True:
+            folder = self._folders.get()
+            try:
+                if folder is None:
+                    return
+                if not self.stopme.is_set():
+                    self._scan_dir(folder)
+            finally:
+                self._folders.task_done()
+
     def _scan_dir(self, folder):
-        """Scans the folder recursively and yields the URIs of the files."""
+        """Scans the folder, queues its subdirectories and delivers its files."""
         self.log("Scanning folder %s", folder)
-        for path, dirs, files in os.walk(folder):
-            if self.stopme.is_set():
+        try:
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    if self.stopme.is_set():
+                        return
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            self._folders.put(entry.path)
+                        elif entry.is_file() and self._is_supported(entry.name):
+                            self._found(Gst.filename_to_uri(entry.path))
+                    except OSError as e:
+                        self.warning("Cannot use %s: %s", entry.path, e)
+        except OSError as e:
+            self.warning("Cannot scan folder %s: %s", folder, e)
+
+    def _is_supported(self, filename):
+        if self.mime_types is None:
+            return True
+
+        extension = os.path.splitext(filename)[1].lower()
+        supported = self._supported_extensions.get(extension)
+        if supported is None:
+            content_type, uncertain = Gio.content_type_guess(filename, None)
+            mime_type = Gio.content_type_get_mime_type(content_type) or ""
+            # Let the discoverer decide when the name is not enough
+            # or when the file might be a media file.
+            supported = uncertain or \
+                mime_type.split("/")[0] in ("audio", "video", "image") or \
+                any(Gio.content_type_is_mime_type(content_type, supported_type)
+                    for supported_type in self.mime_types)
+            self._supported_extensions[extension] = supported
+        return supported
+
+    def _found(self, uri):
+        with self._lock:
+            self._batch.append(uri)
+            if len(self._batch) < PATH_WALKER_BATCH_SIZE and \
+                    time.time() - self._last_delivery < PATH_WALKER_BATCH_INTERVAL:
                 return
-            for afile in files:
-                yield Gst.filename_to_uri(os.path.join(path, afile))
+        self._deliver()
 
-    def process(self):
-        uris = list(self._scan(self.uris))
+    def _deliver(self):
+        with self._lock:
+            uris = self._batch
+            self._batch = []
+            self._last_delivery = time.time()
         if uris:
             GLib.idle_add(self.callback, uris)
 
+    def process(self):
+        for uri in self._scan(self.uris):
+            self._found(uri)
+
+        if not self._folders.empty():
+            threads = [threading.Thread(target=self._scan_folders)
+                       for unused_i in range(self.num_threads)]
+            for thread in threads:
+                thread.start()
+            # Wait until all the directories have been scanned.
+            self._folders.join()
+            for thread in threads:
+                self._folders.put(None)
+            for thread in threads:
+                thread.join()
+
+        self._deliver()
+        GLib.idle_add(self.callback, [])
+
     def abort(self):
         self.stopme.set()
 
@@ -40,6 +40,7 @@ PIPELINE_SIGNALS = {
     "error": (GObject.SignalFlags.RUN_LAST, None, (GObject.TYPE_STRING, GObject.TYPE_STRING)),
     "died": (GObject.SignalFlags.RUN_LAST, None, ()),
     "async-done": (GObject.SignalFlags.RUN_LAST, None, ()),
+    "qos": (GObject.SignalFlags.RUN_LAST, None, (GObject.TYPE_PYOBJECT, GObject.TYPE_UINT64, GObject.TYPE_UINT64)),
 }
 
 MAX_RECOVERIES = 3
@@ -68,6 +69,8 @@ class SimplePipeline(GObject.Object, Loggable):
         position: The current position of the pipeline changed.
         eos: The Pipeline has finished playing.
         error: An error happened.
+        qos: An element dropped buffers, with the number of buffers it
+            processed and dropped since the last flush.
 
     Attributes:
         _pipeline (Gst.Pipeline): The low-level pipeline.
@@ -430,6 +433,9 @@ class SimplePipeline(GObject.Object, Loggable):
             if not self._rendering():
                 self._removeWaitingForAsyncDoneTimeout()
                 self._recover()
+        elif message.type == Gst.MessageType.QOS:
+            unused_format, processed, dropped = message.parse_qos_stats()
+            self.emit("qos", message.src, processed, dropped)
         elif message.type == Gst.MessageType.DURATION_CHANGED:
             self.debug("Querying duration async, because it changed")
             GLib.idle_add(self._queryDurationAsync)
@@ -501,6 +507,14 @@ class SimplePipeline(GObject.Object, Loggable):
             raise PipelineError("Couldn't get duration: Returned None")
         return dur
 
+    def is_rendering(self):
+        """Checks whether the pipeline is rendering instead of playing.
+
+        Returns:
+            bool: True iff the pipeline is rendering.
+        """
+        return self._rendering()
+
     def _rendering(self):
         return False
 
@@ -16,7 +16,12 @@
 # License along with this program; if not, write to the
 # Free Software Foundation, Inc., 51 Franklin St, Fifth Floor,
 # Boston, MA 02110-1301, USA.
+import contextlib
+import heapq
+import itertools
+import json
 import os
+import sqlite3
 import time
 
 from gi.repository import GES
@@ -29,7 +34,12 @@ from gi.repository import GstTranscoder
 
 from pitivi.configure import get_gstpresets_dir
 from pitivi.settings import GlobalSettings
+from pitivi.settings import xdg_cache_home
+from pitivi.utils.discovery import DiscoveryCache
 from pitivi.utils.loggable import Loggable
+from pitivi.utils.misc import hash_file
+from pitivi.utils.pipeline import PipelineError
+from pitivi.utils.system import CPUUsageTracker
 
 # Make sure gst knowns about our own GstPresets
 Gst.preset_set_app_dir(get_gstpresets_dir())
@@ -41,6 +51,17 @@ class ProxyingStrategy:
     NOTHING = "nothing"
 
 
+class ProxyTier:
+    """The assets played by the clips, from the slowest to the fastest."""
+
+    # The assets chosen by the user.
+    DEFAULT = 0
+    # The full resolution proxies, when available.
+    PROXY = 1
+    # The scaled proxies, when available.
+    SCALED = 2
+
+
 GlobalSettings.addConfigSection("proxy")
 GlobalSettings.addConfigOption('proxyingStrategy',
                                section='proxy',
@@ -54,25 +75,783 @@ GlobalSettings.addConfigOption("max_cpu_usage",
                                section="proxy",
                                key="max-cpu-usage",
                                default=10)
+# The CPU usage percentage above which fewer proxies are created in parallel.
+GlobalSettings.addConfigOption("max_total_cpu_usage",
+                               section="proxy",
+                               key="max-total-cpu-usage",
+                               default=80)
+# The number of chunks of a long asset transcoded in parallel.
+GlobalSettings.addConfigOption("numChunkTranscodingJobs",
+                               section="proxy",
+                               key="num-chunk-proxying-jobs",
+                               default=1)
+# By how much the resolution of the scaled proxies is divided, 2 or 4.
+# The scaled proxies are not created when 0.
+GlobalSettings.addConfigOption("scaledProxiesDivisor",
+                               section="proxy",
+                               key="scaled-proxies-divisor",
+                               default=0)
+# Whether faster assets are used for playback when dropping frames.
+GlobalSettings.addConfigOption("autoSwitchProxies",
+                               section="proxy",
+                               key="auto-switch-proxies",
+                               default=True)
+
+# The priorities of the proxying jobs, the lower the sooner.
+PROXY_PRIORITY_PLAYHEAD = 0
+PROXY_PRIORITY_TIMELINE = 1
+PROXY_PRIORITY_LIBRARY = 2
+PROXY_PRIORITY_SCALED = 3
+
+# How often the jobs are reordered and the concurrency adjusted, in seconds.
+PROXY_SCHEDULER_INTERVAL = 2
+# How much faster the transcoding must get for running one more job
+# in parallel to be worth it.
+PROXY_MIN_SPEEDUP = 1.1
+
+# The duration of the chunks in which the long assets are transcoded,
+# so the transcoding can be resumed, in nanoseconds.
+PROXY_CHUNK_DURATION = 5 * 60 * Gst.SECOND
+# The minimum duration of the assets transcoded in chunks.
+PROXY_CHUNKED_MIN_DURATION = 2 * PROXY_CHUNK_DURATION
+
+# The ratio of dropped frames above which faster assets are played.
+PROXY_TIER_MAX_DROP_RATIO = 0.05
+# The period over which the dropped frames are counted, in seconds.
+PROXY_TIER_MEASURE_PERIOD = 3
+# How long the playback must be smooth before slower assets are played
+# again, in seconds.
+PROXY_TIER_RECOVERY_DELAY = 30
 
 
 ENCODING_FORMAT_PRORES = "prores-raw-in-matroska.gep"
 ENCODING_FORMAT_JPEG = "jpeg-raw-in-matroska.gep"
 
 
-def createEncodingProfileSimple(container_caps, audio_caps, video_caps):
-    c = GstPbutils.EncodingContainerProfile.new(None, None,
-                                                Gst.Caps(container_caps),
-                                                None)
-    a = GstPbutils.EncodingAudioProfile.new(Gst.Caps(audio_caps),
-                                            None, None, 0)
-    v = GstPbutils.EncodingVideoProfile.new(Gst.Caps(video_caps),
-                                            None, None, 0)
+class ProxyJob(object):
+    """A transcoding job.
+
+    Attributes:
+        asset (GES.Asset): The asset being transcoded.
+        transcoder (GstTranscoder.Transcoder): The transcoder creating
+            the proxy.
+        priority (int): The lower, the sooner the job is run.
+        started (bool): Whether the transcoder has been started.
+        paused (bool): Whether the started transcoder has been paused,
+            to let more important jobs run.
+        held (bool): Whether the job has been paused explicitly, in which
+            case it is not run until resumed.
+        position (int): How much has been transcoded, in nanoseconds.
+        key (str): What identifies the job, the URI of the asset, or of the
+            scaled proxy for the jobs creating scaled proxies.
+    """
+
+    def __init__(self, asset, transcoder, priority, key=None):
+        self.asset = asset
+        self.transcoder = transcoder
+        self.priority = priority
+        self.key = key or asset.props.id
+        self.started = False
+        self.paused = False
+        self.held = False
+        self.position = 0
+
+    @property
+    def uri(self):
+        """Gets the URI of the asset being transcoded."""
+        return self.asset.props.id
+
+    def run(self):
+        """Starts or resumes the transcoding."""
+        if not self.started:
+            self.started = True
+            self.transcoder.run_async()
+        elif self.paused:
+            if isinstance(self.transcoder, ChunkedTranscoder):
+                self.transcoder.resume()
+            else:
+                self.transcoder.props.pipeline.set_state(Gst.State.PLAYING)
+        self.paused = False
+
+    def pause(self):
+        """Pauses the transcoding, keeping the pipeline."""
+        if self.started and not self.paused:
+            if isinstance(self.transcoder, ChunkedTranscoder):
+                self.transcoder.pause()
+            else:
+                self.transcoder.props.pipeline.set_state(Gst.State.PAUSED)
+        self.paused = True
+
+    def cancel(self):
+        """Stops the transcoding for good."""
+        if isinstance(self.transcoder, ChunkedTranscoder):
+            # The completed chunks are kept for resuming later.
+            self.transcoder.stop()
+
+
+class ProxyScheduler(Loggable):
+    """Schedules the transcoding jobs.
+
+    The pending jobs are run in the order of their priority, and in the
+    order in which they have been added for equal priorities. When a
+    pending job is more important than a running one, the latter is paused
+    to let the former run.
+
+    The number of jobs run in parallel is adjusted to the measured CPU usage
+    and transcoding throughput: one more job is run as long as the CPU is
+    not overloaded and the throughput increases.
+
+    Attributes:
+        jobs (dict): The pending and running ProxyJobs by key.
+        concurrency (int): The number of jobs run in parallel.
+        max_jobs (int): The maximum number of jobs run in parallel.
+        max_cpu_usage (int): The CPU usage percentage above which fewer
+            jobs are run in parallel.
+    """
+
+    def __init__(self, max_jobs, max_cpu_usage):
+        Loggable.__init__(self)
+        self.jobs = {}
+        self.concurrency = 1
+        self.max_jobs = max_jobs
+        self.max_cpu_usage = max_cpu_usage
+
+        # The heap of (priority, counter, ProxyJob) tuples of the jobs
+        # waiting to be run. The removed jobs are skipped when popped.
+        self._queue = []
+        self._counter = itertools.count()
+        # The jobs being run.
+        self._running = []
+
+        # The measured throughput, in transcoded seconds per second,
+        # by number of jobs run in parallel.
+        self._throughputs = {}
+        # The positions of the running jobs by key, at the last measurement.
+        self._positions = {}
+        self._measure_time = 0
+
+    def add(self, job):
+        """Queues a job and runs it if possible."""
+        self.jobs[job.key] = job
+        self.__push(job)
+        self.schedule()
+
+    def get(self, key):
+        """Gets the pending or running job with the specified key."""
+        return self.jobs.get(key)
+
+    def remove(self, key):
+        """Removes the job with the specified key.
+
+        Returns:
+            ProxyJob: The removed job, or None if missing.
+        """
+        job = self.jobs.pop(key, None)
+        if job in self._running:
+            self._running.remove(job)
+            self.schedule()
+        elif job:
+            # Release the transcoder.
+            self._queue = [entry for entry in self._queue if entry[2] is not job]
+            heapq.heapify(self._queue)
+        return job
+
+    def __push(self, job):
+        heapq.heappush(self._queue, (job.priority, next(self._counter), job))
+
+    def __pop(self):
+        """Pops the most important pending job, or None if missing."""
+        while self._queue:
+            job = self._queue[0][2]
+            if self.jobs.get(job.key) is not job or job.held or job in self._running:
+                heapq.heappop(self._queue)
+                continue
+            return job
+        return None
+
+    def hold(self, key):
+        """Pauses the job with the specified key until released."""
+        job = self.jobs.get(key)
+        if not job or job.held:
+            return
+
+        job.held = True
+        if job in self._running:
+            job.pause()
+            self._running.remove(job)
+            self.schedule()
+
+    def release(self, key):
+        """Lets the job with the specified key run again."""
+        job = self.jobs.get(key)
+        if not job or not job.held:
+            return
+
+        job.held = False
+        self.__push(job)
+        self.schedule()
+
+    def reprioritize(self, get_priority):
+        """Updates the priorities of the jobs.
+
+        Args:
+            get_priority (function): Gets the new priority of a job.
+        """
+        queue = []
+        for job in self.jobs.values():
+            job.priority = get_priority(job)
+            if not job.held and job not in self._running:
+                queue.append((job.priority, next(self._counter), job))
+        heapq.heapify(queue)
+        self._queue = queue
+        self.schedule()
+
+    def schedule(self):
+        """Runs the most important jobs, pausing the others if needed."""
+        while len(self._running) < min(self.concurrency, self.max_jobs):
+            job = self.__pop()
+            if not job:
+                break
+            heapq.heappop(self._queue)
+            self.__run(job)
+
+        # Preempt the running jobs less important than the pending ones.
+        while self._running:
+            job = self.__pop()
+            if not job:
+                break
+            least_important = max(self._running, key=lambda job: job.priority)
+            if job.priority >= least_important.priority:
+                break
+            heapq.heappop(self._queue)
+            self.debug("Pausing %s to proxy %s first",
+                       least_important.key, job.key)
+            least_important.pause()
+            self._running.remove(least_important)
+            self.__push(least_important)
+            self.__run(job)
+
+        # Pause the jobs in excess after lowering the concurrency.
+        while len(self._running) > max(1, min(self.concurrency, self.max_jobs)):
+            job = max(self._running, key=lambda job: job.priority)
+            job.pause()
+            self._running.remove(job)
+            self.__push(job)
+
+    def __run(self, job):
+        self.debug("Running %s (priority %d)", job.key, job.priority)
+        job.run()
+        self._running.append(job)
+
+    def measure(self):
+        """Measures the throughput of the running jobs.
+
+        Returns:
+            float: The transcoded seconds per second since the previous
+                measurement, or None if the jobs changed meanwhile.
+        """
+        now = time.time()
+        positions = {job.key: job.position for job in self._running}
+        throughput = None
+        if self._measure_time and positions.keys() == self._positions.keys():
+            transcoded = sum(position - self._positions[key]
+                             for key, position in positions.items())
+            throughput = transcoded / Gst.SECOND / (now - self._measure_time)
+        self._positions = positions
+        self._measure_time = now
+        return throughput
+
+    def adapt(self, cpu_usage, throughput):
+        """Adjusts the number of jobs run in parallel.
+
+        Args:
+            cpu_usage (float): The CPU usage percentage.
+            throughput (float): The throughput with the current concurrency,
+                or None if unknown.
+        """
+        if throughput is None or len(self._running) < self.concurrency:
+            # Not measured or not enough jobs for measuring the concurrency.
+            return
+
+        self._throughputs[self.concurrency] = throughput
+        fewer = self._throughputs.get(self.concurrency - 1)
+        more = self._throughputs.get(self.concurrency + 1)
+        concurrency = self.concurrency
+        if cpu_usage > self.max_cpu_usage:
+            concurrency -= 1
+        elif fewer is not None and throughput < fewer * PROXY_MIN_SPEEDUP:
+            # The last added job did not help, the transcoding is probably
+            # limited by the disk.
+            concurrency -= 1
+        elif more is None or more >= throughput * PROXY_MIN_SPEEDUP:
+            concurrency += 1
+        concurrency = max(1, min(concurrency, self.max_jobs))
+
+        if concurrency != self.concurrency:
+            self.info("Running %d proxying jobs in parallel instead of %d"
+                      " (CPU usage: %d%%, throughput: %.1f)",
+                      concurrency, self.concurrency, cpu_usage, throughput)
+            self.concurrency = concurrency
+            self.schedule()
+
+    def done(self, key):
+        """Handles the end of the job with the specified key."""
+        job = self.jobs.pop(key, None)
+        if job in self._running:
+            self._running.remove(job)
+        if not self.jobs:
+            # The measurements depend on the assets.
+            self._throughputs = {}
+            self._measure_time = 0
+        self.schedule()
+
+
+class ChunksManifest(object):
+    """The list of the transcoded chunks of a proxy, saved next to it.
+
+    Attributes:
+        path (str): The path of the manifest file.
+        params (dict): What identifies the transcoding, the chunks being
+            discarded if it changes.
+        chunks (set): The indexes of the transcoded chunks.
+    """
+
+    def __init__(self, path, params):
+        self.path = path
+        self.params = params
+        self.chunks = set()
+
+    def load(self):
+        """Loads the transcoded chunks, if any and still valid."""
+        self.chunks = set()
+        try:
+            with open(self.path) as manifest:
+                data = json.load(manifest)
+        except (OSError, ValueError):
+            return
+
+        if data.get("params") == self.params:
+            self.chunks = set(data.get("chunks", []))
+
+    def add(self, index):
+        """Records a transcoded chunk."""
+        self.chunks.add(index)
+        data = {"params": self.params, "chunks": sorted(self.chunks)}
+        # Make sure the manifest is never left half written.
+        with open(self.path + ".tmp", "w") as manifest:
+            json.dump(data, manifest)
+        os.replace(self.path + ".tmp", self.path)
+
+    def remove(self):
+        """Deletes the manifest."""
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class ProxyChunk(Loggable):
+    """Pipeline transcoding a range of an asset into a file.
+
+    Attributes:
+        index (int): The index of the chunk.
+        start (int): The start of the range, in nanoseconds.
+        stop (int): The end of the range, in nanoseconds.
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, transcoder, index, start, stop, dest_path):
+        Loggable.__init__(self)
+        self.transcoder = transcoder
+        self.index = index
+        self.start = start
+        self.stop = stop
+        self.dest_path = dest_path
+        self._seeked = False
+
+        self.pipeline = Gst.Pipeline.new("proxy-chunk-%d" % index)
+        transcodebin = Gst.ElementFactory.make("uritranscodebin", None)
+        transcodebin.props.source_uri = transcoder.props.src_uri
+        transcodebin.props.dest_uri = Gst.filename_to_uri(dest_path + ".part")
+        transcodebin.props.profile = transcoder.encoding_profile
+        self.pipeline.add(transcodebin)
+
+        clock = GObject.new(GObject.type_from_name("GstCpuThrottlingClock"))
+        clock.props.cpu_usage = transcoder.cpu_usage
+        self.pipeline.use_clock(clock)
+
+        bus = self.pipeline.get_bus()
+        bus.add_signal_watch()
+        bus.connect("message", self.__bus_message_cb)
+
+    def run(self):
+        """Starts the transcoding, which is paused to seek first."""
+        self.pipeline.set_state(Gst.State.PAUSED)
+
+    def resume(self):
+        """Resumes the transcoding paused by the transcoder."""
+        if self._seeked:
+            self.pipeline.set_state(Gst.State.PLAYING)
+        # Otherwise it is played when the seek is done.
+
+    def position(self):
+        """Gets how much of the chunk has been transcoded."""
+        if not self._seeked:
+            return 0
+        res, position = self.pipeline.query_position(Gst.Format.TIME)
+        if not res:
+            return 0
+        return max(0, min(position, self.stop) - self.start)
+
+    def release(self):
+        """Stops the pipeline."""
+        self.pipeline.set_state(Gst.State.NULL)
+        self.pipeline.get_bus().remove_signal_watch()
+        self.pipeline.get_bus().disconnect_by_func(self.__bus_message_cb)
+
+    def __bus_message_cb(self, unused_bus, message):
+        if message.type == Gst.MessageType.ASYNC_DONE:
+            if not self._seeked:
+                # Seeking keeps the pipeline paused, so it can be done
+                # even when the transcoder has been paused meanwhile.
+                self._seeked = True
+                self.pipeline.seek(1.0, Gst.Format.TIME,
+                                   Gst.SeekFlags.FLUSH | Gst.SeekFlags.ACCURATE,
+                                   Gst.SeekType.SET, self.start,
+                                   Gst.SeekType.SET, self.stop)
+            elif not self.transcoder.paused:
+                self.pipeline.set_state(Gst.State.PLAYING)
+        elif message.type == Gst.MessageType.EOS:
+            self.release()
+            os.replace(self.dest_path + ".part", self.dest_path)
+            self.transcoder.chunk_done(self)
+        elif message.type == Gst.MessageType.ERROR:
+            self.release()
+            error, details = message.parse_error()
+            self.transcoder.chunk_error(self, error, details)
+
+
+class ChunkedTranscoder(GObject.Object, Loggable):
+    """Transcodes an asset in chunks, so the work can be resumed.
+
+    Each chunk is transcoded by a ProxyChunk into its own file next to the
+    destination, the completed chunks being recorded in a ChunksManifest.
+    The chunks are then concatenated into the destination file, without
+    re-encoding.
+
+    Has the signals of GstTranscoder.Transcoder used by ProxyManager.
+
+    Attributes:
+        encoding_profile (GstPbutils.EncodingProfile): The profile of the
+            proxies.
+        cpu_usage (int): The CPU usage percentage of each pipeline.
+        max_chunks (int): The number of chunks transcoded in parallel.
+        paused (bool): Whether the transcoding is paused.
+    """
+
+    __gsignals__ = {
+        "position-updated": (GObject.SignalFlags.RUN_LAST, None, (object,)),
+        "done": (GObject.SignalFlags.RUN_LAST, None, ()),
+        "error": (GObject.SignalFlags.RUN_LAST, None, (object, object)),
+    }
+
+    src_uri = GObject.Property(type=str)
+    dest_uri = GObject.Property(type=str)
+    duration = GObject.Property(type=GObject.TYPE_UINT64)
 
-    c.add_profile(a)
-    c.add_profile(v)
+    # pylint: disable=too-many-arguments
+    def __init__(self, src_uri, dest_uri, encoding_profile, duration, params,
+                 max_chunks=1, chunk_duration=PROXY_CHUNK_DURATION):
+        GObject.Object.__init__(self)
+        Loggable.__init__(self)
+        self.props.src_uri = src_uri
+        self.props.dest_uri = dest_uri
+        self.props.duration = duration
+        self.encoding_profile = encoding_profile
+        self.cpu_usage = 100
+        self.max_chunks = max_chunks
+        self.paused = False
+
+        self._chunk_duration = chunk_duration
+        self._num_chunks = (duration + chunk_duration - 1) // chunk_duration
+        self._dest_path = Gst.uri_get_location(dest_uri)
+        params = dict(params, duration=duration, chunk_duration=chunk_duration)
+        self._manifest = ChunksManifest(self._dest_path + ".manifest", params)
+        self._running = []
+        self._concat_pipeline = None
+        self._position_update_id = 0
+
+    def set_cpu_usage(self, cpu_usage):
+        """Sets the CPU usage percentage of each pipeline."""
+        self.cpu_usage = cpu_usage
+
+    def chunk_path(self, index):
+        """Gets the path of the file of the specified chunk."""
+        return "%s.chunk%05d.mkv" % (self._dest_path, index)
+
+    def run_async(self):
+        """Transcodes the chunks not yet transcoded."""
+        self._manifest.load()
+        self._manifest.chunks = {index for index in self._manifest.chunks
+                                 if os.path.exists(self.chunk_path(index))}
+        if self._manifest.chunks:
+            self.info("Resuming %s, %d of %d chunks transcoded",
+                      self.props.src_uri, len(self._manifest.chunks),
+                      self._num_chunks)
+        self._position_update_id = GLib.timeout_add_seconds(
+            1, self.__position_update_cb)
+        self.__run_chunks()
+
+    def pause(self):
+        """Pauses the pipelines."""
+        self.paused = True
+        for chunk in self._running:
+            chunk.pipeline.set_state(Gst.State.PAUSED)
+
+    def resume(self):
+        """Resumes the paused pipelines."""
+        self.paused = False
+        for chunk in self._running:
+            chunk.resume()
+        self.__run_chunks()
+
+    def stop(self):
+        """Stops the transcoding, keeping the transcoded chunks."""
+        for chunk in self._running:
+            chunk.release()
+        self._running = []
+        if self._concat_pipeline:
+            bus = self._concat_pipeline.get_bus()
+            bus.remove_signal_watch()
+            bus.disconnect_by_func(self.__concat_bus_message_cb)
+            self._concat_pipeline.set_state(Gst.State.NULL)
+            self._concat_pipeline = None
+        if self._position_update_id:
+            GLib.source_remove(self._position_update_id)
+            self._position_update_id = 0
+
+    def __missing_chunks(self):
+        running = {chunk.index for chunk in self._running}
+        for index in range(self._num_chunks):
+            if index not in self._manifest.chunks and index not in running:
+                yield index
+
+    def __run_chunks(self):
+        if self.paused:
+            return
 
-    return c
+        for index in self.__missing_chunks():
+            if len(self._running) >= self.max_chunks:
+                break
+            start = index * self._chunk_duration
+            stop = min(start + self._chunk_duration, self.props.duration)
+            chunk = ProxyChunk(self, index, start, stop, self.chunk_path(index))
+            self._running.append(chunk)
+            chunk.run()
+
+        if not self._running and len(self._manifest.chunks) == self._num_chunks:
+            self.__concatenate()
+
+    def chunk_done(self, chunk):
+        """Handles a transcoded chunk."""
+        self.debug("Chunk %d of %s done", chunk.index, self.props.src_uri)
+        self._running.remove(chunk)
+        self._manifest.add(chunk.index)
+        self.__run_chunks()
+
+    def chunk_error(self, chunk, error, details):
+        """Handles a chunk which failed being transcoded."""
+        self._running.remove(chunk)
+        self.stop()
+        self.emit("error", error, details)
+
+    def __position_update_cb(self):
+        position = len(self._manifest.chunks) * self._chunk_duration
+        position += sum(chunk.position() for chunk in self._running)
+        self.emit("position-updated", min(position, self.props.duration))
+        return True
+
+    def __concatenate(self):
+        """Concatenates the chunks into the destination file."""
+        self.debug("Concatenating the %d chunks of %s",
+                   self._num_chunks, self.props.src_uri)
+        pipeline = Gst.Pipeline.new("proxy-chunks-concat")
+        source = Gst.ElementFactory.make("splitmuxsrc", None)
+        # List the chunks explicitly, because the location is a glob
+        # pattern which cannot be escaped.
+        source.connect("format-location", self.__format_location_cb)
+        mux = Gst.ElementFactory.make("matroskamux", None)
+        sink = Gst.ElementFactory.make("filesink", None)
+        sink.props.location = self._dest_path
+        for element in (source, mux, sink):
+            pipeline.add(element)
+        mux.link(sink)
+        source.connect("pad-added", self.__concat_pad_added_cb, mux)
+
+        bus = pipeline.get_bus()
+        bus.add_signal_watch()
+        bus.connect("message", self.__concat_bus_message_cb)
+        self._concat_pipeline = pipeline
+        pipeline.set_state(Gst.State.PLAYING)
+
+    def __format_location_cb(self, unused_source):
+        return [self.chunk_path(index) for index in range(self._num_chunks)]
+
+    @staticmethod
+    def __concat_pad_added_cb(unused_source, pad, mux):
+        sinkpad = mux.get_compatible_pad(pad, pad.query_caps(None))
+        pad.link(sinkpad)
+
+    def __concat_bus_message_cb(self, unused_bus, message):
+        if message.type not in (Gst.MessageType.EOS, Gst.MessageType.ERROR):
+            return
+
+        self.stop()
+        if message.type == Gst.MessageType.ERROR:
+            error, details = message.parse_error()
+            self.emit("error", error, details)
+            return
+
+        for index in range(self._num_chunks):
+            os.remove(self.chunk_path(index))
+        self._manifest.remove()
+        self.emit("done")
+
+
+def get_media_types(stream_info):
+    """Gets the media types of the caps of a stream.
+
+    Args:
+        stream_info (GstPbutils.DiscovererStreamInfo): The stream.
+
+    Returns:
+        set: The names of the structures of the caps.
+    """
+    caps = stream_info.get_caps()
+    if not caps:
+        return set()
+    return {caps.get_structure(i).get_name() for i in range(caps.get_size())}
+
+
+def get_streams_caps(info):
+    """Gets the caps of the streams of the specified discoverer info.
+
+    Returns:
+        List[str]: The caps of the streams, serialized.
+    """
+    return [stream.get_caps().to_string() for stream in info.get_stream_list()]
+
+
+class ProxyIndexEntry(object):
+    """A proxy recorded in the ProxyIndex.
+
+    Attributes:
+        proxy_uri (str): The URI of the proxy.
+        proxy_size (int): The size of the proxy file, in bytes.
+        encoding_target (str): The encoding target of the proxy.
+        duration (int): The duration of the asset, in nanoseconds.
+        proxy_duration (int): The duration of the proxy, in nanoseconds.
+        caps (List[str]): The caps of the streams of the asset.
+        proxy_caps (List[str]): The caps of the streams of the proxy.
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, proxy_uri, proxy_size, encoding_target, duration,
+                 proxy_duration, caps, proxy_caps):
+        self.proxy_uri = proxy_uri
+        self.proxy_size = proxy_size
+        self.encoding_target = encoding_target
+        self.duration = duration
+        self.proxy_duration = proxy_duration
+        self.caps = caps
+        self.proxy_caps = proxy_caps
+
+
+class ProxyIndex(Loggable):
+    """Persistent index of the validated proxies.
+
+    The proxies are identified by the hash, the size and the modification
+    time of the asset file, so an asset which did not change can be matched
+    with its proxy without checking again whether they are compatible.
+    """
+
+    # The indexes by database file.
+    indexes_by_dbfile = {}
+
+    def __init__(self, dbfile):
+        Loggable.__init__(self)
+        self.dbfile = dbfile
+        self._conn = sqlite3.connect(dbfile)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS Proxies "
+                           "(Hash TEXT NOT NULL, "
+                           " Size INTEGER NOT NULL, "
+                           " Mtime INTEGER NOT NULL, "
+                           " ProxyUri TEXT NOT NULL, "
+                           " ProxySize INTEGER NOT NULL, "
+                           " EncodingTarget TEXT NOT NULL, "
+                           " Duration INTEGER NOT NULL, "
+                           " ProxyDuration INTEGER NOT NULL, "
+                           " Caps TEXT NOT NULL, "
+                           " ProxyCaps TEXT NOT NULL, "
+                           " PRIMARY KEY (Hash, Size, Mtime)) WITHOUT ROWID")
+        self._conn.commit()
+
+    @classmethod
+    def get(cls):
+        """Gets the index of the current cache directory."""
+        dbfile = os.path.join(xdg_cache_home(), "proxies.db")
+        if dbfile not in cls.indexes_by_dbfile:
+            cls.indexes_by_dbfile[dbfile] = ProxyIndex(dbfile)
+        return cls.indexes_by_dbfile[dbfile]
+
+    @staticmethod
+    def get_key(uri):
+        """Gets the key identifying the contents of the specified file.
+
+        Returns:
+            Tuple[str, int, int]: The hash, the size and the modification
+                time of the file, or None if it cannot be read.
+        """
+        path = Gst.uri_get_location(uri)
+        try:
+            stat = os.stat(path)
+            return hash_file(path), stat.st_size, stat.st_mtime_ns
+        except OSError:
+            return None
+
+    def lookup(self, key):
+        """Gets the entry for the specified key.
+
+        Returns:
+            ProxyIndexEntry: The entry, or None if missing.
+        """
+        row = self._conn.execute(
+            "SELECT ProxyUri, ProxySize, EncodingTarget, Duration,"
+            " ProxyDuration, Caps, ProxyCaps FROM Proxies"
+            " WHERE Hash = ? AND Size = ? AND Mtime = ?", key).fetchone()
+        if not row:
+            return None
+
+        proxy_uri, proxy_size, encoding_target, duration, proxy_duration, \
+            caps, proxy_caps = row
+        return ProxyIndexEntry(proxy_uri, proxy_size, encoding_target, duration,
+                               proxy_duration, json.loads(caps),
+                               json.loads(proxy_caps))
+
+    def put(self, key, entry):
+        """Records the proxy for the specified key."""
+        self._conn.execute(
+            "INSERT OR REPLACE INTO Proxies VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            key + (entry.proxy_uri, entry.proxy_size, entry.encoding_target,
+                   entry.duration, entry.proxy_duration, json.dumps(entry.caps),
+                   json.dumps(entry.proxy_caps)))
+        self._conn.commit()
+
+    def remove(self, key):
+        """Forgets the proxy for the specified key."""
+        self._conn.execute("DELETE FROM Proxies"
+                           " WHERE Hash = ? AND Size = ? AND Mtime = ?", key)
+        self._conn.commit()
 
 
 class ProxyManager(GObject.Object, Loggable):
@@ -94,16 +873,11 @@ class ProxyManager(GObject.Object, Loggable):
                             "video/x-raw", "video/x-vp8",
                             "video/x-theora"]
 
-    WHITELIST_FORMATS = []
-    for container in WHITELIST_CONTAINER_CAPS:
-        for audio in WHITELIST_AUDIO_CAPS:
-            for video in WHITELIST_VIDEO_CAPS:
-                WHITELIST_FORMATS.append(createEncodingProfileSimple(
-                    container, audio, video))
-
-    for audio in WHITELIST_AUDIO_CAPS:
-        a = GstPbutils.EncodingAudioProfile.new(Gst.Caps(audio), None, None, 0)
-        WHITELIST_FORMATS.append(a)
+    # Any combination of the whitelisted container, audio and video
+    # media types is well supported, as well as the audio-only files.
+    WHITELIST_CONTAINERS = frozenset(WHITELIST_CONTAINER_CAPS)
+    WHITELIST_AUDIOS = frozenset(WHITELIST_AUDIO_CAPS)
+    WHITELIST_VIDEOS = frozenset(WHITELIST_VIDEO_CAPS)
 
     proxy_extension = "proxy.mkv"
 
@@ -117,8 +891,17 @@ class ProxyManager(GObject.Object, Loggable):
         # Transcoded time per asset in seconds.
         self._transcoded_durations = {}
         self._start_proxying_time = 0
-        self.__running_transcoders = []
-        self.__pending_transcoders = []
+        self.__scheduler = ProxyScheduler(app.settings.numTranscodingJobs,
+                                          app.settings.max_total_cpu_usage)
+        self.__cpu_usage_tracker = CPUUsageTracker()
+        self.__scheduler_tick_id = 0
+        # The URIs of the indexed proxies being loaded by asset URI.
+        self.__indexed_proxies = {}
+        # The loaded scaled proxies by asset URI.
+        self.__scaled_proxies = {}
+        # The (DiscovererInfo, bool) tuples telling whether the format of
+        # the assets is well supported, by asset URI.
+        self.__supported_formats = {}
 
         self.__encoding_target_file = None
         self.proxyingUnsupported = False
@@ -233,6 +1016,30 @@ class ProxyManager(GObject.Object, Loggable):
     def getTargetUri(self, proxy_asset):
         return ".".join(proxy_asset.props.id.split(".")[:-3])
 
+    def getScaledProxyUri(self, asset, divisor):
+        """Returns the URI of a possible scaled proxy file.
+
+        The name looks like:
+            <filename>.<file_size>.scaled<divisor>.mkv
+        """
+        proxy_uri = self.getProxyUri(asset)
+        if not proxy_uri:
+            return None
+
+        return "%s.scaled%d.mkv" % (
+            proxy_uri[:-len("." + self.proxy_extension)], divisor)
+
+    def get_scaled_proxy(self, asset):
+        """Gets the scaled proxy of the specified asset, if ready.
+
+        Args:
+            asset (GES.Asset): The original asset.
+
+        Returns:
+            GES.Asset: The scaled proxy, or None if missing.
+        """
+        return self.__scaled_proxies.get(asset.props.id)
+
     def getProxyUri(self, asset):
         """Returns the URI of a possible proxy file.
 
@@ -253,12 +1060,35 @@ class ProxyManager(GObject.Object, Loggable):
         return "%s.%s.%s" % (asset.get_id(), file_size, self.proxy_extension)
 
     def isAssetFormatWellSupported(self, asset):
-        for encoding_format in self.WHITELIST_FORMATS:
-            if self._assetMatchesEncodingFormat(asset, encoding_format):
-                self.info("Automatically not proxying")
-                return True
+        info = asset.get_info()
+        cached_info, supported = self.__supported_formats.get(asset.props.id, (None, False))
+        if cached_info is not info:
+            supported = self._isFormatWellSupported(info)
+            # The info changes when the asset is reloaded.
+            self.__supported_formats[asset.props.id] = (info, supported)
 
-        return False
+        if supported:
+            self.info("Automatically not proxying")
+        return supported
+
+    @classmethod
+    def _isFormatWellSupported(cls, info):
+        audios = [get_media_types(stream) for stream in info.get_audio_streams()]
+        videos = [get_media_types(stream) for stream in info.get_video_streams()]
+        container = info.get_stream_info()
+        if not isinstance(container, GstPbutils.DiscovererContainerInfo) and \
+                len(audios) == 1 and not videos and \
+                audios[0] & cls.WHITELIST_AUDIOS:
+            return True
+
+        if container and not get_media_types(container) & cls.WHITELIST_CONTAINERS:
+            return False
+
+        # All the streams of a kind have to be encoded in the same format.
+        return any(all(audio in media_types for media_types in audios)
+                   for audio in cls.WHITELIST_AUDIOS) and \
+            any(all(video in media_types for media_types in videos)
+                for video in cls.WHITELIST_VIDEOS)
 
     def __assetNeedsTranscoding(self, asset):
         if self.proxyingUnsupported:
@@ -284,12 +1114,77 @@ class ProxyManager(GObject.Object, Loggable):
         self.info("%s does not need proxy", asset.get_id())
         return False
 
-    def __startTranscoder(self, transcoder):
-        self.debug("Starting %s", transcoder.props.src_uri)
+    def __queueJob(self, job):
+        self.debug("Queueing %s", job.uri)
         if self._start_proxying_time == 0:
             self._start_proxying_time = time.time()
-        transcoder.run_async()
-        self.__running_transcoders.append(transcoder)
+        self.__scheduler.max_jobs = self.app.settings.numTranscodingJobs
+        self.__scheduler.add(job)
+        if not self.__scheduler_tick_id:
+            self.__cpu_usage_tracker.reset()
+            self.__scheduler_tick_id = GLib.timeout_add_seconds(
+                PROXY_SCHEDULER_INTERVAL, self.__scheduler_tick_cb)
+
+    def __scheduler_tick_cb(self):
+        if not self.__scheduler.jobs:
+            self.__scheduler_tick_id = 0
+            # Stop calling me.
+            return False
+
+        self.__scheduler.max_jobs = self.app.settings.numTranscodingJobs
+        self.__scheduler.max_cpu_usage = self.app.settings.max_total_cpu_usage
+        priorities = self.__assets_priorities()
+        self.__scheduler.reprioritize(
+            lambda job: PROXY_PRIORITY_SCALED if job.key != job.uri
+            else priorities.get(job.uri, PROXY_PRIORITY_LIBRARY))
+        self.__scheduler.adapt(self.__cpu_usage_tracker.usage(),
+                               self.__scheduler.measure())
+        self.__cpu_usage_tracker.reset()
+        return True
+
+    def __assets_priorities(self):
+        """Gets the priorities of the assets in the timeline.
+
+        The assets under the playhead are proxied first, then the assets
+        in the timeline, then the others, which have no priority here.
+
+        Returns:
+            dict: The priorities by asset URI.
+        """
+        priorities = {}
+        project = self.app.project_manager.current_project
+        if project and project.ges_timeline:
+            try:
+                playhead = project.pipeline.getPosition()
+            except PipelineError:
+                playhead = None
+            for layer in project.ges_timeline.get_layers():
+                for clip in layer.get_clips():
+                    if not isinstance(clip, GES.UriClip):
+                        continue
+                    uri = get_proxy_target(clip).props.id
+                    if playhead is not None and \
+                            clip.props.start <= playhead < clip.props.start + clip.props.duration:
+                        priorities[uri] = PROXY_PRIORITY_PLAYHEAD
+                    else:
+                        priorities.setdefault(uri, PROXY_PRIORITY_TIMELINE)
+        return priorities
+
+    def pause_job(self, asset):
+        """Pauses the transcoding job for the specified asset, if any.
+
+        Args:
+            asset (GES.Asset): The original asset.
+        """
+        self.__scheduler.hold(asset.props.id)
+
+    def resume_job(self, asset):
+        """Resumes the paused transcoding job for the specified asset.
+
+        Args:
+            asset (GES.Asset): The original asset.
+        """
+        self.__scheduler.release(asset.props.id)
 
     def __assetsMatch(self, asset, proxy):
         if self.__assetNeedsTranscoding(proxy):
@@ -302,6 +1197,7 @@ class ProxyManager(GObject.Object, Loggable):
         return True
 
     def __assetLoadedCb(self, proxy, res, asset, transcoder):
+        indexed = self.__indexed_proxies.pop(asset.props.id, None) == proxy.props.id
         try:
             GES.Asset.request_finish(res)
         except GLib.Error as e:
@@ -314,8 +1210,11 @@ class ProxyManager(GObject.Object, Loggable):
             return
 
         if not transcoder:
-            if not self.__assetsMatch(asset, proxy):
+            if not indexed and not self.__assetsMatch(asset, proxy):
                 return self.__createTranscoder(asset)
+        elif isinstance(transcoder, ChunkedTranscoder):
+            # The previews are generated later by the previewers.
+            del transcoder
         else:
             transcoder.props.pipeline.props.video_filter.finalize(proxy)
             transcoder.props.pipeline.props.audio_filter.finalize(proxy)
@@ -331,9 +1230,154 @@ class ProxyManager(GObject.Object, Loggable):
                     proxy.get_id(), Gst.TIME_ARGS(proxy.get_info().get_duration())
                 )
             )
+        elif not indexed:
+            self.__index_proxy(asset, proxy)
 
         self.emit("proxy-ready", asset, proxy)
         self.__emitProgress(proxy, 100)
+        self.__add_scaled_job(asset)
+
+    def __add_scaled_job(self, asset):
+        """Creates the scaled proxy of the asset if enabled and missing."""
+        divisor = self.app.settings.scaledProxiesDivisor
+        if divisor < 2 or self.proxyingUnsupported or asset.is_image():
+            return
+
+        videos = asset.get_info().get_video_streams()
+        if not videos:
+            return
+
+        scaled_uri = self.getScaledProxyUri(asset, divisor)
+        if not scaled_uri or self.__scheduler.get(scaled_uri):
+            return
+
+        scaled = self.__scaled_proxies.get(asset.props.id)
+        if scaled and scaled.props.id == scaled_uri:
+            return
+
+        if Gio.File.new_for_uri(scaled_uri).query_exists(None):
+            self.debug("Using scaled proxy already generated: %s", scaled_uri)
+            GES.Asset.request_async(GES.UriClip, scaled_uri, None,
+                                    self.__scaledAssetLoadedCb, asset)
+            return
+
+        # Keep the size even, as required by most encoders.
+        width = max(2, videos[0].get_width() // divisor // 2 * 2)
+        height = max(2, videos[0].get_height() // divisor // 2 * 2)
+        encoding_profile = self.__getEncodingProfile(self.__encoding_target_file, asset)
+        for profile in encoding_profile.get_profiles():
+            if isinstance(profile, GstPbutils.EncodingVideoProfile):
+                profile.set_restriction(Gst.Caps.from_string(
+                    "video/x-raw,width=%d,height=%d" % (width, height)))
+
+        dispatcher = GstTranscoder.TranscoderGMainContextSignalDispatcher.new()
+        transcoder = GstTranscoder.Transcoder.new_full(
+            asset.props.id, scaled_uri + ".part", encoding_profile,
+            dispatcher)
+        transcoder.props.position_update_interval = 1000
+        transcoder.set_cpu_usage(self.app.settings.max_cpu_usage)
+        transcoder.connect("position-updated",
+                           self.__scaledPositionChangedCb, scaled_uri)
+        transcoder.connect("done", self.__scaledTranscoderDoneCb, asset, scaled_uri)
+        transcoder.connect("error", self.__scaledTranscoderErrorCb, scaled_uri)
+        self.__queueJob(ProxyJob(asset, transcoder, PROXY_PRIORITY_SCALED,
+                                 key=scaled_uri))
+
+    def __scaledPositionChangedCb(self, transcoder, position, scaled_uri):
+        job = self.__scheduler.get(scaled_uri)
+        if job and job.transcoder is transcoder:
+            job.position = position
+
+    def __scaledTranscoderErrorCb(self, transcoder, error, unused_details, scaled_uri):
+        self.warning("Failed creating scaled proxy %s: %s", scaled_uri, error)
+        self.__scheduler.done(scaled_uri)
+
+    def __scaledTranscoderDoneCb(self, transcoder, asset, scaled_uri):
+        transcoder.disconnect_by_func(self.__scaledTranscoderDoneCb)
+        transcoder.disconnect_by_func(self.__scaledTranscoderErrorCb)
+        transcoder.disconnect_by_func(self.__scaledPositionChangedCb)
+
+        self.debug("Transcoder done with %s", scaled_uri)
+        self.__scheduler.done(scaled_uri)
+
+        os.rename(Gst.uri_get_location(transcoder.props.dest_uri),
+                  Gst.uri_get_location(scaled_uri))
+        GES.Asset.needs_reload(GES.UriClip, scaled_uri)
+        GES.Asset.request_async(GES.UriClip, scaled_uri, None,
+                                self.__scaledAssetLoadedCb, asset)
+
+    def __scaledAssetLoadedCb(self, scaled, res, asset):
+        try:
+            GES.Asset.request_finish(res)
+        except GLib.Error as e:
+            self.warning("Failed loading scaled proxy %s: %s", scaled.props.id, e)
+            return
+
+        if scaled.get_duration() != asset.get_duration():
+            self.warning("Scaled proxy %s does not have the duration of %s",
+                         scaled.props.id, asset.props.id)
+            return
+
+        # The scaled proxies are not GES proxies, as only one proxy can be
+        # used at a time, and they are never serialized in the project.
+        scaled.scaled_proxy_target = asset
+        self.__scaled_proxies[asset.props.id] = scaled
+
+    def __get_indexed_proxy_uri(self, asset):
+        """Gets the URI of the proxy of the asset, if indexed and still valid.
+
+        The indexed proxy is used only when its discovered info is cached,
+        so GES loads it without discovering it again.
+
+        Returns:
+            str: The URI of the proxy, or None if it has to be checked.
+        """
+        discovery_cache = DiscoveryCache.get()
+        if self.proxyingUnsupported or not discovery_cache.installed:
+            # Loading the proxy would take as long as checking it.
+            return None
+
+        key = ProxyIndex.get_key(asset.props.id)
+        if not key:
+            return None
+
+        entry = ProxyIndex.get().lookup(key)
+        if not entry or \
+                entry.encoding_target != self.__encoding_target_file or \
+                entry.duration != asset.get_duration() or \
+                entry.proxy_uri != self.getProxyUri(asset) or \
+                entry.caps != get_streams_caps(asset.get_info()):
+            return None
+
+        try:
+            proxy_size = os.path.getsize(Gst.uri_get_location(entry.proxy_uri))
+        except OSError:
+            return None
+        if proxy_size != entry.proxy_size or \
+                not discovery_cache.get_info(entry.proxy_uri):
+            return None
+
+        return entry.proxy_uri
+
+    def __index_proxy(self, asset, proxy):
+        """Records the proxy of the asset in the index."""
+        key = ProxyIndex.get_key(asset.props.id)
+        if not key:
+            return
+
+        try:
+            proxy_size = os.path.getsize(Gst.uri_get_location(proxy.props.id))
+        except OSError:
+            return
+
+        entry = ProxyIndexEntry(proxy.props.id, proxy_size,
+                                self.__encoding_target_file,
+                                asset.get_duration(), proxy.get_duration(),
+                                get_streams_caps(asset.get_info()),
+                                get_streams_caps(proxy.get_info()))
+        ProxyIndex.get().put(key, entry)
+        # Allow loading the proxy without discovering it next time.
+        DiscoveryCache.get().store_info(proxy.props.id, proxy.get_info())
 
     def __transcoderErrorCb(self, transcoder, error, unused_details, asset):
         self.emit("error-preparing-asset", asset, None, error)
@@ -345,7 +1389,7 @@ class ProxyManager(GObject.Object, Loggable):
 
         self.debug("Transcoder done with %s", asset.get_id())
 
-        self.__running_transcoders.remove(transcoder)
+        self.__scheduler.done(asset.props.id)
 
         proxy_uri = self.getProxyUri(asset)
         os.rename(Gst.uri_get_location(transcoder.props.dest_uri),
@@ -357,13 +1401,10 @@ class ProxyManager(GObject.Object, Loggable):
         GES.Asset.request_async(GES.UriClip, proxy_uri, None,
                                 self.__assetLoadedCb, asset, transcoder)
 
-        try:
-            self.__startTranscoder(self.__pending_transcoders.pop())
-        except IndexError:
-            if not self.__running_transcoders:
-                self._transcoded_durations = {}
-                self._total_time_to_transcode = 0
-                self._start_proxying_time = 0
+        if not self.__scheduler.jobs:
+            self._transcoded_durations = {}
+            self._total_time_to_transcode = 0
+            self._start_proxying_time = 0
 
     def __emitProgress(self, asset, creation_progress):
         """Handles the transcoding progress of the specified asset."""
@@ -379,10 +1420,12 @@ class ProxyManager(GObject.Object, Loggable):
         self.emit("progress", asset, asset.creation_progress, estimated_time)
 
     def __proxyingPositionChangedCb(self, transcoder, position, asset):
-        if transcoder not in self.__running_transcoders:
+        job = self.__scheduler.get(asset.props.id)
+        if not job or job.transcoder is not transcoder:
             self.info("Position changed after job cancelled!")
             return
 
+        job.position = position
         self._transcoded_durations[asset] = position / Gst.SECOND
 
         duration = transcoder.props.duration
@@ -404,34 +1447,37 @@ class ProxyManager(GObject.Object, Loggable):
         Returns:
             bool: True iff the asset is being transcoded or pending.
         """
-        all_transcoders = self.__running_transcoders + self.__pending_transcoders
-        for transcoder in all_transcoders:
-            if asset.props.id == transcoder.props.src_uri:
-                return True
-
-        return False
+        return self.__scheduler.get(asset.props.id) is not None
 
     def __createTranscoder(self, asset):
         self._total_time_to_transcode += asset.get_duration() / Gst.SECOND
         asset_uri = asset.get_id()
         proxy_uri = self.getProxyUri(asset)
 
-        dispatcher = GstTranscoder.TranscoderGMainContextSignalDispatcher.new()
         encoding_profile = self.__getEncodingProfile(self.__encoding_target_file, asset)
-        transcoder = GstTranscoder.Transcoder.new_full(
-            asset_uri, proxy_uri + ".part", encoding_profile,
-            dispatcher)
-        transcoder.props.position_update_interval = 1000
+        if asset.get_duration() >= PROXY_CHUNKED_MIN_DURATION:
+            # Long assets are transcoded in chunks, to be able to resume.
+            params = {"encoding_target": self.__encoding_target_file}
+            transcoder = ChunkedTranscoder(
+                asset_uri, proxy_uri + ".part", encoding_profile,
+                asset.get_duration(), params,
+                max_chunks=self.app.settings.numChunkTranscodingJobs)
+        else:
+            dispatcher = GstTranscoder.TranscoderGMainContextSignalDispatcher.new()
+            transcoder = GstTranscoder.Transcoder.new_full(
+                asset_uri, proxy_uri + ".part", encoding_profile,
+                dispatcher)
+            transcoder.props.position_update_interval = 1000
 
-        thumbnailbin = Gst.ElementFactory.make("teedthumbnailbin")
-        thumbnailbin.props.uri = asset.get_id()
+            thumbnailbin = Gst.ElementFactory.make("teedthumbnailbin")
+            thumbnailbin.props.uri = asset.get_id()
 
-        waveformbin = Gst.ElementFactory.make("waveformbin")
-        waveformbin.props.uri = asset.get_id()
-        waveformbin.props.duration = asset.get_duration()
+            waveformbin = Gst.ElementFactory.make("waveformbin")
+            waveformbin.props.uri = asset.get_id()
+            waveformbin.props.duration = asset.get_duration()
 
-        transcoder.props.pipeline.props.video_filter = thumbnailbin
-        transcoder.props.pipeline.props.audio_filter = waveformbin
+            transcoder.props.pipeline.props.video_filter = thumbnailbin
+            transcoder.props.pipeline.props.audio_filter = waveformbin
 
         transcoder.set_cpu_usage(self.app.settings.max_cpu_usage)
         transcoder.connect("position-updated",
@@ -440,10 +1486,8 @@ class ProxyManager(GObject.Object, Loggable):
 
         transcoder.connect("done", self.__transcoderDoneCb, asset)
         transcoder.connect("error", self.__transcoderErrorCb, asset)
-        if len(self.__running_transcoders) < self.app.settings.numTranscodingJobs:
-            self.__startTranscoder(transcoder)
-        else:
-            self.__pending_transcoders.append(transcoder)
+        priority = self.__assets_priorities().get(asset_uri, PROXY_PRIORITY_LIBRARY)
+        self.__queueJob(ProxyJob(asset, transcoder, priority))
 
     def cancel_job(self, asset):
         """Cancels the transcoding job for the specified asset, if any.
@@ -451,28 +1495,22 @@ class ProxyManager(GObject.Object, Loggable):
         Args:
             asset (GES.Asset): The original asset.
         """
-        if not self.is_asset_queued(asset):
+        # Removing the job will lead to the destruction of its transcoder
+        # (only reference) here, which means it will be stopped.
+        divisor = self.app.settings.scaledProxiesDivisor
+        if divisor >= 2:
+            scaled_uri = self.getScaledProxyUri(asset, divisor)
+            if scaled_uri:
+                self.__scheduler.remove(scaled_uri)
+
+        job = self.__scheduler.remove(asset.props.id)
+        if not job:
             return
 
-        for transcoder in self.__running_transcoders:
-            if asset.props.id == transcoder.props.src_uri:
-                self.info("Cancelling running transcoder %s %s",
-                          transcoder.props.src_uri,
-                          transcoder.__grefcount__)
-                self.__running_transcoders.remove(transcoder)
-                self.emit("asset-preparing-cancelled", asset)
-                return
-
-        for transcoder in self.__pending_transcoders:
-            if asset.props.id == transcoder.props.src_uri:
-                self.info("Cancelling pending transcoder %s",
-                          transcoder.props.src_uri)
-                # Removing the transcoder from the list
-                # will lead to its destruction (only reference)
-                # here, which means it will be stopped.
-                self.__pending_transcoders.remove(transcoder)
-                self.emit("asset-preparing-cancelled", asset)
-                return
+        job.cancel()
+        self.info("Cancelling %s transcoder %s",
+                  "running" if job.started else "pending", job.uri)
+        self.emit("asset-preparing-cancelled", asset)
 
     def add_job(self, asset):
         """Adds a transcoding job for the specified asset if needed.
@@ -485,11 +1523,26 @@ class ProxyManager(GObject.Object, Loggable):
             return
 
         force_proxying = asset.force_proxying
+        if force_proxying or \
+                self.app.settings.proxyingStrategy != ProxyingStrategy.NOTHING:
+            # A proxy which has been used before does not need to be
+            # checked again if the asset did not change.
+            proxy_uri = self.__get_indexed_proxy_uri(asset)
+            if proxy_uri:
+                self.debug("Using indexed proxy: %s", proxy_uri)
+                self.__indexed_proxies[asset.props.id] = proxy_uri
+                GES.Asset.request_async(GES.UriClip,
+                                        proxy_uri, None,
+                                        self.__assetLoadedCb, asset,
+                                        None)
+                return
+
         if not force_proxying and not self.__assetNeedsTranscoding(asset):
             self.debug("Not proxying asset (proxying disabled: %s)",
                        self.proxyingUnsupported)
             # Make sure to notify we do not need a proxy for that asset.
             self.emit("proxy-ready", asset, None)
+            self.__add_scaled_job(asset)
             return
 
         proxy_uri = self.getProxyUri(asset)
@@ -516,9 +1569,209 @@ def get_proxy_target(obj):
     else:
         asset = obj
 
+    scaled_target = getattr(asset, "scaled_proxy_target", None)
+    if scaled_target:
+        return scaled_target
+
     if ProxyManager.is_proxy_asset(asset):
         target = asset.get_proxy_target()
         if target and target.get_error() is None:
             asset = target
 
     return asset
+
+
+class ProxyTierSwitcher(Loggable):
+    """Switches the clips to faster assets when the playback drops frames.
+
+    The ratio of frames dropped by the sinks is measured while playing.
+    When too many frames are dropped, the clips play the full resolution
+    proxies, and then the scaled proxies. When the playback has been
+    smooth long enough, the clips play slower assets again.
+
+    The assets are not switched while an operation is being recorded,
+    because the changes would be recorded in the operation, and while
+    the project is being serialized.
+
+    Attributes:
+        app (Pitivi): The app.
+        pipeline (Pipeline): The pipeline playing the timeline.
+        ges_timeline (GES.Timeline): The timeline.
+        tier (int): The ProxyTier being played.
+    """
+
+    def __init__(self, app, pipeline, ges_timeline):
+        Loggable.__init__(self)
+        self.app = app
+        self.pipeline = pipeline
+        self.ges_timeline = ges_timeline
+        self.tier = ProxyTier.DEFAULT
+
+        # The (default asset, switched asset) tuples by switched clip.
+        self._default_assets = {}
+        # The (processed, dropped) counters of the sinks by sink.
+        self._qos_stats = {}
+        # The buffers processed and dropped since the measurement start.
+        self._processed = 0
+        self._dropped = 0
+        self._measure_time = 0
+        # When frames have last been dropped or the tier changed.
+        self._drop_time = 0
+        # Whether the project is being serialized.
+        self._serializing = False
+
+        self.pipeline.connect("qos", self._qos_cb)
+        self.pipeline.connect("position", self._position_cb)
+        self.pipeline.connect("state-change", self._state_change_cb)
+
+    def release(self):
+        """Disconnects from the pipeline."""
+        self.pipeline.disconnect_by_func(self._qos_cb)
+        self.pipeline.disconnect_by_func(self._position_cb)
+        self.pipeline.disconnect_by_func(self._state_change_cb)
+
+    def _qos_cb(self, unused_pipeline, src, processed, dropped):
+        prev_processed, prev_dropped = self._qos_stats.get(src, (0, 0))
+        if processed < prev_processed or dropped < prev_dropped:
+            # The counters are reset when flushing.
+            prev_processed, prev_dropped = 0, 0
+        self._qos_stats[src] = (processed, dropped)
+        self._processed += processed - prev_processed
+        self._dropped += dropped - prev_dropped
+
+    def _position_cb(self, unused_pipeline, unused_position):
+        if not self.app.settings.autoSwitchProxies or \
+                self.pipeline.getState() != Gst.State.PLAYING or \
+                self.pipeline.is_rendering() or self._serializing:
+            return
+
+        action_log = self.app.action_log
+        if action_log and action_log.is_in_transaction():
+            # Try again when the operation is done.
+            return
+
+        self.measure(time.time())
+
+    def _state_change_cb(self, unused_pipeline, state, unused_prev):
+        if state != Gst.State.PLAYING:
+            # Dropping frames when starting to play is expected.
+            self._measure_time = 0
+
+    def measure(self, now):
+        """Switches the tier depending on the frames dropped lately.
+
+        Args:
+            now (float): The current time, in seconds.
+
+        Returns:
+            float: The ratio of dropped frames in the last period, or None
+                if the period is not over.
+        """
+        if not self._measure_time:
+            self._measure_time = now
+            self._drop_time = max(self._drop_time, now)
+            self._processed = 0
+            self._dropped = 0
+            return None
+
+        if now - self._measure_time < PROXY_TIER_MEASURE_PERIOD:
+            return None
+
+        total = self._processed + self._dropped
+        ratio = self._dropped / total if total else 0
+        self._measure_time = now
+        self._processed = 0
+        self._dropped = 0
+
+        if ratio > PROXY_TIER_MAX_DROP_RATIO:
+            self._drop_time = now
+            if self.tier < ProxyTier.SCALED:
+                self.info("Dropped %d%% of the frames", ratio * 100)
+                self.set_tier(self.tier + 1)
+        elif self.tier > ProxyTier.DEFAULT and \
+                now - self._drop_time >= PROXY_TIER_RECOVERY_DELAY:
+            self._drop_time = now
+            self.set_tier(self.tier - 1)
+
+        return ratio
+
+    def __tier_asset(self, default, tier):
+        if tier == ProxyTier.DEFAULT:
+            return default
+
+        asset = default
+        target = get_proxy_target(default)
+        proxy = target.props.proxy
+        if proxy and ProxyManager.is_proxy_asset(proxy) and proxy.get_error() is None:
+            asset = proxy
+
+        if tier == ProxyTier.SCALED:
+            scaled = self.app.proxy_manager.get_scaled_proxy(target)
+            if scaled:
+                asset = scaled
+
+        return asset
+
+    def set_tier(self, tier):
+        """Sets the assets of the clips to the assets of the specified tier.
+
+        Args:
+            tier (int): The ProxyTier to be played.
+        """
+        self.info("Switching from tier %d to tier %d", self.tier, tier)
+        self.tier = tier
+        for layer in self.ges_timeline.get_layers():
+            for clip in layer.get_clips():
+                if not isinstance(clip, GES.UriClip):
+                    continue
+
+                current = clip.get_asset()
+                default, switched = self._default_assets.pop(clip, (None, None))
+                if switched is not current:
+                    # The asset has been changed meanwhile.
+                    default = current
+
+                asset = self.__tier_asset(default, tier)
+                if asset is not current:
+                    clip.set_asset(asset)
+                if asset is not default:
+                    self._default_assets[clip] = (default, asset)
+
+        self.pipeline.commit_timeline()
+
+    def get_default_asset(self, asset):
+        """Gets the asset which is replaced by the specified asset, if any.
+
+        Args:
+            asset (GES.UriClipAsset): The asset of a clip.
+
+        Returns:
+            GES.UriClipAsset: The asset which would be played if the tier
+                was ProxyTier.DEFAULT.
+        """
+        for default, switched in self._default_assets.values():
+            if switched is asset:
+                return default
+        return asset
+
+    def restore(self):
+        """Sets the assets of the clips back to their default assets."""
+        if self.tier != ProxyTier.DEFAULT:
+            self.set_tier(ProxyTier.DEFAULT)
+        self._drop_time = 0
+
+    @contextlib.contextmanager
+    def default_assets(self):
+        """Lets the clips use their default assets temporarily."""
+        tier = self.tier
+        self._serializing = True
+        try:
+            if tier != ProxyTier.DEFAULT:
+                self.set_tier(ProxyTier.DEFAULT)
+            yield
+        finally:
+            if tier != ProxyTier.DEFAULT:
+                self.set_tier(tier)
+                # The switches made the sinks drop frames.
+                self._measure_time = 0
+            self._serializing = False
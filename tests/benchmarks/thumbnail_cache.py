@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+# Pitivi video editor
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this program; if not, write to the
+# Free Software Foundation, Inc., 51 Franklin St, Fifth Floor,
+# Boston, MA 02110-1301, USA.
+"""Benchmark of the thumbnails storage.
+
+Compares the legacy per-asset databases with the shared ThumbnailStore.
+
+Run with: python3 -m tests.benchmarks.thumbnail_cache
+"""
+import os
+import sqlite3
+import tempfile
+import time
+
+from gi.repository import Gst
+
+from pitivi.timeline.previewers import THUMB_HEIGHT
+from pitivi.timeline.previewers import THUMB_PERIOD
+from pitivi.timeline.previewers import ThumbnailStore
+
+NUM_ASSETS = 50
+NUM_THUMBS = 200
+# About the size of a JPEG thumbnail.
+JPEG = os.urandom(8 * 1024)
+
+
+def bench_legacy(tmpdir):
+    """Stores the thumbnails in one database per asset, like before."""
+    dbs = []
+    start = time.time()
+    for asset in range(NUM_ASSETS):
+        db = sqlite3.connect(os.path.join(tmpdir, "asset%d" % asset))
+        cur = db.cursor()
+        cur.execute("CREATE TABLE IF NOT EXISTS Thumbs "
+                    "(Time INTEGER NOT NULL PRIMARY KEY, "
+                    " Jpeg BLOB NOT NULL)")
+        for i in range(NUM_THUMBS):
+            position = i * THUMB_PERIOD
+            cur.execute("DELETE FROM Thumbs WHERE  time=?", (position,))
+            cur.execute("INSERT INTO Thumbs VALUES (?,?)",
+                        (position, sqlite3.Binary(JPEG)))
+        db.commit()
+        dbs.append(db)
+    insert_time = time.time() - start
+
+    start = time.time()
+    for db in dbs:
+        cur = db.cursor()
+        for i in range(NUM_THUMBS):
+            cur.execute("SELECT * FROM Thumbs WHERE Time = ?", (i * THUMB_PERIOD,))
+            assert cur.fetchone()
+    lookup_time = time.time() - start
+
+    for db in dbs:
+        db.close()
+    return insert_time, lookup_time
+
+
+def bench_store(tmpdir):
+    """Stores the thumbnails in the shared ThumbnailStore."""
+    store = ThumbnailStore(os.path.join(tmpdir, "thumbs.db"))
+    start = time.time()
+    for asset in range(NUM_ASSETS):
+        filehash = "asset%d" % asset
+        for i in range(NUM_THUMBS):
+            store.put_jpeg(filehash, i * THUMB_PERIOD, THUMB_HEIGHT, JPEG)
+    store.flush()
+    insert_time = time.time() - start
+
+    start = time.time()
+    for asset in range(NUM_ASSETS):
+        filehash = "asset%d" % asset
+        for i in range(NUM_THUMBS):
+            assert store.get_jpeg(filehash, i * THUMB_PERIOD, THUMB_HEIGHT)
+    lookup_time = time.time() - start
+    return insert_time, lookup_time
+
+
+def main():
+    Gst.init(None)
+    num = NUM_ASSETS * NUM_THUMBS
+    print("%d assets with %d thumbnails each" % (NUM_ASSETS, NUM_THUMBS))
+    for name, bench in (("legacy", bench_legacy), ("store", bench_store)):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            insert_time, lookup_time = bench(tmpdir)
+        print("%-8s insert: %8.0f thumbs/s  lookup: %8.0f thumbs/s" %
+              (name, num / insert_time, num / lookup_time))
+
+
+if __name__ == "__main__":
+    main()
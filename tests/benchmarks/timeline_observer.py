@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+# Pitivi video editor
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this program; if not, write to the
+# Free Software Foundation, Inc., 51 Franklin St, Fifth Floor,
+# Boston, MA 02110-1301, USA.
+"""Benchmark of the undo observers on a large timeline.
+
+Measures the time and the memory needed for creating the TimelineObserver
+of a synthetic timeline, which is what delays the loading, and for
+observing all its clips, which happens in the background or when the
+first operation starts.
+
+Run with: python3 -m tests.benchmarks.timeline_observer
+"""
+import time
+import tracemalloc
+
+from gi.repository import GES
+from gi.repository import Gst
+from gi.repository import GstController
+
+from pitivi.undo.timeline import TimelineObserver
+from pitivi.undo.undo import UndoableActionLog
+
+NUM_CLIPS = 5000
+NUM_LAYERS = 10
+# Every how many clips one has an effect with keyframes.
+KEYFRAMED_EFFECT_EVERY = 10
+
+
+def create_timeline():
+    ges_timeline = GES.Timeline.new_audio_video()
+    layers = [ges_timeline.append_layer() for unused_i in range(NUM_LAYERS)]
+    for i in range(NUM_CLIPS):
+        clip = GES.TestClip()
+        clip.props.start = i // NUM_LAYERS * Gst.SECOND
+        clip.props.duration = Gst.SECOND
+        layers[i % NUM_LAYERS].add_clip(clip)
+
+        if i % KEYFRAMED_EFFECT_EVERY == 0:
+            effect = GES.Effect.new("videobalance")
+            clip.add(effect)
+            control_source = GstController.InterpolationControlSource()
+            control_source.props.mode = GstController.InterpolationMode.LINEAR
+            effect.set_control_source(control_source, "contrast", "direct")
+            control_source.set(clip.props.start, 0.5)
+            control_source.set(clip.props.start + Gst.SECOND, 1)
+    return ges_timeline
+
+
+def measure(name, func):
+    tracemalloc.start()
+    start = time.time()
+    result = func()
+    duration = time.time() - start
+    unused_current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print("%-20s %8.2f s %8.1f MiB" % (name, duration, peak / 1024 / 1024))
+    return result
+
+
+def main():
+    ges_timeline = create_timeline()
+    print("%d clips in %d layers" % (NUM_CLIPS, NUM_LAYERS))
+
+    action_log = UndoableActionLog()
+    observer = measure("create observer",
+                       lambda: TimelineObserver(ges_timeline, action_log))
+    measure("observe all clips", observer.attach_pending_clips)
+
+
+if __name__ == "__main__":
+    main()
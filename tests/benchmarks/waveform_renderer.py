@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+# Pitivi video editor
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this program; if not, write to the
+# Free Software Foundation, Inc., 51 Franklin St, Fifth Floor,
+# Boston, MA 02110-1301, USA.
+"""Benchmark of the waveform renderer.
+
+Compares passing the samples as lists, like before, with passing the
+arrays of the waveform pyramid directly.
+
+Run with: python3 -m tests.benchmarks.waveform_renderer
+"""
+import os
+import tempfile
+import time
+
+import numpy
+
+from pitivi.timeline.previewers import renderer
+from pitivi.timeline.previewers import WaveformPyramid
+
+NUM_VALUES = 200000
+WIDTH = 2000
+HEIGHT = 50
+REPEATS = 20
+
+
+def bench(name, func):
+    start = time.time()
+    for unused_i in range(REPEATS):
+        func()
+    duration = (time.time() - start) / REPEATS
+    print("%-20s %8.2f ms" % (name, duration * 1000))
+
+
+def main():
+    values = numpy.random.uniform(0, 100, (NUM_VALUES, 3)).astype(numpy.float32)
+    rms = values[:, WaveformPyramid.RMS]
+    columns = values.shape[1]
+    print("%d values drawn on %d pixels" % (NUM_VALUES, WIDTH))
+
+    bench("list", lambda: renderer.fill_surface(rms.tolist(), WIDTH, HEIGHT))
+    rms64 = rms.astype(numpy.float64)
+    bench("float64 array", lambda: renderer.fill_surface(rms64, WIDTH, HEIGHT))
+    rms32 = numpy.ascontiguousarray(rms)
+    bench("float32 array", lambda: renderer.fill_surface(rms32, WIDTH, HEIGHT))
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "level.npy")
+        numpy.save(path, values)
+        mapped = numpy.load(path, mmap_mode="r")
+        bench("memmap stride", lambda mapped=mapped: renderer.fill_surface(
+            mapped, WIDTH, HEIGHT,
+            offset=WaveformPyramid.RMS, stride=columns))
+        bench("memmap envelope", lambda mapped=mapped: renderer.fill_envelope(
+            mapped, WIDTH, HEIGHT,
+            min_offset=WaveformPyramid.MIN, max_offset=WaveformPyramid.MAX,
+            stride=columns))
+        # Unmap the file before removing it.
+        del mapped
+
+
+if __name__ == "__main__":
+    main()
@@ -19,9 +19,11 @@
 """Tests for the utils.misc module."""
 # pylint: disable=protected-access,no-self-use
 import os
+import tempfile
 from unittest import mock
 
 from gi.repository import GdkPixbuf
+from gi.repository import GLib
 from gi.repository import Gst
 
 from pitivi.utils.misc import PathWalker
@@ -61,16 +63,17 @@ class MiscMethodsTest(common.TestCase):
 class PathWalkerTest(common.TestCase):
     """Tests for the `PathWalker` class."""
 
-    def _scan(self, uris):
+    def _scan(self, uris, mime_types=None):
         """Uses the PathWalker to scan URIs."""
         mainloop = common.create_main_loop()
         received_uris = []
 
-        def done_cb(uris):  # pylint: disable=missing-docstring
+        def found_cb(uris):  # pylint: disable=missing-docstring
             received_uris.extend(uris)
-            mainloop.quit()
-        walker = PathWalker(uris, done_cb)
+        walker = PathWalker(uris, found_cb, mime_types)
         walker.run()
+        # Quit after all the found URIs have been passed.
+        GLib.idle_add(mainloop.quit)
         mainloop.run()
         return received_uris
 
@@ -92,3 +95,37 @@ class PathWalkerTest(common.TestCase):
         self.assertGreater(len(received_uris), 1, received_uris)
         valid_uri = common.get_sample_uri("tears_of_steel.webm")
         self.assertIn(valid_uri, received_uris)
+
+    def test_scanning_dir_batches(self):
+        """Checks the files in the directories are found in batches."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            expected_uris = set()
+            for i in range(5):
+                folder = os.path.join(tmpdir, str(i))
+                os.mkdir(folder)
+                for j in range(50):
+                    path = os.path.join(folder, "%d.webm" % j)
+                    open(path, "w").close()
+                    expected_uris.add(Gst.filename_to_uri(path))
+                # Not in the specified types, but media files.
+                for name in ("clip.m4v", "song.ogg"):
+                    path = os.path.join(folder, name)
+                    open(path, "w").close()
+                    expected_uris.add(Gst.filename_to_uri(path))
+                open(os.path.join(folder, "notes.txt"), "w").close()
+            os.symlink(tmpdir, os.path.join(tmpdir, "loop"))
+
+            batches = []
+            walker = PathWalker([Gst.filename_to_uri(tmpdir)], batches.append,
+                                ["video/webm"])
+            with mock.patch("pitivi.utils.misc.GLib") as glib:
+                glib.idle_add.side_effect = lambda func, uris: func(uris)
+                walker.run()
+
+            # The last batch signals the end of the search.
+            self.assertEqual(batches.pop(), [])
+            self.assertGreater(len(batches), 1)
+            self.assertTrue(all(batches))
+            received_uris = [uri for batch in batches for uri in batch]
+            self.assertEqual(len(received_uris), len(expected_uris))
+            self.assertEqual(set(received_uris), expected_uris)
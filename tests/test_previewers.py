@@ -19,54 +19,71 @@
 """Tests for the timeline.previewers module."""
 # pylint: disable=protected-access
 import os
+import sqlite3
 import tempfile
 from unittest import mock
 
 import numpy
 from gi.repository import GdkPixbuf
 from gi.repository import GES
+from gi.repository import GLib
 from gi.repository import Gst
 
+from pitivi.timeline.previewers import get_thumb_level
 from pitivi.timeline.previewers import get_wavefile_location_for_uri
+from pitivi.timeline.previewers import LINEAR_THUMBNAILING_MIN_MISSING
+from pitivi.timeline.previewers import PixbufCache
+from pitivi.timeline.previewers import PreviewGeneratorManager
+from pitivi.timeline.previewers import SAMPLE_DURATION
+from pitivi.timeline.previewers import SpritePacker
 from pitivi.timeline.previewers import THUMB_HEIGHT
+from pitivi.timeline.previewers import THUMB_LEVELS
 from pitivi.timeline.previewers import THUMB_PERIOD
 from pitivi.timeline.previewers import ThumbnailCache
+from pitivi.timeline.previewers import ThumbnailEngine
+from pitivi.timeline.previewers import ThumbnailStore
 from pitivi.timeline.previewers import VideoPreviewer
+from pitivi.timeline.previewers import WAVEFORM_BUCKET_DURATION
+from pitivi.timeline.previewers import WaveformPyramid
+from pitivi.timeline.previewers import WaveformTileRenderer
+from pitivi.utils.misc import hash_file
 from tests import common
 from tests.test_media_library import BaseTestMediaLibrary
 
 
+# The RMS values of the 100 ms buckets of the audio, interpolated
+# linearly for each SAMPLE_DURATION.
 SIMPSON_WAVFORM_VALUES = [
-    0.10277689599093834, 0.50788916706114862, 0.91300143813135892, 1.3181137092015693,
-    1.7232259802717795, 2.1283382513419897, 2.5334505224121999, 2.9385627934824101,
-    3.3436750645526203, 3.7487873356228305, 3.748787335622831, 3.6974645491239455,
-    3.6461417626250601, 3.5948189761261746, 3.5434961896272892, 3.4921734031284037,
-    3.4408506166295183, 3.3895278301306329, 3.3382050436317474, 3.286882257132862,
-    3.2868822571328606, 3.4364524655420996, 3.5860226739513386, 3.7355928823605775,
-    3.8851630907698165, 4.034733299179055, 4.1843035075882939, 4.3338737159975329,
-    4.4834439244067719, 4.6330141328160108, 4.6330141328160108, 4.6166031969548991,
-    4.6001922610937873, 4.5837813252326756, 4.5673703893715638, 4.5509594535104521,
-    4.5345485176493403, 4.5181375817882286, 4.5017266459271168, 4.485315710066005,
-    4.4853157100660033, 4.5547060070202106, 4.6240963039744178, 4.6934866009286251,
-    4.7628768978828324, 4.8322671948370397, 4.901657491791247, 4.9710477887454543,
-    5.0404380856996616, 5.1098283826538689, 5.109828382653868, 5.0866990072166436,
-    5.0635696317794192, 5.0404402563421948, 5.0173108809049705, 4.9941815054677461,
-    4.9710521300305217, 4.9479227545932973, 4.924793379156073, 4.9016640037188486,
-    4.901664003718845, 4.8508680589687616, 4.8000721142186782, 4.7492761694685948,
-    4.6984802247185113, 4.6476842799684279, 4.5968883352183445, 4.5460923904682611,
-    4.4952964457181777, 4.4445005009680942, 4.4445005009680925, 4.5544001248210364,
-    4.6642997486739803, 4.7741993725269243, 4.8840989963798682, 4.9939986202328122,
-    5.1038982440857561, 5.2137978679387, 5.323697491791644, 5.4335971156445879,
-    5.433597115644587, 5.3988578703107724, 5.3641186249769577, 5.329379379643143,
-    5.2946401343093283, 5.2599008889755137, 5.225161643641699, 5.1904223983078843,
-    5.1556831529740696, 5.120943907640255, 5.120943907640255, 5.0895954243424724,
-    5.0582469410446897, 5.0268984577469071, 4.9955499744491245, 4.9642014911513419,
-    4.9328530078535593, 4.9015045245557767, 4.8701560412579941, 4.8388075579602114,
-    4.8388075579602079, 4.7336937056290518, 4.6285798532978957, 4.5234660009667396,
-    4.4183521486355835, 4.3132382963044273, 4.2081244439732712, 4.1030105916421151,
-    3.9978967393109586, 3.892782886979802, 3.8927828869797994, 3.8630968485705619,
-    3.8334108101613245, 3.803724771752087, 3.7740387333428496, 3.7443526949336121,
-    3.7146666565243747, 3.6849806181151372, 3.6552945797058998, 3.6256085412966623,
+    0.10277689599093834, 0.4673779399541276, 0.8319789839173168, 1.196580027880506,
+    1.5611810718436954, 1.9257821158068846, 2.290383159770074, 2.6549842037332634,
+    3.0195852476964524, 3.3841862916596415, 3.748787335622831, 3.702596827773834,
+    3.656406319924837, 3.6102158120758396, 3.564025304226843, 3.517834796377846,
+    3.4716442885288488, 3.4254537806798515, 3.3792632728308547, 3.333072764981858,
+    3.2868822571328606, 3.4214954447011756, 3.5561086322694906, 3.6907218198378056,
+    3.825335007406121, 3.9599481949744355, 4.094561382542751, 4.229174570111066,
+    4.363787757679381, 4.498400945247695, 4.633014132816011, 4.61824429054101,
+    4.6034744482660095, 4.588704605991008, 4.573934763716008, 4.559164921441007,
+    4.544395079166006, 4.529625236891006, 4.514855394616005, 4.500085552341004,
+    4.485315710066003, 4.547766977324789, 4.610218244583576, 4.672669511842363,
+    4.735120779101149, 4.797572046359935, 4.860023313618722, 4.922474580877509,
+    4.984925848136295, 5.047377115395081, 5.109828382653868, 5.089011944760365,
+    5.068195506866863, 5.0473790689733615, 5.026562631079859, 5.005746193186356,
+    4.984929755292854, 4.964113317399352, 4.94329687950585, 4.922480441612347,
+    4.901664003718845, 4.85594765344377, 4.8102313031686945, 4.764514952893619,
+    4.718798602618544, 4.673082252343469, 4.6273659020683935, 4.581649551793318,
+    4.535933201518243, 4.490216851243168, 4.4445005009680925, 4.543410162435742,
+    4.642319823903391, 4.741229485371041, 4.84013914683869, 4.93904880830634,
+    5.037958469773989, 5.136868131241639, 5.235777792709288, 5.334687454176938,
+    5.433597115644587, 5.402331794844153, 5.371066474043721, 5.339801153243288,
+    5.308535832442854, 5.277270511642421, 5.246005190841988, 5.214739870041555,
+    5.183474549241121, 5.152209228440688, 5.120943907640255, 5.0927302726722505,
+    5.064516637704245, 5.036303002736241, 5.008089367768236, 4.979875732800231,
+    4.9516620978322266, 4.923448462864222, 4.895234827896218, 4.867021192928212,
+    4.838807557960208, 4.744205090862167, 4.649602623764126, 4.555000156666085,
+    4.460397689568045, 4.365795222470004, 4.271192755371963, 4.176590288273922,
+    4.081987821175881, 3.98738535407784, 3.8927828869797994, 3.8660654524114855,
+    3.8393480178431716, 3.812630583274858, 3.7859131487065443, 3.7591957141382304,
+    3.7324782795699165, 3.7057608450016026, 3.679043410433289, 3.6523259758649753,
     3.6256085412966614, 0.0]
 
 
@@ -93,9 +110,99 @@ class TestAudioPreviewer(BaseTestMediaLibrary):
         self.assertTrue(os.path.exists(wavefile), wavefile)
 
         with open(wavefile, "rb") as fsamples:
-            samples = list(numpy.load(fsamples))
+            samples = numpy.load(fsamples)
 
-        self.assertEqual(samples, SIMPSON_WAVFORM_VALUES)
+        # The values of the buckets were originally measured by the `level`
+        # element, in decibels, which loses some precision.
+        numpy.testing.assert_allclose(samples, SIMPSON_WAVFORM_VALUES, atol=1e-3)
+
+
+class TestWaveformPreviewer(common.TestCase):
+    """Tests for the `WaveformPreviewer` class."""
+
+    def test_buckets(self):
+        """Checks the RMS and peak values computed from the raw audio."""
+        wavebin = Gst.ElementFactory.make("waveformbin", None)
+        wavebin.props.duration = 4 * WAVEFORM_BUCKET_DURATION
+
+        def probe(info_type, obj):
+            info = mock.Mock()
+            info.type = info_type
+            info.get_buffer.return_value = obj
+            info.get_event.return_value = obj
+            wavebin._probe_cb(None, info)
+
+        # 10 frames per bucket.
+        caps = Gst.Caps.from_string("audio/x-raw,format=F32LE,channels=1,"
+                                    "layout=interleaved,rate=100")
+        probe(Gst.PadProbeType.EVENT_DOWNSTREAM, Gst.Event.new_caps(caps))
+        frames = numpy.array([0.1] * 10 + [-0.3] * 10 + [0.5] * 15, dtype="<f4")
+        buf = Gst.Buffer.new_wrapped(frames.tobytes())
+        buf.pts = 0
+        probe(Gst.PadProbeType.BUFFER, buf)
+        probe(Gst.PadProbeType.EVENT_DOWNSTREAM, Gst.Event.new_eos())
+
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            wavebin.wavefile = os.path.join(tmpdirname, "test.wave.npy")
+            wavebin.finalize()
+            samples = numpy.load(wavebin.wavefile)
+            self.assertIsNotNone(WaveformPyramid.load(wavebin.wavefile))
+
+        numpy.testing.assert_almost_equal(samples[[0, 5, 10, 20, 30]], [10, 20, 30, 50, 50], decimal=4)
+        self.assertEqual(samples[31:].tolist(), [0] * 9)
+        level = wavebin.pyramid.levels[0]
+        numpy.testing.assert_almost_equal(level[[0, 10, 20], WaveformPyramid.MIN], [10, -30, 50], decimal=4)
+        numpy.testing.assert_almost_equal(level[[0, 10, 20], WaveformPyramid.MAX], [10, -30, 50], decimal=4)
+
+
+class TestWaveformPyramid(common.TestCase):
+    """Tests for the `WaveformPyramid` class."""
+
+    def test_levels(self):
+        """Checks the levels are computed, saved and memory-mapped."""
+        samples = numpy.array([1, 1, 1, 1, 2, 2, 2, 2, 4], dtype=float)
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            wavefile = os.path.join(tmpdirname, "test.wave.npy")
+            self.assertIsNone(WaveformPyramid.load(wavefile))
+            WaveformPyramid.create_from_samples(wavefile, samples)
+
+            pyramid = WaveformPyramid.load(wavefile)
+            self.assertEqual([len(level) for level in pyramid.levels], [9, 3])
+            self.assertIsInstance(pyramid.levels[0], numpy.memmap)
+            numpy.testing.assert_almost_equal(pyramid.levels[1],
+                                              [[-1, 1, 1], [-2, 2, 2], [-4, 4, 4]])
+
+            values, duration = pyramid.get_level(SAMPLE_DURATION)
+            self.assertEqual((len(values), duration), (9, SAMPLE_DURATION))
+            values, duration = pyramid.get_level(100 * SAMPLE_DURATION)
+            self.assertEqual((len(values), duration), (3, 4 * SAMPLE_DURATION))
+
+
+class TestWaveformTileRenderer(common.TestCase):
+    """Tests for the `WaveformTileRenderer` class."""
+
+    def test_render(self):
+        """Checks the tiles are rendered once and only if still wanted."""
+        tile_renderer = WaveformTileRenderer()
+        # The jobs are processed last in first out, so this stops the
+        # processing after the tiles below are rendered.
+        tile_renderer.abort()
+
+        render_func = mock.Mock(return_value="surface")
+        callback1 = mock.Mock()
+        callback2 = mock.Mock()
+        tile_renderer.render("a", render_func, lambda: True, callback1)
+        tile_renderer.render("a", render_func, lambda: True, callback2)
+        tile_renderer.render("b", render_func, lambda: False, callback1)
+
+        with mock.patch.object(GLib, "idle_add",
+                               side_effect=lambda func, *args: func(*args)):
+            tile_renderer.process()
+
+        render_func.assert_called_once_with()
+        callback1.assert_called_once_with("a", "surface")
+        callback2.assert_called_once_with("a", "surface")
+        self.assertEqual(tile_renderer._pending, {})
 
 
 class TestVideoPreviewer(common.TestCase):
@@ -123,6 +230,147 @@ class TestVideoPreviewer(common.TestCase):
         self.assertEqual(run_thumb_interval(2 * THUMB_PERIOD - 1), 2 * THUMB_PERIOD)
         self.assertEqual(run_thumb_interval(2 * THUMB_PERIOD), 2 * THUMB_PERIOD)
 
+        self.assertEqual(run_thumb_interval(2 * THUMB_PERIOD + 1), 4 * THUMB_PERIOD)
+        self.assertEqual(run_thumb_interval(4 * THUMB_PERIOD + 1), 8 * THUMB_PERIOD)
+
+    def test_get_thumb_level(self):
+        """Checks the lowest satisfying resolution level is picked."""
+        self.assertEqual(get_thumb_level(THUMB_HEIGHT + 1), 0)
+        self.assertEqual(get_thumb_level(THUMB_HEIGHT), 0)
+        self.assertEqual(get_thumb_level(THUMB_HEIGHT // 2 + 1), 0)
+        self.assertEqual(get_thumb_level(THUMB_HEIGHT // 2), 1)
+        self.assertEqual(get_thumb_level(1), THUMB_LEVELS - 1)
+
+    def test_should_play_linearly(self):
+        """Checks when the clip is played instead of seeking."""
+        ges_elem = mock.Mock()
+        ges_elem.props.uri = common.get_sample_uri("1sec_simpsons_trailer.mp4")
+        ges_elem.props.id = common.get_sample_uri("1sec_simpsons_trailer.mp4")
+        previewer = VideoPreviewer(ges_elem, 94)
+        previewer.thumbs = dict.fromkeys(range(30))
+
+        with mock.patch.object(VideoPreviewer, "thumb_interval", THUMB_PERIOD):
+            previewer.queue = list(range(LINEAR_THUMBNAILING_MIN_MISSING - 1))
+            self.assertFalse(previewer._should_play_linearly())
+
+            previewer.queue = list(range(14))
+            self.assertFalse(previewer._should_play_linearly())
+
+            previewer.queue = list(range(15))
+            self.assertTrue(previewer._should_play_linearly())
+
+        with mock.patch.object(VideoPreviewer, "thumb_interval", 10 * THUMB_PERIOD):
+            self.assertFalse(previewer._should_play_linearly())
+
+
+class TestThumbnailEngine(common.TestCase):
+    """Tests for the `ThumbnailEngine` class."""
+
+    def test_dispatch_order(self):
+        """Checks the jobs are handed out by priority, then FIFO."""
+        engine = ThumbnailEngine(max_workers=1)
+        owner = mock.Mock()
+        callback = mock.Mock()
+        engine.add_job("file:///a", 0, callback, priority=1)
+        engine.add_job("file:///a", 1, callback, priority=0)
+        engine.add_job("file:///a", 2, callback, priority=0, owner=owner)
+        engine.add_job("file:///a", 3, callback, priority=0)
+        engine.cancel_jobs(owner)
+
+        processed = []
+        with mock.patch("pitivi.timeline.previewers.ThumbnailWorker.process") as process:
+            process.side_effect = lambda job: processed.append(job.position)
+            for unused_i in range(3):
+                engine._dispatch_cb()
+                worker = engine._workers[0]
+                engine.job_done(worker, mock.Mock())
+
+        self.assertEqual(processed, [1, 3, 0])
+        self.assertEqual(callback.call_count, 0)
+
+    def test_workers_reused(self):
+        """Checks the workers are reused for the same URI."""
+        engine = ThumbnailEngine(max_workers=2)
+        engine.add_job("file:///a", 0, mock.Mock())
+        engine.add_job("file:///b", 0, mock.Mock())
+        with mock.patch("pitivi.timeline.previewers.ThumbnailWorker.process"):
+            engine._dispatch_cb()
+            self.assertEqual(len(engine._workers), 2)
+            worker_a, worker_b = engine._workers
+            worker_a.uri = "file:///a"
+            worker_a.height = THUMB_HEIGHT
+            worker_b.uri = "file:///b"
+            worker_b.height = THUMB_HEIGHT
+            engine.job_done(worker_b, mock.Mock())
+            engine.job_done(worker_a, mock.Mock())
+
+            engine.add_job("file:///a", 1, mock.Mock())
+            self.assertIs(engine._take_worker(engine._queue[0][2]), worker_a)
+
+
+class TestPreviewGeneratorManager(common.TestCase):
+    """Tests for the `PreviewGeneratorManager` class."""
+
+    def test_get_priority(self):
+        """Checks the visible ranges close to the playhead go first."""
+        manager = PreviewGeneratorManager()
+        self.assertEqual(manager.get_priority(10, 20), 0)
+
+        manager.viewport = (100, 200)
+        manager.playhead = 150
+        # Containing the playhead.
+        self.assertEqual(manager.get_priority(140, 160), 0)
+        # Visible.
+        self.assertEqual(manager.get_priority(170, 180), 20)
+        self.assertEqual(manager.get_priority(50, 110), 40)
+        # Not visible.
+        self.assertEqual(manager.get_priority(210, 220), 111)
+        self.assertEqual(manager.get_priority(0, 90), 111)
+        self.assertLess(manager.get_priority(0, 90), manager.get_priority(0, 80))
+
+        # The playhead is not visible.
+        manager.playhead = 1000
+        self.assertEqual(manager.get_priority(190, 200), 100)
+
+    def test_reprioritize(self):
+        """Checks the queued jobs are reordered."""
+        manager = PreviewGeneratorManager()
+        engine = manager.thumbnailer
+        for position in range(4):
+            engine.add_job("file:///a", position, mock.Mock())
+        engine.reprioritize(lambda job: -job.position)
+        self.assertEqual([entry[2].position for entry in sorted(engine._queue)],
+                         [3, 2, 1, 0])
+
+
+class TestPixbufCache(common.TestCase):
+    """Tests for the `PixbufCache` class."""
+
+    def test_eviction(self):
+        """Checks the least recently used pixbufs are evicted."""
+        cache = PixbufCache(max_bytes=300)
+        pixbuf = mock.Mock()
+        pixbuf.get_rowstride.return_value = 10
+        pixbuf.get_height.return_value = 10
+
+        cache.put("a", pixbuf)
+        cache.put("b", pixbuf)
+        cache.put("c", pixbuf)
+        self.assertEqual(cache.size, 300)
+        self.assertIs(cache.get("a"), pixbuf)
+
+        cache.put("d", pixbuf)
+        self.assertEqual(cache.size, 300)
+        self.assertIsNone(cache.get("b"))
+        self.assertIs(cache.get("a"), pixbuf)
+        self.assertIs(cache.get("c"), pixbuf)
+        self.assertIs(cache.get("d"), pixbuf)
+        self.assertEqual((cache.hits, cache.misses), (4, 1))
+
+        # Replacing does not count twice.
+        cache.put("d", pixbuf)
+        self.assertEqual(cache.size, 300)
+
 
 class TestThumbnailCache(BaseTestMediaLibrary):
     """Tests for the ThumbnailCache class."""
@@ -178,3 +426,105 @@ class TestThumbnailCache(BaseTestMediaLibrary):
                 thumb_cache = ThumbnailCache(sample_uri)
                 self.assertTrue(Gst.SECOND in thumb_cache)
                 self.assertIsNotNone(thumb_cache[Gst.SECOND])
+
+    def test_levels(self):
+        """Checks the lower resolutions and the nearest positions."""
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            with mock.patch("pitivi.timeline.previewers.xdg_cache_home") as xdg_cache_home:
+                xdg_cache_home.return_value = tmpdirname
+                sample_uri = common.get_sample_uri("1sec_simpsons_trailer.mp4")
+                thumb_cache = ThumbnailCache(sample_uri)
+                self.assertIsNone(thumb_cache.get_nearest_position(0, THUMB_PERIOD))
+
+                pixbuf = GdkPixbuf.Pixbuf.new(GdkPixbuf.Colorspace.RGB,
+                                              False, 8, 40, THUMB_HEIGHT)
+                thumb_cache[Gst.SECOND] = pixbuf
+                thumb_cache.commit()
+
+                thumb_cache = ThumbnailCache(sample_uri)
+                level1 = thumb_cache.get_level(Gst.SECOND, 1)
+                self.assertEqual((level1.props.width, level1.props.height),
+                                 (20, THUMB_HEIGHT >> 1))
+                level2 = thumb_cache.get_level(Gst.SECOND, 2)
+                self.assertEqual((level2.props.width, level2.props.height),
+                                 (10, THUMB_HEIGHT >> 2))
+
+                self.assertEqual(thumb_cache.get_nearest_position(Gst.SECOND - THUMB_PERIOD, THUMB_PERIOD),
+                                 Gst.SECOND)
+                self.assertEqual(thumb_cache.get_nearest_position(Gst.SECOND + THUMB_PERIOD, THUMB_PERIOD),
+                                 Gst.SECOND)
+                self.assertIsNone(thumb_cache.get_nearest_position(Gst.SECOND + THUMB_PERIOD, THUMB_PERIOD - 1))
+
+    def test_sprites(self):
+        """Checks the thumbnails are loaded from the sprite sheets."""
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            with mock.patch("pitivi.timeline.previewers.xdg_cache_home") as xdg_cache_home:
+                xdg_cache_home.return_value = tmpdirname
+                sample_uri = common.get_sample_uri("1sec_simpsons_trailer.mp4")
+                thumb_cache = ThumbnailCache(sample_uri)
+                positions = [i * THUMB_PERIOD for i in range(20)]
+                for position in positions:
+                    thumb_cache[position] = GdkPixbuf.Pixbuf.new(GdkPixbuf.Colorspace.RGB,
+                                                                 False, 8, 40, THUMB_HEIGHT)
+                thumb_cache.commit()
+                sheets = thumb_cache._pack_sheets(positions, 0)
+                self.assertEqual(len(sheets), 1)
+                thumb_cache._save_sprites({0: sheets})
+
+                ThumbnailCache.pixbufs.clear()
+                thumb_cache = ThumbnailCache(sample_uri)
+                with mock.patch.object(thumb_cache._store, "get_jpeg") as get_jpeg:
+                    for position in positions:
+                        pixbuf = thumb_cache[position]
+                        self.assertEqual((pixbuf.props.width, pixbuf.props.height),
+                                         (40, THUMB_HEIGHT))
+                    self.assertFalse(get_jpeg.called)
+
+    def test_migration(self):
+        """Checks the legacy per-asset databases are imported."""
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            with mock.patch("pitivi.timeline.previewers.xdg_cache_home") as xdg_cache_home:
+                xdg_cache_home.return_value = tmpdirname
+                sample_uri = common.get_sample_uri("1sec_simpsons_trailer.mp4")
+                pixbuf = GdkPixbuf.Pixbuf.new(GdkPixbuf.Colorspace.RGB,
+                                              False, 8, 20, THUMB_HEIGHT)
+                unused_success, jpeg = pixbuf.save_to_bufferv("jpeg", [], [])
+
+                filehash = hash_file(Gst.uri_get_location(sample_uri))
+                os.makedirs(os.path.join(tmpdirname, "thumbs"))
+                legacy_dbfile = os.path.join(tmpdirname, "thumbs", filehash)
+                legacy_db = sqlite3.connect(legacy_dbfile)
+                legacy_db.execute("CREATE TABLE Thumbs "
+                                  "(Time INTEGER NOT NULL PRIMARY KEY, "
+                                  " Jpeg BLOB NOT NULL)")
+                legacy_db.execute("INSERT INTO Thumbs VALUES (?, ?)",
+                                  (Gst.SECOND, sqlite3.Binary(jpeg)))
+                legacy_db.commit()
+                legacy_db.close()
+
+                thumb_cache = ThumbnailCache(sample_uri)
+                self.assertFalse(os.path.exists(legacy_dbfile))
+                self.assertEqual(thumb_cache.positions, {Gst.SECOND})
+                self.assertEqual(thumb_cache.image_size, (20, THUMB_HEIGHT))
+                # The lower resolutions are computed when first needed.
+                self.assertIsNotNone(thumb_cache.get_level(Gst.SECOND, 1))
+
+    def test_migration_failure(self):
+        """Checks the legacy databases which cannot be imported are kept."""
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            store = ThumbnailStore(os.path.join(tmpdirname, "thumbs.db"))
+            legacy_dbfile = os.path.join(tmpdirname, "legacy")
+            with open(legacy_dbfile, "wb") as legacy_db:
+                legacy_db.write(b"not a database" * 100)
+
+            store.migrate("filehash", legacy_dbfile, THUMB_HEIGHT)
+            self.assertTrue(os.path.exists(legacy_dbfile))
+
+    def test_packing_failure(self):
+        """Checks the end of the packing is reported even when it fails."""
+        pack_sheets = mock.Mock(side_effect=sqlite3.OperationalError("locked"))
+        callback = mock.Mock()
+        packer = SpritePacker(pack_sheets, [0], callback)
+        with mock.patch("pitivi.timeline.previewers.GLib.idle_add") as idle_add:
+            packer.process()
+        idle_add.assert_called_once_with(callback, {})
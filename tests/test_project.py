@@ -29,6 +29,8 @@ from gi.repository import Gst
 from pitivi import medialibrary
 from pitivi.project import Project
 from pitivi.project import ProjectManager
+from pitivi.undo.undo import UndoableAction
+from pitivi.undo.undo import UndoableActionLog
 from pitivi.utils.misc import path_from_uri
 from pitivi.utils.proxy import ProxyingStrategy
 from tests import common
@@ -255,6 +257,47 @@ class TestProjectManager(common.TestCase):
         self.assertFalse(os.path.isfile(path_from_uri(backup_uri)),
                          "Backup file not deleted when project closed")
 
+    def test_backup_written_after_save(self):
+        """Checks a backup obsoleted by saving does not replace the journal."""
+        self.manager.new_blank_project()
+        project = self.manager.current_project
+        fd, xges_path = tempfile.mkstemp(suffix=".xges")
+        os.close(fd)
+        uri = "file://" + os.path.abspath(xges_path)
+        project.uri = uri
+        self.assertTrue(self.manager.saveProject(uri))
+
+        action_log = UndoableActionLog()
+        with mock.patch("pitivi.project.has_validate", True):
+            self.manager.start_journal(action_log)
+
+        def commit_operation(name):
+            action = mock.Mock(spec=UndoableAction)
+            action.expand.return_value = False
+            action.asScenarioAction.return_value.to_string.return_value = name
+            action_log.begin(name)
+            action_log.push(action)
+            action_log.commit(name)
+
+        try:
+            commit_operation("a1")
+            self.assertTrue(self.manager.save_backup_async())
+            writer = self.manager._ProjectManager__backup_writer
+            self.assertTrue(self.manager.saveProject(uri))
+            commit_operation("b1")
+
+            writer.join()
+            self.manager._ProjectManager__backup_written_cb(writer)
+            self.manager._ProjectManager__journal.sync()
+            journal_path = path_from_uri(self.manager._makeJournalURI(uri))
+            self.assertFalse(os.path.exists(journal_path + ".next"))
+            with open(journal_path) as journal:
+                lines = journal.read().splitlines()
+            self.assertEqual(lines[2:], ["b1"])
+        finally:
+            self.manager.closeRunningProject()
+            os.remove(xges_path)
+
 
 class TestProjectLoading(common.TestCase):
 
@@ -533,6 +576,61 @@ class TestProjectLoading(common.TestCase):
             self.assertEqual(medialib.storemodel[1][medialibrary.COL_THUMB_DECORATOR].state,
                              medialibrary.AssetThumbnail.IN_PROGRESS)
 
+    def test_bounded_import(self):
+        """Checks the media files are discovered a few at a time."""
+        project = common.create_project()
+        uris = [common.get_sample_uri(name) for name in
+                ("flat_colour1_640x480.png", "tears_of_steel.webm",
+                 "1sec_simpsons_trailer.mp4")]
+        progress = []
+        project.connect("import-progress",
+                        lambda unused_project, *args: progress.append(args))
+
+        with mock.patch("pitivi.project.IMPORT_MAX_DISCOVERIES", 2), \
+                mock.patch.object(project, "create_asset") as create_asset:
+            create_asset.return_value = True
+            project.addUris(uris + uris[:1])
+            self.assertEqual([call[0][0] for call in create_asset.call_args_list],
+                             uris[:2])
+
+            project._Project__import_done(uris[0])
+            self.assertEqual(create_asset.call_count, 3)
+            self.assertEqual(progress, [(1, 3)])
+
+            project._Project__import_done(uris[2])
+            project._Project__import_done(uris[1])
+            self.assertEqual(create_asset.call_count, 3)
+            self.assertEqual(progress, [(1, 3), (2, 3), (3, 3)])
+
+    def test_cancel_import(self):
+        """Checks the queued imports can be cancelled."""
+        project = common.create_project()
+        uris = [common.get_sample_uri(name) for name in
+                ("flat_colour1_640x480.png", "tears_of_steel.webm",
+                 "1sec_simpsons_trailer.mp4")]
+        progress = []
+        project.connect("import-progress",
+                        lambda unused_project, *args: progress.append(args))
+
+        with mock.patch("pitivi.project.IMPORT_MAX_DISCOVERIES", 1), \
+                mock.patch.object(project, "create_asset") as create_asset:
+            create_asset.return_value = True
+            project.addUris(uris)
+            # Being discovered.
+            self.assertFalse(project.cancel_import(uris[0]))
+            self.assertTrue(project.cancel_import(uris[1]))
+            self.assertEqual(progress, [(0, 2)])
+
+            project._Project__import_done(uris[0])
+            self.assertEqual([call[0][0] for call in create_asset.call_args_list],
+                             [uris[0], uris[2]])
+            project._Project__import_done(uris[2])
+            self.assertEqual(progress, [(0, 2), (1, 2), (2, 2)])
+
+            # Cancelled imports can be added again.
+            project.addUris(uris[1:2])
+            self.assertEqual(create_asset.call_args[0][0], uris[1])
+
 
 class TestProjectSettings(common.TestCase):
 
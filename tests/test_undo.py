@@ -138,6 +138,83 @@ class TestUndoableActionLog(common.TestCase):
         self.log.redo()
         self.assertFalse(self.log.dirty())
 
+    def test_max_operations(self):
+        """Checks the oldest operations are forgotten."""
+        self.log.max_operations = 2
+        for name in ["a", "b", "c"]:
+            self.log.begin(name)
+            self.log.push(mock.Mock(spec=UndoableAction))
+            self.log.commit(name)
+        self.assertEqual([stack.action_group_name for stack in self.log.undo_stacks],
+                         ["b", "c"])
+        self.assertTrue(self.log.dirty())
+
+        self.log.undo()
+        self.log.undo()
+        self.assertRaises(UndoWrongStateError, self.log.undo)
+        # The forgotten operation is still done.
+        self.assertTrue(self.log.dirty())
+
+    def test_max_size(self):
+        """Checks the operations are forgotten when using too much memory."""
+        self.log.begin("a")
+        self.log.push(mock.Mock(spec=UndoableAction))
+        self.log.commit("a")
+        self.log.max_size = self.log.size + 1
+        self.log.begin("b")
+        self.log.push(mock.Mock(spec=UndoableAction))
+        self.log.commit("b")
+        self.assertEqual([stack.action_group_name for stack in self.log.undo_stacks],
+                         ["b"])
+        self.assertLessEqual(self.log.size, self.log.max_size)
+
+    def test_merge_property_changes(self):
+        """Checks the property changes of the same objects are merged."""
+        gobject = mock.Mock()
+        for old_value, new_value in [(0, 1), (1, 2)]:
+            self.log.begin("change")
+            self.log.push(PropertyChangedAction(gobject, "alpha", old_value, new_value))
+            self.log.commit("change")
+        self.assertEqual(len(self.log.undo_stacks), 1)
+
+        self.log.checkpoint()
+        self.log.begin("change")
+        self.log.push(PropertyChangedAction(gobject, "alpha", 2, 3))
+        self.log.commit("change")
+        # Not merged with the saved state.
+        self.assertEqual(len(self.log.undo_stacks), 2)
+
+        self.log.begin("change")
+        self.log.push(PropertyChangedAction(gobject, "volume", 0, 1))
+        self.log.commit("change")
+        self.assertEqual(len(self.log.undo_stacks), 3)
+
+        self.log.undo()
+        self.log.undo()
+        self.assertFalse(self.log.dirty())
+        self.log.undo()
+        gobject.set_property.assert_called_with("alpha", 0)
+
+    def test_merge_key(self):
+        """Checks the operations with the same merge key are merged."""
+        merge_key = object()
+        for unused_i in range(2):
+            self.log.begin("import", merge_key=merge_key)
+            self.log.push(mock.Mock(spec=UndoableAction))
+            self.log.commit("import")
+        self.assertEqual(len(self.log.undo_stacks), 1)
+        self.assertEqual(len(self.log.undo_stacks[0].done_actions), 2)
+
+        self.log.begin("import", merge_key=object())
+        self.log.push(mock.Mock(spec=UndoableAction))
+        self.log.commit("import")
+        self.assertEqual(len(self.log.undo_stacks), 2)
+
+        self.log.undo()
+        self.log.undo()
+        for action in self.log.redo_stacks[-1].done_actions:
+            action.undo.assert_called_once_with()
+
     def testCommit(self):
         """
         Commit a stack.
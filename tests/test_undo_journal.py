@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+# Pitivi video editor
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this program; if not, write to the
+# Free Software Foundation, Inc., 51 Franklin St, Fifth Floor,
+# Boston, MA 02110-1301, USA.
+"""Tests for the pitivi.undo.journal module."""
+import os
+import tempfile
+from unittest import mock
+
+from pitivi.undo.journal import UndoJournal
+from pitivi.undo.undo import UndoableAction
+from pitivi.undo.undo import UndoableActionLog
+from tests import common
+
+
+def create_action(name):
+    action = mock.Mock(spec=UndoableAction)
+    action.expand.return_value = False
+    action.asScenarioAction.return_value.to_string.return_value = name
+    return action
+
+
+class TestUndoJournal(common.TestCase):
+    """Tests for the UndoJournal class."""
+
+    def test_journal(self):
+        """Checks the committed operations are journaled."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "project.xges~.scenario")
+            log = UndoableActionLog()
+            journal = UndoJournal(log, path)
+            journal.reset("<ges/>")
+            self.assertFalse(UndoJournal.has_operations(path))
+
+            log.begin("a")
+            log.push(create_action("a1"))
+            log.begin("nested")
+            log.push(create_action("a2"))
+            log.commit("nested")
+            log.begin("rolled back")
+            log.push(create_action("ignored"))
+            log.rollback()
+            log.commit("a")
+
+            log.begin("b")
+            log.push(create_action("b1"))
+            log.rollback()
+            journal.sync()
+
+            with open(path) as journal_file:
+                lines = journal_file.read().splitlines()
+            self.assertEqual(len(lines), 4, lines)
+            self.assertTrue(lines[1].startswith("load-project"))
+            self.assertEqual(lines[2:], ["a1", "a2"])
+            self.assertTrue(UndoJournal.has_operations(path))
+
+            journal.reset("<ges/>")
+            self.assertFalse(UndoJournal.has_operations(path))
+            journal.release()
+
+    def test_switch(self):
+        """Checks the operations done after the marker are kept."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "project.xges~.scenario")
+            log = UndoableActionLog()
+            journal = UndoJournal(log, path)
+            journal.reset("<ges/>")
+
+            log.begin("a")
+            log.push(create_action("a1"))
+            log.commit("a")
+            marker = journal.mark()
+            log.begin("b")
+            log.push(create_action("b1"))
+            log.commit("b")
+
+            prepared_path = path + ".next"
+            UndoJournal.prepare(prepared_path, "<ges a1/>")
+            journal.switch(prepared_path, marker)
+            journal.sync()
+
+            self.assertFalse(os.path.exists(prepared_path))
+            with open(path) as journal_file:
+                lines = journal_file.read().splitlines()
+            self.assertEqual(len(lines), 3, lines)
+            self.assertIn("a1", lines[1])
+            self.assertEqual(lines[2], "b1")
+            journal.release()
+
+    def test_incomplete(self):
+        """Checks the operations which cannot be journaled are detected."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "project.xges~.scenario")
+            log = UndoableActionLog()
+            journal = UndoJournal(log, path)
+            journal.reset("<ges/>")
+
+            log.begin("a")
+            log.push(create_action("a1"))
+            log.commit("a")
+            self.assertTrue(journal.complete)
+
+            log.begin("b")
+            log.push(create_action("b1"))
+            unserializable_action = create_action("b2")
+            unserializable_action.asScenarioAction.side_effect = NotImplementedError
+            log.push(unserializable_action)
+            log.commit("b")
+            self.assertFalse(journal.complete)
+
+            marker = journal.mark()
+            log.begin("c")
+            log.push(create_action("c1"))
+            log.commit("c")
+
+            # The prepared project contains the missing action.
+            prepared_path = path + ".next"
+            UndoJournal.prepare(prepared_path, "<ges b2/>")
+            journal.switch(prepared_path, marker)
+            self.assertTrue(journal.complete)
+            journal.release()
@@ -16,10 +16,13 @@
 # License along with this program; if not, write to the
 # Free Software Foundation, Inc., 51 Franklin St, Fifth Floor,
 # Boston, MA 02110-1301, USA.
+from unittest import mock
+
 from gi.repository import GES
 from gi.repository import Gtk
 
 from pitivi.project import ProjectSettingsDialog
+from pitivi.undo.project import AssetAddedIntention
 from tests import common
 
 
@@ -146,3 +149,24 @@ class TestProjectUndo(common.TestCase):
 
         self.action_log.redo()
         assert_meta("a2", "2002")
+
+
+class TestAssetAddedIntention(common.TestCase):
+    """Tests for the AssetAddedIntention class."""
+
+    def test_undo_before_added(self):
+        """Checks the assets added after being undone are removed."""
+        uri = common.get_sample_uri("tears_of_steel.webm")
+        project = mock.Mock()
+        intention = AssetAddedIntention(project, uri)
+
+        intention.undo()
+        project.cancel_import.assert_called_once_with(uri)
+
+        asset = mock.Mock()
+        asset.get_id.return_value = uri
+        intention._asset_added_cb(project, asset)
+        project.remove_asset.assert_called_once_with(asset)
+
+        intention.do()
+        project.add_asset.assert_called_once_with(asset)
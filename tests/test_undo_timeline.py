@@ -32,8 +32,10 @@ from pitivi.timeline.timeline import TimelineContainer
 from pitivi.undo.project import AssetAddedAction
 from pitivi.undo.timeline import ClipAdded
 from pitivi.undo.timeline import ClipRemoved
+from pitivi.undo.timeline import TimelineObserver
 from pitivi.undo.timeline import TrackElementAdded
 from pitivi.undo.undo import PropertyChangedAction
+from pitivi.undo.undo import UndoableActionLog
 from pitivi.utils.ui import LAYER_HEIGHT
 from pitivi.utils.ui import URI_TARGET_ENTRY
 from tests import common
@@ -101,6 +103,25 @@ class BaseTestUndoTimeline(common.TestCase):
 
 class TestTimelineObserver(BaseTestUndoTimeline):
 
+    def test_lazy_clip_observers(self):
+        clip = GES.TitleClip()
+        clip.set_duration(Gst.SECOND)
+        self.layer.add_clip(clip)
+
+        action_log = UndoableActionLog()
+        observer = TimelineObserver(self.timeline, action_log)
+        layer_observer = observer.layer_observers[self.layer]
+        self.assertEqual(list(layer_observer.pending_clips), [clip])
+        self.assertNotIn(clip, layer_observer.clip_observers)
+
+        with action_log.started("move clip"):
+            clip.set_start(10)
+        self.assertFalse(observer.has_pending_clips())
+        stack, = action_log.undo_stacks
+        action, = stack.done_actions
+        self.assertTrue(isinstance(action, PropertyChangedAction))
+        self.assertEqual((action.old_value, action.new_value), (0, 10))
+
     def test_layer_removed(self):
         self.setup_timeline_container()
 
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+# Pitivi video editor
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this program; if not, write to the
+# Free Software Foundation, Inc., 51 Franklin St, Fifth Floor,
+# Boston, MA 02110-1301, USA.
+"""Tests for the utils.discovery module."""
+import os
+import tempfile
+
+from gi.repository import Gst
+from gi.repository import GstPbutils
+
+from pitivi.utils.discovery import DiscoveryCache
+from tests import common
+
+
+class TestDiscoveryCache(common.TestCase):
+    """Tests for the DiscoveryCache class."""
+
+    def test_cache(self):
+        with tempfile.TemporaryDirectory() as tmpdir, \
+                common.cloned_sample("tears_of_steel.webm"):
+            uri = common.get_sample_uri("tears_of_steel.webm")
+            discoverer = GstPbutils.Discoverer.new(5 * Gst.SECOND)
+            info = discoverer.discover_uri(uri)
+
+            cache = DiscoveryCache(os.path.join(tmpdir, "discovery.db"))
+            self.assertIsNone(cache.get_info(uri))
+            cache.store_info(uri, info)
+            cache.flush()
+
+            cache = DiscoveryCache(os.path.join(tmpdir, "discovery.db"))
+            cached_info = cache.get_info(uri)
+            self.assertEqual(cached_info.get_duration(), info.get_duration())
+            self.assertEqual(len(cached_info.get_stream_list()),
+                             len(info.get_stream_list()))
+
+            # Modifying the file invalidates the cached info.
+            path = Gst.uri_get_location(uri)
+            stat = os.stat(path)
+            os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+            self.assertIsNone(cache.get_info(uri))
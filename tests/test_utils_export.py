@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+# Pitivi video editor
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this program; if not, write to the
+# Free Software Foundation, Inc., 51 Franklin St, Fifth Floor,
+# Boston, MA 02110-1301, USA.
+"""Tests for the utils.export module."""
+# pylint: disable=protected-access
+import os
+import tarfile
+import tempfile
+from unittest import mock
+
+from pitivi.utils.export import consolidate_project
+from pitivi.utils.export import MediaCut
+from pitivi.utils.export import ProjectExporter
+from pitivi.utils.export import rewrite_project_uris
+from tests import common
+
+
+PROJECT = b"""<?xml version='1.0' encoding='UTF-8'?>
+<ges version='0.4'>
+  <project properties='properties;' metadatas='metadatas;'>
+    <ressources>
+      <asset id='file:///a.mov' extractable-type-name='GESUriClip' proxy-id='file:///a.mov.1.proxy.mkv'/>
+      <asset id='file:///a.mov.1.proxy.mkv' extractable-type-name='GESUriClip'/>
+      <asset id='file:///b.mov' extractable-type-name='GESUriClip'/>
+    </ressources>
+    <timeline>
+      <layer priority='0'>
+        <clip id='0' asset-id='file:///a.mov' type-name='GESUriClip' layer-priority='0' track-types='6' start='0' duration='1' inpoint='0' rate='0'/>
+        <clip id='1' asset-id='file:///b.mov' type-name='GESUriClip' layer-priority='0' track-types='6' start='1' duration='1' inpoint='0' rate='0'/>
+      </layer>
+    </timeline>
+  </project>
+</ges>
+"""
+
+
+class TestRewriteProjectUris(common.TestCase):
+    """Tests for the rewrite_project_uris function."""
+
+    def test_rewrite(self):
+        content = rewrite_project_uris(PROJECT, {
+            "file:///a.mov": "file:///a.mov.1.proxy.mkv",
+            "file:///b.mov": "file:///export/b.mov"})
+        content = content.decode()
+
+        self.assertNotIn("'file:///a.mov'", content)
+        self.assertNotIn("\"file:///a.mov\"", content)
+        self.assertNotIn("proxy-id", content)
+        self.assertEqual(content.count("file:///a.mov.1.proxy.mkv"), 2)
+        self.assertNotIn("file:///b.mov", content)
+        self.assertEqual(content.count("file:///export/b.mov"), 2)
+
+
+class TestConsolidateProject(common.TestCase):
+    """Tests for the consolidate_project function."""
+
+    def test_consolidate(self):
+        project = PROJECT.replace(
+            b"inpoint='0' rate='0'/>",
+            b"inpoint='100' rate='0'>"
+            b"<source track-id='0' children-properties='properties;'>"
+            b"<binding type='direct' source_type='interpolation' property='alpha'"
+            b" mode='1' track_id='0' values=' 50:0.5  100:1  200:0 '/>"
+            b"</source>"
+            b"<effect asset-id='agingtv' clip-id='0' type-name='GESEffect'"
+            b" track-type='4' track-id='0' properties='properties;'"
+            b" metadatas='metadatas;' children-properties='properties;'>"
+            b"<binding type='direct' source_type='interpolation' property='scratch-lines'"
+            b" mode='1' track_id='0' values=' 0:1  50:2 '/>"
+            b"</effect></clip>", 1)
+        cut_a1 = MediaCut("file:///a.mov", 0, 50, "file:///a.0-50.mkv",
+                          "top/a.0-50.mkv", "top/a.mov", 10)
+        cut_a2 = MediaCut("file:///a.mov", 80, 300, "file:///a.80-300.mkv",
+                          "top/a.80-300.mkv", "top/a.mov", 10)
+        cut_b = MediaCut("file:///b.mov", 0, 10, "file:///b.0-10.mkv",
+                         "top/b.0-10.mkv", "top/b.mov", 10)
+        for cut in (cut_a1, cut_a2):
+            cut.path = cut.arcname
+        cut_a2.actual_start = 60
+        targets = {"file:///a.mov": "file:///a.mov",
+                   "file:///a.mov.1.proxy.mkv": "file:///a.mov",
+                   "file:///b.mov": "file:///b.mov"}
+
+        content = consolidate_project(project, [cut_a1, cut_a2, cut_b], targets)
+        content = content.decode()
+
+        self.assertNotIn("proxy", content)
+        self.assertNotIn("'file:///a.mov'", content)
+        self.assertNotIn("\"file:///a.mov\"", content)
+        # The unused cut is still an asset, for the other clips.
+        self.assertEqual(content.count("file:///a.0-50.mkv"), 1)
+        self.assertEqual(content.count("file:///a.80-300.mkv"), 2)
+        self.assertIn("inpoint=\"40\"", content)
+        self.assertIn("values=\" 40:1  140:0 \"", content)
+        # The keyframes of the effect are relative to the clip.
+        self.assertIn("values=\" 0:1  50:2 \"", content)
+        # The range of b.mov could not be copied.
+        self.assertNotIn("b.0-10.mkv", content)
+        self.assertEqual(content.count("file:///b.mov"), 2)
+
+    def test_consolidate_whole_files(self):
+        """Checks the media files without cuts are kept as they are."""
+        targets = {"file:///a.mov": "file:///a.mov",
+                   "file:///a.mov.1.proxy.mkv": "file:///a.mov",
+                   "file:///b.mov": "file:///b.mov"}
+
+        content = consolidate_project(PROJECT, [], targets).decode()
+
+        self.assertNotIn("proxy", content)
+        self.assertEqual(content.count("file:///a.mov"), 2)
+        self.assertEqual(content.count("file:///b.mov"), 2)
+
+
+class TestProjectExporter(common.TestCase):
+    """Tests for the ProjectExporter class."""
+
+    def test_duplicates(self):
+        """Checks a media file included several times is stored once."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            def create_file(name, content):
+                path = os.path.join(tmpdir, name)
+                with open(path, "wb") as media:
+                    media.write(content)
+                return path
+
+            a = create_file("a.mov", b"a" * 1000)
+            a_copy = create_file("a copy.mov", b"a" * 1000)
+            b = create_file("b.mov", b"b" * 1000)
+            a_link = os.path.join(tmpdir, "a link.mov")
+            os.symlink(a, a_link)
+
+            path = os.path.join(tmpdir, "project.xges_tar")
+            sources = [(a, "top/a.mov"),
+                       (a_copy, "top/a copy.mov"),
+                       (b, "top/b.mov"),
+                       (a_link, "top/a link.mov")]
+            exporter = ProjectExporter(path, "top/project.xges", PROJECT, sources)
+            with mock.patch("pitivi.utils.export.GLib") as glib:
+                exporter.process()
+            self.assertIsNone(exporter.failure)
+            self.assertEqual(exporter._done, exporter._total)
+            glib.idle_add.assert_called()
+
+            with tarfile.open(path) as tar:
+                members = {member.name: member for member in tar.getmembers()}
+                self.assertEqual(tar.extractfile("top/project.xges").read(), PROJECT)
+                self.assertTrue(members["top/a.mov"].isfile())
+                self.assertTrue(members["top/b.mov"].isfile())
+                for name in ("top/a copy.mov", "top/a link.mov"):
+                    self.assertTrue(members[name].islnk())
+                    self.assertEqual(members[name].linkname, "top/a.mov")
+                    self.assertEqual(tar.extractfile(name).read(), b"a" * 1000)
+
+    def test_abort(self):
+        """Checks the archive is removed when the export is aborted."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            media_path = os.path.join(tmpdir, "a.mov")
+            with open(media_path, "wb") as media:
+                media.write(b"a" * 1000)
+
+            path = os.path.join(tmpdir, "project.xges_tar")
+            exporter = ProjectExporter(path, "project.xges", PROJECT,
+                                       [(media_path, "a.mov")])
+            exporter.abort()
+            with mock.patch("pitivi.utils.export.GLib"):
+                exporter.process()
+            self.assertIsNone(exporter.failure)
+            self.assertFalse(os.path.exists(path))
@@ -0,0 +1,358 @@
+# -*- coding: utf-8 -*-
+# Pitivi video editor
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this program; if not, write to the
+# Free Software Foundation, Inc., 51 Franklin St, Fifth Floor,
+# Boston, MA 02110-1301, USA.
+"""Tests for the utils.proxy module."""
+# pylint: disable=protected-access
+import os
+import tempfile
+from unittest import mock
+
+from gi.repository import Gst
+from gi.repository import GstPbutils
+
+from pitivi.utils.proxy import ChunkedTranscoder
+from pitivi.utils.proxy import ChunksManifest
+from pitivi.utils.proxy import PROXY_PRIORITY_LIBRARY
+from pitivi.utils.proxy import PROXY_PRIORITY_PLAYHEAD
+from pitivi.utils.proxy import PROXY_PRIORITY_TIMELINE
+from pitivi.utils.proxy import ProxyIndex
+from pitivi.utils.proxy import ProxyIndexEntry
+from pitivi.utils.proxy import ProxyJob
+from pitivi.utils.proxy import ProxyManager
+from pitivi.utils.proxy import ProxyScheduler
+from pitivi.utils.proxy import ProxyTier
+from pitivi.utils.proxy import ProxyTierSwitcher
+from tests import common
+
+
+def create_job(uri, priority=PROXY_PRIORITY_LIBRARY):
+    asset = mock.Mock()
+    asset.props.id = uri
+    return ProxyJob(asset, mock.Mock(), priority)
+
+
+def create_stream(media_type, stream_class=GstPbutils.DiscovererStreamInfo):
+    structure = mock.Mock()
+    structure.get_name.return_value = media_type
+    caps = mock.Mock()
+    caps.get_size.return_value = 1
+    caps.get_structure.return_value = structure
+    stream = mock.Mock()
+    stream.get_caps.return_value = caps
+    stream.__class__ = stream_class
+    return stream
+
+
+def create_info(container, audios, videos):
+    info = mock.Mock()
+    if container:
+        info.get_stream_info.return_value = create_stream(
+            container, GstPbutils.DiscovererContainerInfo)
+    else:
+        info.get_stream_info.return_value = create_stream(audios[0])
+    info.get_audio_streams.return_value = [create_stream(audio) for audio in audios]
+    info.get_video_streams.return_value = [create_stream(video) for video in videos]
+    return info
+
+
+class TestProxyManager(common.TestCase):
+    """Tests for the `ProxyManager` class."""
+
+    def test_format_well_supported(self):
+        """Checks the whitelisted formats are recognized."""
+        def check(expected, container, audios, videos):
+            info = create_info(container, audios, videos)
+            self.assertEqual(ProxyManager._isFormatWellSupported(info), expected,
+                             (container, audios, videos))
+
+        check(True, None, ["audio/mpeg"], [])
+        check(False, None, ["audio/x-aac"], [])
+        check(True, "video/quicktime", ["audio/mpeg"], ["video/x-h264"])
+        check(True, "video/webm", [], ["video/x-vp8"])
+        check(True, "application/ogg", ["audio/x-vorbis"], [])
+        check(True, "video/x-matroska", ["audio/x-flac", "audio/x-flac"],
+              ["video/x-raw"])
+        check(False, "video/x-msvideo", ["audio/mpeg"], ["video/x-h264"])
+        check(False, "video/quicktime", ["audio/mpeg"], ["video/x-h265"])
+        # The streams of a kind are encoded in a single format.
+        check(False, "video/x-matroska", ["audio/mpeg", "audio/x-vorbis"],
+              ["video/x-vp8"])
+
+
+class TestProxyScheduler(common.TestCase):
+    """Tests for the `ProxyScheduler` class."""
+
+    def running(self, scheduler):
+        return sorted(job.uri for job in scheduler._running)
+
+    def test_priorities(self):
+        """Checks the most important jobs are run first."""
+        scheduler = ProxyScheduler(max_jobs=2, max_cpu_usage=80)
+        scheduler.concurrency = 2
+        for uri in "abcd":
+            scheduler.add(create_job(uri))
+        self.assertEqual(self.running(scheduler), ["a", "b"])
+        self.assertIs(scheduler.get("c").started, False)
+
+        scheduler.reprioritize(
+            lambda job: {"c": PROXY_PRIORITY_PLAYHEAD,
+                         "d": PROXY_PRIORITY_TIMELINE}.get(job.uri, job.priority))
+        self.assertEqual(self.running(scheduler), ["c", "d"])
+        # The preempted jobs are paused.
+        self.assertTrue(scheduler.get("a").paused)
+        self.assertTrue(scheduler.get("b").paused)
+
+        scheduler.done("c")
+        self.assertIsNone(scheduler.get("c"))
+        self.assertEqual(len(self.running(scheduler)), 2)
+        self.assertIn("d", self.running(scheduler))
+
+    def test_hold(self):
+        """Checks the paused jobs are not run until resumed."""
+        scheduler = ProxyScheduler(max_jobs=1, max_cpu_usage=80)
+        scheduler.add(create_job("a"))
+        scheduler.add(create_job("b"))
+
+        scheduler.hold("a")
+        self.assertTrue(scheduler.get("a").paused)
+        self.assertEqual(self.running(scheduler), ["b"])
+
+        scheduler.release("a")
+        scheduler.done("b")
+        self.assertEqual(self.running(scheduler), ["a"])
+        self.assertFalse(scheduler.get("a").paused)
+
+        self.assertIsNotNone(scheduler.remove("a"))
+        self.assertEqual(self.running(scheduler), [])
+        self.assertIsNone(scheduler.remove("a"))
+
+    def test_adapt(self):
+        """Checks more jobs are run only while it helps."""
+        scheduler = ProxyScheduler(max_jobs=4, max_cpu_usage=80)
+        for uri in "abcde":
+            scheduler.add(create_job(uri))
+        self.assertEqual(len(scheduler._running), 1)
+
+        scheduler.adapt(cpu_usage=20, throughput=1.0)
+        self.assertEqual(scheduler.concurrency, 2)
+        self.assertEqual(len(scheduler._running), 2)
+
+        scheduler.adapt(cpu_usage=40, throughput=1.9)
+        self.assertEqual(scheduler.concurrency, 3)
+
+        # Not worth it.
+        scheduler.adapt(cpu_usage=50, throughput=2.0)
+        self.assertEqual(scheduler.concurrency, 2)
+        self.assertEqual(len(scheduler._running), 2)
+
+        scheduler.adapt(cpu_usage=40, throughput=1.9)
+        self.assertEqual(scheduler.concurrency, 2)
+
+        # Overloaded.
+        scheduler.adapt(cpu_usage=90, throughput=1.9)
+        self.assertEqual(scheduler.concurrency, 1)
+        self.assertEqual(len(scheduler._running), 1)
+
+
+class TestChunksManifest(common.TestCase):
+    """Tests for the `ChunksManifest` class."""
+
+    def test_load(self):
+        """Checks the chunks are kept only for the same transcoding."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "proxy.manifest")
+            manifest = ChunksManifest(path, {"duration": 10})
+            manifest.load()
+            self.assertEqual(manifest.chunks, set())
+
+            manifest.add(0)
+            manifest.add(2)
+            manifest = ChunksManifest(path, {"duration": 10})
+            manifest.load()
+            self.assertEqual(manifest.chunks, {0, 2})
+
+            manifest = ChunksManifest(path, {"duration": 20})
+            manifest.load()
+            self.assertEqual(manifest.chunks, set())
+
+            manifest.remove()
+            self.assertFalse(os.path.exists(path))
+
+
+class TestChunkedTranscoder(common.TestCase):
+    """Tests for the `ChunkedTranscoder` class."""
+
+    def test_resume(self):
+        """Checks only the missing chunks are transcoded."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            dest_uri = Gst.filename_to_uri(os.path.join(tmpdir, "a.proxy.mkv.part"))
+            transcoder = ChunkedTranscoder("file:///a", dest_uri, None,
+                                           duration=35, params={},
+                                           max_chunks=2, chunk_duration=10)
+            # Chunk 1 has been transcoded before.
+            with open(transcoder.chunk_path(1), "w"):
+                pass
+            transcoder._manifest.add(1)
+
+            with mock.patch("pitivi.utils.proxy.ProxyChunk") as chunk_class, \
+                    mock.patch("pitivi.utils.proxy.GLib"):
+                chunk_class.side_effect = \
+                    lambda unused_transcoder, index, *args: mock.Mock(index=index)
+                transcoder.run_async()
+                self.assertEqual([call[0][1:4] for call in chunk_class.call_args_list],
+                                 [(0, 0, 10), (2, 20, 30)])
+
+                chunk_class.reset_mock()
+                transcoder.chunk_done(transcoder._running[0])
+                self.assertEqual([call[0][1:4] for call in chunk_class.call_args_list],
+                                 [(3, 30, 35)])
+                self.assertEqual(transcoder._manifest.chunks, {0, 1})
+
+    def test_pause(self):
+        """Checks the chunks are resumed only by the transcoder."""
+        transcoder = ChunkedTranscoder("file:///a", "file:///a.proxy.mkv.part", None,
+                                       duration=35, params={},
+                                       max_chunks=2, chunk_duration=10)
+        with mock.patch("pitivi.utils.proxy.ProxyChunk") as chunk_class, \
+                mock.patch("pitivi.utils.proxy.GLib"):
+            chunk_class.side_effect = \
+                lambda unused_transcoder, index, *args: mock.Mock(index=index)
+            transcoder.run_async()
+            transcoder.pause()
+            transcoder.resume()
+            for chunk in transcoder._running:
+                chunk.resume.assert_called_once_with()
+                chunk.pipeline.set_state.assert_called_once_with(Gst.State.PAUSED)
+
+    def test_concatenated_chunks(self):
+        """Checks the chunks are listed explicitly when concatenating."""
+        dest_uri = Gst.filename_to_uri("/tmp/[a]*?.proxy.mkv.part")
+        transcoder = ChunkedTranscoder("file:///a", dest_uri, None,
+                                       duration=35, params={},
+                                       max_chunks=2, chunk_duration=10)
+        self.assertEqual(transcoder._ChunkedTranscoder__format_location_cb(None),
+                         [transcoder.chunk_path(index) for index in range(4)])
+
+    def test_stop_concatenating(self):
+        """Checks the concatenation pipeline is released when stopping."""
+        transcoder = ChunkedTranscoder("file:///a", "file:///a.proxy.mkv.part", None,
+                                       duration=35, params={},
+                                       max_chunks=2, chunk_duration=10)
+        pipeline = mock.Mock()
+        transcoder._concat_pipeline = pipeline
+        transcoder.stop()
+        bus = pipeline.get_bus.return_value
+        bus.remove_signal_watch.assert_called_once_with()
+        bus.disconnect_by_func.assert_called_once_with(
+            transcoder._ChunkedTranscoder__concat_bus_message_cb)
+        pipeline.set_state.assert_called_once_with(Gst.State.NULL)
+        self.assertIsNone(transcoder._concat_pipeline)
+
+
+class TestProxyIndex(common.TestCase):
+    """Tests for the `ProxyIndex` class."""
+
+    def test_lookup(self):
+        """Checks the proxies are found only while the asset is unchanged."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "asset.mov")
+            with open(path, "wb") as asset_file:
+                asset_file.write(b"1234")
+            uri = Gst.filename_to_uri(path)
+            index = ProxyIndex(os.path.join(tmpdir, "proxies.db"))
+
+            key = ProxyIndex.get_key(uri)
+            self.assertIsNone(index.lookup(key))
+            entry = ProxyIndexEntry(uri + ".4.proxy.mkv", 100, "target.gep",
+                                    Gst.SECOND, Gst.SECOND,
+                                    ["video/x-h264"], ["image/jpeg"])
+            index.put(key, entry)
+
+            entry = ProxyIndex(index.dbfile).lookup(ProxyIndex.get_key(uri))
+            self.assertEqual(entry.proxy_uri, uri + ".4.proxy.mkv")
+            self.assertEqual(entry.proxy_size, 100)
+            self.assertEqual(entry.encoding_target, "target.gep")
+            self.assertEqual(entry.duration, Gst.SECOND)
+            self.assertEqual(entry.caps, ["video/x-h264"])
+            self.assertEqual(entry.proxy_caps, ["image/jpeg"])
+
+            with open(path, "wb") as asset_file:
+                asset_file.write(b"12345")
+            self.assertIsNone(index.lookup(ProxyIndex.get_key(uri)))
+
+            index.remove(key)
+            self.assertIsNone(index.lookup(key))
+            os.remove(path)
+            self.assertIsNone(ProxyIndex.get_key(uri))
+
+
+class TestProxyTierSwitcher(common.TestCase):
+    """Tests for the `ProxyTierSwitcher` class."""
+
+    def test_measure(self):
+        """Checks faster assets are played while dropping frames."""
+        ges_timeline = mock.Mock()
+        ges_timeline.get_layers.return_value = []
+        pipeline = mock.Mock()
+        switcher = ProxyTierSwitcher(mock.Mock(), pipeline, ges_timeline)
+        sink = mock.Mock()
+
+        self.assertIsNone(switcher.measure(100))
+        switcher._qos_cb(pipeline, sink, 90, 10)
+        self.assertIsNone(switcher.measure(101))
+        self.assertEqual(switcher.measure(103), 0.1)
+        self.assertEqual(switcher.tier, ProxyTier.PROXY)
+        pipeline.commit_timeline.assert_called_once_with()
+
+        # The counters have been reset by a flush.
+        switcher._qos_cb(pipeline, sink, 50, 50)
+        self.assertEqual(switcher.measure(106), 0.5)
+        self.assertEqual(switcher.tier, ProxyTier.SCALED)
+        switcher._qos_cb(pipeline, sink, 90, 60)
+        self.assertEqual(switcher.measure(109), 0.2)
+        self.assertEqual(switcher.tier, ProxyTier.SCALED)
+
+        # Smooth, but not long enough.
+        self.assertEqual(switcher.measure(112), 0)
+        self.assertEqual(switcher.tier, ProxyTier.SCALED)
+        self.assertEqual(switcher.measure(140), 0)
+        self.assertEqual(switcher.tier, ProxyTier.PROXY)
+
+        switcher.restore()
+        self.assertEqual(switcher.tier, ProxyTier.DEFAULT)
+
+    def test_suspended(self):
+        """Checks the tier is not switched while recording an operation."""
+        app = mock.Mock()
+        app.action_log.is_in_transaction.return_value = True
+        pipeline = mock.Mock()
+        pipeline.getState.return_value = Gst.State.PLAYING
+        pipeline.is_rendering.return_value = False
+        switcher = ProxyTierSwitcher(app, pipeline, mock.Mock())
+        with mock.patch.object(switcher, "measure") as measure:
+            switcher._position_cb(pipeline, 0)
+            measure.assert_not_called()
+
+            app.action_log.is_in_transaction.return_value = False
+            with switcher.default_assets():
+                switcher._position_cb(pipeline, 0)
+            measure.assert_not_called()
+            # The assets are not switched when already the default ones.
+            pipeline.commit_timeline.assert_not_called()
+
+            switcher._position_cb(pipeline, 0)
+            measure.assert_called_once()